@@ -1,7 +1,8 @@
-from typing import Any, List, Optional
+import logging
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk, SystemMessage
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
 
 try:
     from google import genai
@@ -9,6 +10,8 @@ try:
 except ImportError:
     raise ImportError("Please install google-genai package: pip install google-genai")
 
+logger = logging.getLogger(__name__)
+
 class CustomGeminiAdapter(BaseChatModel):
     client: Any = None
     model_name: str
@@ -24,40 +27,92 @@ class CustomGeminiAdapter(BaseChatModel):
     def _llm_type(self) -> str:
         return "google-genai-custom"
 
-    def _generate(
+    def create_context_cache(self, system_instruction: str, ttl: str = "3600s") -> Optional[str]:
+        """
+        Stores a stable prompt prefix in Gemini's server-side context cache.
+        Returns the cache handle, or None if the cache could not be created
+        (e.g. the prefix is below the model's minimum cacheable size).
+        """
+        try:
+            cache = self.client.caches.create(
+                model=self.model_name,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    ttl=ttl
+                )
+            )
+            return cache.name
+        except Exception as e:
+            logger.warning(f"Could not create Gemini context cache: {e}")
+            return None
+
+    def delete_context_cache(self, name: str) -> None:
+        """Deletes a context cache created by create_context_cache (best effort)."""
+        try:
+            self.client.caches.delete(name=name)
+        except Exception as e:
+            logger.warning(f"Could not delete Gemini context cache {name}: {e}")
+
+    def _prepare_request(
         self,
         messages: List[BaseMessage],
         stop: Optional[List[str]] = None,
-        run_manager: Any = None,
         **kwargs: Any,
-    ) -> ChatResult:
+    ) -> Tuple[str, "types.GenerateContentConfig"]:
         
         # Convert LangChain messages to Google GenAI format
         # This is a simplified converter
-        prompt_text = ""
         system_instruction = None
-        
-        for msg in messages:
-            if isinstance(msg, SystemMessage):
-                system_instruction = msg.content
-            elif isinstance(msg, HumanMessage):
-                prompt_text += f"\nUser: {msg.content}"
-            elif isinstance(msg, AIMessage):
-                prompt_text += f"\nModel: {msg.content}"
-            else:
-                prompt_text += f"\n{msg.content}"
-
-        config = types.GenerateContentConfig(
-            temperature=self.temperature,
-            candidate_count=1,
-            stop_sequences=stop,
-            system_instruction=system_instruction
-        )
+
+        # Fast path: a single prompt (router, SQL, answer and chat calls)
+        if len(messages) == 1 and type(messages[0]) is HumanMessage:
+            prompt_text = "User: " + messages[0].content
+        else:
+            parts: List[str] = []
+            for msg in messages:
+                t = type(msg)
+                if t is SystemMessage:
+                    system_instruction = msg.content
+                elif t is HumanMessage:
+                    parts.append("User: " + msg.content)
+                elif t is AIMessage:
+                    parts.append("Model: " + msg.content)
+                else:
+                    parts.append(msg.content)
+            prompt_text = "\n".join(parts)
+
+        # A cached prefix already carries the system instruction
+        cached_content = kwargs.get("cached_content")
+        if cached_content:
+            config = types.GenerateContentConfig(
+                temperature=self.temperature,
+                candidate_count=1,
+                stop_sequences=stop,
+                cached_content=cached_content
+            )
+        else:
+            config = types.GenerateContentConfig(
+                temperature=self.temperature,
+                candidate_count=1,
+                stop_sequences=stop,
+                system_instruction=system_instruction
+            )
+
+        return prompt_text.strip(), config
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        prompt_text, config = self._prepare_request(messages, stop, **kwargs)
         
         try:
             response = self.client.models.generate_content(
                 model=self.model_name,
-                contents=prompt_text.strip(),
+                contents=prompt_text,
                 config=config
             )
             
@@ -71,3 +126,72 @@ class CustomGeminiAdapter(BaseChatModel):
             return ChatResult(
                 generations=[ChatGeneration(message=AIMessage(content=f"Error: {str(e)}"))]
             )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        prompt_text, config = self._prepare_request(messages, stop, **kwargs)
+
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=self.model_name,
+                contents=prompt_text,
+                config=config
+            ):
+                if chunk.text:
+                    yield ChatGenerationChunk(message=AIMessageChunk(content=chunk.text))
+        except Exception as e:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"Error: {str(e)}"))
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Native async call: avoids LangChain's default thread-pool dispatch of _generate
+        prompt_text, config = self._prepare_request(messages, stop, **kwargs)
+
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name,
+                contents=prompt_text,
+                config=config
+            )
+
+            return ChatResult(
+                generations=[ChatGeneration(message=AIMessage(content=response.text))]
+            )
+        except Exception as e:
+            # Propagated (unlike _generate) so the service reports the error instead
+            # of caching it as if it were a real answer
+            logger.error(f"Gemini generate_content failed: {e}")
+            raise
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        prompt_text, config = self._prepare_request(messages, stop, **kwargs)
+
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=self.model_name,
+                contents=prompt_text,
+                config=config
+            )
+            async for chunk in stream:
+                if chunk.text:
+                    yield ChatGenerationChunk(message=AIMessageChunk(content=chunk.text))
+        except Exception as e:
+            # Propagated for the same reason as in _agenerate
+            logger.error(f"Gemini generate_content_stream failed: {e}")
+            raise
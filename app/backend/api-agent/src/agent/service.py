@@ -1,10 +1,14 @@
+import asyncio
+import hashlib
 import logging
 import re
-from operator import itemgetter
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import AsyncIterator
 
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnableParallel, RunnableLambda
+from langchain_community.utilities import SQLDatabase
 
 from agent.gemini_adapter import CustomGeminiAdapter
 from config.settings import get_settings
@@ -15,73 +19,26 @@ logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
+# Patrones para limpiar la salida SQL del LLM (compilados una sola vez)
+_SQL_FENCE_RE = re.compile(r"```sql\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+_FENCE_RE = re.compile(r"```\s*(.*?)\s*```", re.DOTALL)
+_SELECT_RE = re.compile(r"(SELECT\s.*)", re.DOTALL | re.IGNORECASE)
 
-class AgentService:
-    """
-    Servicio de agente conversacional que permite consultas en lenguaje natural
-    a la base de datos PostgreSQL usando Google Gemini API.
-    """
-    
-    def __init__(self):
-        try:
-            logger.info("Initializing AgentService...")
-            self.db = get_db()
-            logger.info("Database connected successfully.")
-            
-            target_model = settings.MODEL_NAME
-            logger.info(f"Using Google GenAI SDK (Custom Adapter): {target_model}")
-            self.llm = CustomGeminiAdapter(
-                api_key=settings.GOOGLE_API_KEY,
-                model_name=target_model,
-                temperature=0
-            )
-            
-            logger.info("LLM initialized.")
-            self.sql_chain = self._build_chain()
-            logger.info("Chain built successfully.")
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            raise e
+# --- PROMPTS ---
+# The router/SQL templates are split into a static prefix (schema + instructions,
+# eligible for Gemini context caching) and a per-question tail.
 
-    def _build_chain(self):
-        """
-        Constructs a multipurpose chain that routes between:
-        1. SQL Database Query (for data questions)
-        2. General Chat (for greetings/other questions)
-        """
-        try:
-            logger.info("Beginning _build_chain (Multipurpose)...")
-            
-            # --- ROUTER COMPONENT ---
-            router_template = """Given the user question below, classify it into one of two categories:
+ROUTER_PREFIX_TEMPLATE = """Given the user question below, classify it into one of two categories:
 1. "SQL": If the question requires looking up data in the database tables: {table_names}.
 2. "CHAT": If the question is a general greeting, a question about usage, or does not require database access.
 
 Do not generate code. Return ONLY the word "SQL" or "CHAT".
 
-Question: {question}
+"""
+ROUTER_QUESTION_TEMPLATE = """Question: {question}
 Classification:"""
-            
-            def get_table_names(_):
-                return ", ".join(self.db.get_usable_table_names())
-
-            router_prompt = PromptTemplate.from_template(router_template)
-            
-            router_chain = (
-                RunnableParallel({
-                    "question": itemgetter("question"),
-                    "table_names": RunnableLambda(get_table_names)
-                })
-                | router_prompt
-                | self.llm
-                | StrOutputParser()
-                | RunnableLambda(lambda x: x.strip().upper())
-            )
 
-            # --- BRANCH 1: SQL QUERY CHAIN (EXISTING LOGIC) ---
-            
-            sql_template = """You are a Postgres expert assisting a Chilean Customs Agency (Agencia de Aduanas en Chile).
+SQL_PREFIX_TEMPLATE = """You are a Postgres expert assisting a Chilean Customs Agency (Agencia de Aduanas en Chile).
 Given an input question, create a syntactically correct Postgres SQL query to run.
 Unless the user specifies in the question a specific number of examples to obtain, query for at most 5 results using the LIMIT clause as per Postgres.
 You can order the results to return the most informative data in the database.
@@ -98,51 +55,11 @@ IMPORTANT:
 Only use the following tables:
 {table_info}
 
-Question: {question}
+"""
+SQL_QUESTION_TEMPLATE = """Question: {question}
 SQL Query:"""
-            
-            sql_prompt = PromptTemplate.from_template(sql_template)
-            
-            def get_schema(_):
-                return self.db.get_table_info()
-
-            generate_sql_chain = (
-                RunnableParallel({
-                    "question": itemgetter("question"),
-                    "table_info": RunnableLambda(get_schema)
-                })
-                | sql_prompt
-                | self.llm
-                | StrOutputParser()
-            )
-            
-            def run_query(q):
-                logger.debug(f"Executing query: {q}")
-                return self.db.run(q)
-            
-            def execute_sql_step_func(inputs):
-                q = inputs["query"]
-                logger.debug(f"Raw LLM output: {q}")
-                match = re.search(r"```sql\s*(.*?)\s*```", q, re.DOTALL | re.IGNORECASE)
-                if match: q = match.group(1).strip()
-                else:
-                    match = re.search(r"```\s*(.*?)\s*```", q, re.DOTALL)
-                    if match: q = match.group(1).strip()
-                    else: q = q.replace("```sql", "").replace("```", "").strip()
-                
-                select_match = re.search(r"(SELECT\s.*)", q, re.DOTALL | re.IGNORECASE)
-                if select_match: q = select_match.group(1).strip()
-                    
-                logger.debug(f"Cleaned SQL query: {q}")
-                
-                return {
-                    "question": inputs["question"],
-                    "query": q,
-                    "result": run_query(q)
-                }
-            
-            sql_answer_prompt = PromptTemplate.from_template(
-                """Given the following user question, corresponding SQL query, and SQL result, answer the user question.
+
+SQL_ANSWER_TEMPLATE = """Given the following user question, corresponding SQL query, and SQL result, answer the user question.
 You are an expert assistant for a Customs Agency in Chile.
 IMPORTANT: Answer in SPANISH.
 Provide a direct and professional answer based ONLY on the result.
@@ -153,19 +70,8 @@ Question: {question}
 SQL Query: {query}
 SQL Result: {result}
 Answer: """
-            )
-
-            sql_full_chain = (
-                RunnableParallel({"question": itemgetter("question"), "query": generate_sql_chain})
-                | RunnableLambda(execute_sql_step_func)
-                | sql_answer_prompt
-                | self.llm
-                | StrOutputParser()
-            )
 
-            # --- BRANCH 2: GENERAL CHAT CHAIN ---
-            
-            chat_template = """You are a helpful AI assistant for a Customs Agency in Chile (Agencia de Aduanas).
+CHAT_TEMPLATE = """You are a helpful AI assistant for a Customs Agency in Chile (Agencia de Aduanas).
 Answer the user's question politely and concisely in SPANISH.
 If they ask for data you don't have access to, explain that you can only query the 'despachos' and 'documentos' database.
 
@@ -177,50 +83,335 @@ IMPORTANT DOMAIN KNOWLEDGE:
 
 Question: {question}
 Answer:"""
-            
-            chat_prompt = PromptTemplate.from_template(chat_template)
-            
-            chat_chain = (
-                chat_prompt
-                | self.llm
-                | StrOutputParser()
-            )
 
-            # --- MAIN ROUTING LOGIC ---
+# Renderers bound once at import; each request only pays the format call
+_render_router_prefix = ROUTER_PREFIX_TEMPLATE.format
+_render_router_question = ROUTER_QUESTION_TEMPLATE.format
+_render_sql_prefix = SQL_PREFIX_TEMPLATE.format
+_render_sql_question = SQL_QUESTION_TEMPLATE.format
+_render_sql_answer = SQL_ANSWER_TEMPLATE.format
+_render_chat = CHAT_TEMPLATE.format
+
+
+@lru_cache(maxsize=1)
+def _table_names_cached(db: SQLDatabase, bucket: int) -> str:
+    return ", ".join(db.get_usable_table_names())
+
+
+@lru_cache(maxsize=1)
+def _schema_cached(db: SQLDatabase, bucket: int) -> str:
+    return db.get_table_info()
+
+
+@lru_cache(maxsize=1)
+def _router_prefix_cached(db: SQLDatabase, bucket: int) -> str:
+    return _render_router_prefix(table_names=_table_names_cached(db, bucket))
+
+
+@lru_cache(maxsize=1)
+def _sql_prefix_cached(db: SQLDatabase, bucket: int) -> str:
+    return _render_sql_prefix(table_info=_schema_cached(db, bucket))
+
+
+# Rough size estimate used to skip prefixes below Gemini's minimum cacheable size
+_CHARS_PER_TOKEN = 4
+# Time in-flight requests get to finish with a superseded context cache before it is deleted
+_CACHE_DELETE_GRACE_SECONDS = 120
+
+
+def _schema_ttl_bucket() -> int:
+    """Changes every SCHEMA_CACHE_TTL_SECONDS, expiring the schema caches above."""
+    return int(time.monotonic() // settings.SCHEMA_CACHE_TTL_SECONDS)
+
+
+def invalidate_schema_cache() -> None:
+    """Forces the next request to re-read the database schema."""
+    _table_names_cached.cache_clear()
+    _schema_cached.cache_clear()
+    _router_prefix_cached.cache_clear()
+    _sql_prefix_cached.cache_clear()
+    # The Gemini context caches are re-checked too; they are only recreated if the
+    # re-read schema actually renders different prefixes
+    if _service is not None:
+        _service.recheck_prompt_caches()
+
+
+def _discard_task(task: asyncio.Task) -> None:
+    """
+    Cancels a task whose result is no longer needed. If it already finished with an
+    error, the exception is retrieved so asyncio does not log it as never retrieved.
+    """
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def _clean_sql_query(q: str) -> str:
+    """Extracts the bare SELECT statement from the raw LLM output."""
+    # Fast path: the prompt asks for a bare SELECT, so fences are rare
+    if "```" in q:
+        match = _SQL_FENCE_RE.search(q)
+        if match: q = match.group(1).strip()
+        else:
+            match = _FENCE_RE.search(q)
+            if match: q = match.group(1).strip()
+            else: q = q.replace("```sql", "").replace("```", "").strip()
+    else:
+        q = q.strip()
+
+    select_match = _SELECT_RE.search(q)
+    if select_match: q = select_match.group(1).strip()
+    return q
+
+
+class AgentService:
+    """
+    Servicio de agente conversacional que permite consultas en lenguaje natural
+    a la base de datos PostgreSQL usando Google Gemini API.
+    """
+    
+    def __init__(self):
+        try:
+            logger.info("Initializing AgentService...")
+            self.db = get_db()
+            logger.info("Database connected successfully.")
             
-            def route(info):
-                intent = info["intent"]
-                if "SQL" in intent:
-                    return sql_full_chain
-                else:
-                    return chat_chain
-
-            full_chain = (
-                RunnableParallel({
-                    "question": itemgetter("question"),
-                    "intent": router_chain
-                })
-                | RunnableLambda(route)
+            target_model = settings.MODEL_NAME
+            logger.info(f"Using Google GenAI SDK (Custom Adapter): {target_model}")
+            self.llm = CustomGeminiAdapter(
+                api_key=settings.GOOGLE_API_KEY,
+                model_name=target_model,
+                temperature=0
+            )
+            # The router only emits "SQL" or "CHAT": a smaller model is enough
+            logger.info(f"Router model: {settings.ROUTER_MODEL_NAME}")
+            self.router_llm = CustomGeminiAdapter(
+                api_key=settings.GOOGLE_API_KEY,
+                model_name=settings.ROUTER_MODEL_NAME,
+                temperature=0
             )
             
-            logger.info("Multipurpose chain built successfully!")
-            return full_chain
-            
+            logger.info("LLM initialized.")
+            self._prompt_caches: dict[str, str] = {}
+            self._prompt_cache_key: str | None = None
+            self._prompt_cache_expires = 0.0
+            self._prompt_cache_bucket: int | None = None
+            self._prompt_cache_lock = threading.Lock()
+            self._response_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+            self._response_cache_lock = asyncio.Lock()
         except Exception as e:
-            logger.error(f"Error in _build_chain: {e}", exc_info=True)
+            import traceback
+            traceback.print_exc()
             raise e
 
+    async def _invoke_llm(self, prompt: str, llm: CustomGeminiAdapter | None = None, **kwargs) -> str:
+        message = await (llm or self.llm).ainvoke(prompt, **kwargs)
+        return message.content
+
+    async def _prompt_cache_handle(self, kind: str) -> str | None:
+        """Returns the context-cache handle for "router" or "sql", refreshing it off the event loop."""
+        # Also re-checked on each schema refresh, so a schema change swaps the caches
+        if (time.monotonic() >= self._prompt_cache_expires
+                or _schema_ttl_bucket() != self._prompt_cache_bucket):
+            await asyncio.to_thread(self._get_prompt_caches)
+        return self._prompt_caches.get(kind)
+
+    async def _classify(self, question: str) -> str:
+        tail = _render_router_question(question=question)
+        handle = await self._prompt_cache_handle("router")
+        if handle:
+            intent = await self._invoke_llm(tail, self.router_llm, cached_content=handle)
+        else:
+            prefix = await asyncio.to_thread(_router_prefix_cached, self.db, _schema_ttl_bucket())
+            intent = await self._invoke_llm(prefix + tail, self.router_llm)
+        return intent.strip().upper()
+
+    async def _generate_sql(self, question: str) -> str:
+        tail = _render_sql_question(question=question)
+        handle = await self._prompt_cache_handle("sql")
+        if handle:
+            return await self._invoke_llm(tail, cached_content=handle)
+        prefix = await asyncio.to_thread(_sql_prefix_cached, self.db, _schema_ttl_bucket())
+        return await self._invoke_llm(prefix + tail)
+
+    def _run_query(self, q: str) -> str:
+        logger.debug(f"Executing query: {q}")
+        return self.db.run(q)
+
+    async def _sql_answer_prompt(self, question: str, query: str) -> str:
+        """Cleans and runs the generated SQL, returning the answer prompt."""
+        logger.debug(f"Raw LLM output: {query}")
+        q = _clean_sql_query(query)
+        logger.debug(f"Cleaned SQL query: {q}")
+        result = await asyncio.to_thread(self._run_query, q)
+        return _render_sql_answer(question=question, query=q, result=result)
+
+    def _get_prompt_caches(self) -> dict[str, str]:
+        """
+        Returns the Gemini context-cache handles for the static router/SQL prefixes,
+        (re)creating them when the schema changes or the cache TTL runs out.
+        """
+        bucket = _schema_ttl_bucket()
+        router_prefix = _router_prefix_cached(self.db, bucket)
+        sql_prefix = _sql_prefix_cached(self.db, bucket)
+        # Keyed on the rendered prefixes: any schema change (not only table names)
+        # creates new caches on the next schema refresh
+        hasher = hashlib.sha256(router_prefix.encode())
+        hasher.update(b"\0")
+        hasher.update(sql_prefix.encode())
+        key = hasher.hexdigest()
+        with self._prompt_cache_lock:
+            if key == self._prompt_cache_key and time.monotonic() < self._prompt_cache_expires:
+                self._prompt_cache_bucket = bucket
+                return self._prompt_caches
+
+            ttl = settings.PROMPT_CACHE_TTL_SECONDS
+            caches = {}
+            for kind, llm, prefix in (
+                ("router", self.router_llm, router_prefix),
+                ("sql", self.llm, sql_prefix),
+            ):
+                # Gemini rejects caches below the model's minimum size: don't even ask
+                if len(prefix) // _CHARS_PER_TOKEN < settings.PROMPT_CACHE_MIN_TOKENS:
+                    continue
+                handle = llm.create_context_cache(prefix, ttl=f"{ttl}s")
+                if handle:
+                    caches[kind] = handle
+            logger.info(f"Prompt caches refreshed: {sorted(caches)}")
+
+            # Superseded caches stay billed until their TTL unless deleted. The delete
+            # is delayed so requests that already picked up an old handle can finish
+            superseded = list(self._prompt_caches.values())
+            if superseded:
+                timer = threading.Timer(
+                    _CACHE_DELETE_GRACE_SECONDS, self._delete_prompt_caches, args=(superseded,)
+                )
+                timer.daemon = True
+                timer.start()
+
+            self._prompt_caches = caches
+            self._prompt_cache_key = key
+            self._prompt_cache_bucket = bucket
+            # Refresh slightly before the server-side expiry
+            self._prompt_cache_expires = time.monotonic() + ttl * 0.9
+            return caches
+
+    def _delete_prompt_caches(self, handles: list[str]) -> None:
+        for handle in handles:
+            self.llm.delete_context_cache(handle)
+
+    def recheck_prompt_caches(self) -> None:
+        """Makes the next request compare the prompt-cache key against a fresh schema."""
+        with self._prompt_cache_lock:
+            self._prompt_cache_bucket = None
+
     async def ask(self, question: str) -> str:
         """
         Process a natural language question and return the answer.
         """
+        key = hashlib.blake2b(question.strip().lower().encode()).hexdigest()
+        cached = await self._get_cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
-            # Invoke the chain
-            response = await self.sql_chain.ainvoke({"question": question})
-            return response
+            response = await self._run_speculative(question)
         except Exception as e:
+            # Failures (Gemini quota, timeouts) are never cached
             return f"Lo siento, ocurrió un error al procesar tu consulta: {str(e)}"
 
+        if response:
+            await self._set_cached_response(key, response)
+        return response
+
+    async def _run_speculative(self, question: str) -> str:
+        """Answers the question in one shot: routing (see _route), then the final LLM call."""
+        return await self._invoke_llm(await self._answer_prompt(question))
+
+    async def _answer_prompt(self, question: str) -> str:
+        """Routes the question and returns the prompt for the final answer."""
+        query = await self._route(question)
+        if query is not None:
+            return await self._sql_answer_prompt(question, query)
+        return _render_chat(question=question)
+
+    async def _route(self, question: str) -> str | None:
+        """
+        Starts the router and the SQL draft together. Returns the generated SQL
+        for data questions, or None (cancelling the draft) for plain chat.
+        """
+        router_task = asyncio.create_task(self._classify(question))
+        sql_gen_task = asyncio.create_task(self._generate_sql(question))
+        try:
+            intent = await router_task
+        except BaseException:
+            _discard_task(sql_gen_task)
+            raise
+
+        if "SQL" in intent:
+            return await sql_gen_task
+        _discard_task(sql_gen_task)
+        return None
+
+    async def ask_many(self, questions: list[str]) -> list[str]:
+        """
+        Process several questions concurrently, preserving their order.
+        Concurrency is capped by BATCH_MAX_CONCURRENCY.
+        """
+        semaphore = asyncio.Semaphore(settings.BATCH_MAX_CONCURRENCY)
+
+        async def bounded_ask(question: str) -> str:
+            async with semaphore:
+                return await self.ask(question)
+
+        return list(await asyncio.gather(*(bounded_ask(q) for q in questions)))
+
+    async def astream(self, question: str) -> AsyncIterator[str]:
+        """
+        Process a natural language question, yielding the answer as it is generated.
+        """
+        key = hashlib.blake2b(question.strip().lower().encode()).hexdigest()
+        cached = await self._get_cached_response(key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts: list[str] = []
+        try:
+            prompt = await self._answer_prompt(question)
+            async for chunk in self.llm.astream(prompt):
+                parts.append(chunk.content)
+                yield chunk.content
+        except Exception as e:
+            yield f"Lo siento, ocurrió un error al procesar tu consulta: {str(e)}"
+            return
+
+        # Only reached when the stream completed: a failed stream returns above and
+        # a client-aborted one is closed at the yield, so neither is cached
+        response = "".join(parts)
+        if response:
+            await self._set_cached_response(key, response)
+
+    async def _get_cached_response(self, key: str) -> str | None:
+        """Returns a cached answer for the normalized question, if still fresh."""
+        async with self._response_cache_lock:
+            entry = self._response_cache.get(key)
+            if entry is None:
+                return None
+            stored_at, response = entry
+            if time.monotonic() - stored_at > settings.RESPONSE_CACHE_TTL_SECONDS:
+                del self._response_cache[key]
+                return None
+            self._response_cache.move_to_end(key)
+            return response
+
+    async def _set_cached_response(self, key: str, response: str) -> None:
+        """Stores an answer, evicting the least recently used entries over capacity."""
+        async with self._response_cache_lock:
+            self._response_cache[key] = (time.monotonic(), response)
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > settings.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+
 # Singleton
 _service = None
 
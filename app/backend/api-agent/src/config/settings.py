@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from functools import lru_cache
+from functools import cached_property, lru_cache
 
 
 class Settings(BaseSettings):
@@ -15,9 +15,23 @@ class Settings(BaseSettings):
     
     # Google Gemini API
     MODEL_NAME: str = "gemini-2.0-flash"
+    ROUTER_MODEL_NAME: str = "gemini-2.0-flash-lite"
     GOOGLE_API_KEY: str | None = None
+    PROMPT_CACHE_TTL_SECONDS: int = 3600
+    PROMPT_CACHE_MIN_TOKENS: int = 4096  # Mínimo que Gemini acepta para un context cache (depende del modelo)
 
-    @property
+    # Cache del esquema de la base de datos
+    SCHEMA_CACHE_TTL_SECONDS: int = 300
+
+    # Cache de respuestas
+    RESPONSE_CACHE_SIZE: int = 1024
+    RESPONSE_CACHE_TTL_SECONDS: int = 600
+
+    # Consultas en lote
+    BATCH_MAX_CONCURRENCY: int = 8
+    BATCH_MAX_QUESTIONS: int = 32  # Preguntas máximas por request (cada una son varias llamadas a Gemini)
+
+    @cached_property
     def DATABASE_URL(self) -> str:
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
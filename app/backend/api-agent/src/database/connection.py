@@ -6,14 +6,21 @@ from config.settings import get_settings
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Engine compartido por el proceso: las consultas reutilizan conexiones del pool
+# en vez de pagar TCP + autenticación en cada request.
+_engine = create_engine(
+    f"postgresql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}",
+    pool_size=10,
+    max_overflow=5,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+)
+
 
 def get_db() -> SQLDatabase:
     """
     Creates and returns a SQLDatabase instance for LangChain.
     Uses synchronous PostgreSQL driver for LangChain compatibility.
     """
-    db_url = f"postgresql://{settings.DB_USER}:{settings.DB_PASSWORD}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
-    
     logger.info(f"Connecting to database schema: {settings.DB_SCHEMA}")
-    engine = create_engine(db_url)
-    return SQLDatabase(engine, schema=settings.DB_SCHEMA)
+    return SQLDatabase(_engine, schema=settings.DB_SCHEMA)
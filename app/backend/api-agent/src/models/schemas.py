@@ -1,11 +1,26 @@
 from pydantic import BaseModel, Field
 
+from config.settings import get_settings
+
+settings = get_settings()
+
 
 class AgentQueryRequest(BaseModel):
     """Solicitud de consulta al agente."""
     query: str = Field(..., description="Pregunta en lenguaje natural", examples=["¿Cuántos despachos hay?"])
 
 
+class AgentQueryBatchRequest(BaseModel):
+    """Solicitud de varias consultas al agente en una sola llamada."""
+    questions: list[str] = Field(
+        ...,
+        min_length=1,
+        max_length=settings.BATCH_MAX_QUESTIONS,
+        description="Preguntas en lenguaje natural",
+        examples=[["¿Cuántos despachos hay?", "Hola"]],
+    )
+
+
 class AgentQueryResponse(BaseModel):
     """Respuesta del agente."""
     answer: str = Field(..., description="Respuesta generada por el agente")
@@ -1,7 +1,11 @@
+from typing import AsyncIterator
+
+import orjson
 from litestar import Router, post
 from litestar.openapi.spec import Tag
-from models.schemas import AgentQueryRequest, AgentQueryResponse
-from agent.service import get_agent_service
+from litestar.response import ServerSentEvent
+from models.schemas import AgentQueryBatchRequest, AgentQueryRequest, AgentQueryResponse
+from agent.service import get_agent_service, invalidate_schema_cache
 
 
 @post(
@@ -22,8 +26,57 @@ async def query_agent(data: AgentQueryRequest) -> AgentQueryResponse:
     return AgentQueryResponse(answer=answer)
 
 
+@post(
+    "/query/stream",
+    description="Procesa una pregunta en lenguaje natural y transmite la respuesta como Server-Sent Events.",
+    summary="Consulta al Agente (streaming)",
+    tags=["Agent"],
+)
+async def query_agent_stream(data: AgentQueryRequest) -> ServerSentEvent:
+    """
+    Igual que /query, pero emite la respuesta por fragmentos a medida que se genera.
+    Cada evento contiene un JSON con la forma {"text": "..."}.
+    """
+    service = get_agent_service()
+
+    async def event_stream() -> AsyncIterator[str]:
+        async for chunk in service.astream(data.query):
+            yield orjson.dumps({"text": chunk}).decode()
+
+    return ServerSentEvent(event_stream())
+
+
+@post(
+    "/query/batch",
+    description="Procesa varias preguntas en paralelo y retorna las respuestas en el mismo orden.",
+    summary="Consulta al Agente (lote)",
+    tags=["Agent"],
+)
+async def query_agent_batch(data: AgentQueryBatchRequest) -> list[AgentQueryResponse]:
+    """
+    Procesa un lote de preguntas de forma concurrente.
+    """
+    service = get_agent_service()
+    answers = await service.ask_many(data.questions)
+    return [AgentQueryResponse(answer=answer) for answer in answers]
+
+
+@post(
+    "/schema/invalidate",
+    description="Descarta el esquema de la base de datos y los prompts cacheados en Gemini.",
+    summary="Invalidar Esquema",
+    tags=["Agent"],
+)
+async def invalidate_schema() -> dict:
+    """
+    Fuerza a la siguiente consulta a releer el esquema (por ejemplo, tras una migración).
+    """
+    invalidate_schema_cache()
+    return {"status": "ok"}
+
+
 agent_router = Router(
     path="/agent",
-    route_handlers=[query_agent],
+    route_handlers=[query_agent, query_agent_stream, query_agent_batch, invalidate_schema],
     tags=["Agent"],
 )
@@ -1,10 +1,12 @@
-from litestar import Litestar, get
+from litestar import Litestar, get, delete
 from litestar.openapi import OpenAPIConfig
 from litestar.openapi.spec import Contact, License, Server
 from litestar.config.cors import CORSConfig
 from contextlib import asynccontextmanager
+import orjson
 import structlog
 
+from src.auth.keycloak import get_keycloak_client
 from src.config import get_settings
 from src.middleware.security import (
     security_headers_middleware,
@@ -16,6 +18,20 @@ from src.roles.controller import RoleController, UserRoleController
 from src.groups.controller import GroupController, UserGroupController
 from src.sync.user_sync import get_user_sync_service
 
+# Logs en JSON serializados con orjson (bytes directos, sin re-encode str -> bytes)
+# Los niveles bajo LOG_LEVEL se descartan antes de construir el evento
+structlog.configure(
+    wrapper_class=structlog.make_filtering_bound_logger(get_settings().log_level_value),
+    processors=[
+        structlog.contextvars.merge_contextvars,
+        structlog.processors.add_log_level,
+        structlog.processors.TimeStamper(fmt="iso"),
+        structlog.processors.format_exc_info,
+        structlog.processors.JSONRenderer(serializer=orjson.dumps),
+    ],
+    logger_factory=structlog.BytesLoggerFactory(),
+)
+
 logger = structlog.get_logger()
 
 
@@ -37,6 +53,7 @@ async def lifespan(app: Litestar):
     yield
 
     # Shutdown
+    await get_keycloak_client().close()
     await sync_service.close()
     logger.info("application_stopped")
 
@@ -53,6 +70,18 @@ async def root() -> dict:
     return {"message": "Auth API", "docs": "/auth/swagger"}
 
 
+@delete(
+    path="/cache",
+    summary="Purgar cache",
+    description="Vacia la cache de lecturas de Keycloak (usuarios y roles).",
+    tags=["Administracion"],
+    status_code=204,
+)
+async def purge_cache() -> None:
+    get_keycloak_client().cache.clear()
+    logger.info("keycloak_cache_purged")
+
+
 def create_app() -> Litestar:
     """Factory de la aplicacion."""
     settings = get_settings()
@@ -104,6 +133,7 @@ Incluir el token en el header `Authorization: Bearer <token>`.
         route_handlers=[
             root,
             health_check,
+            purge_cache,
             UserController,
             RoleController,
             UserRoleController,
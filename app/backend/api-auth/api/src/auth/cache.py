@@ -0,0 +1,70 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+class AsyncTTLCache:
+    """
+    Cache en memoria con expiracion (TTL) y tamaño maximo (LRU).
+    Las claves son tuplas cuyo primer elemento identifica el tipo de recurso.
+    Las cargas concurrentes de una misma clave se colapsan en una sola (single-flight).
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self._generation = 0
+
+    async def get_or_load(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Retorna el valor cacheado o lo carga con `loader` si no existe o expiro."""
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                return value
+            del self._data[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, loader, self._generation))
+            self._inflight[key] = task
+        # shield: si un solicitante se cancela, la carga sigue para los demas
+        return await asyncio.shield(task)
+
+    async def _load(self, key: tuple, loader: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        try:
+            value = await loader()
+            # Si hubo una invalidacion durante la carga, el valor puede estar obsoleto
+            if generation == self._generation:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+            return value
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def invalidate(self, *keys: tuple) -> None:
+        """Elimina claves especificas."""
+        self._generation += 1
+        for key in keys:
+            self._data.pop(key, None)
+            self._inflight.pop(key, None)
+
+    def invalidate_kind(self, kind: str) -> None:
+        """Elimina todas las claves de un tipo de recurso (primer elemento de la tupla)."""
+        self._generation += 1
+        for store in (self._data, self._inflight):
+            for key in [k for k in store if k[0] == kind]:
+                del store[key]
+
+    def clear(self) -> None:
+        """Vacia la cache completa."""
+        self._generation += 1
+        self._data.clear()
+        self._inflight.clear()
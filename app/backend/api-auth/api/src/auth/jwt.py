@@ -109,11 +109,6 @@ class JWTValidator:
 
 
 # Singleton
-_jwt_validator: JWTValidator | None = None
-
-
+@lru_cache
 def get_jwt_validator() -> JWTValidator:
-    global _jwt_validator
-    if _jwt_validator is None:
-        _jwt_validator = JWTValidator()
-    return _jwt_validator
\ No newline at end of file
+    return JWTValidator()
\ No newline at end of file
@@ -1,11 +1,16 @@
 import httpx
+from functools import lru_cache
 from typing import Any
 import structlog
 
+from src.auth.cache import AsyncTTLCache
 from src.config import get_settings
 
 logger = structlog.get_logger()
 
+# Conexiones keep-alive reutilizadas entre requests a Keycloak
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
 
 class KeycloakAdminError(Exception):
     """Error en operacion con Keycloak Admin API."""
@@ -25,33 +30,53 @@ class KeycloakAdminClient:
     def __init__(self):
         self.settings = get_settings()
         self._access_token: str | None = None
+        # Cache de lecturas (usuarios y roles); las escrituras invalidan sus entradas
+        self.cache = AsyncTTLCache(
+            ttl=self.settings.keycloak_cache_ttl,
+            max_size=self.settings.keycloak_cache_max_size,
+        )
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """Cliente HTTP compartido (pool de conexiones); se crea en el primer uso."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(retries=2, limits=_HTTP_LIMITS),
+            )
+        return self._client
+
+    async def close(self) -> None:
+        """Cierra el cliente HTTP y sus conexiones."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def _get_admin_token(self) -> str:
         """Obtiene token de acceso para la Admin API."""
         token_url = f"{self.settings.keycloak_url}/realms/master/protocol/openid-connect/token"
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    token_url,
-                    data={
-                        "grant_type": "password",
-                        "client_id": "admin-cli",
-                        "username": self.settings.keycloak_admin_user,
-                        "password": self.settings.keycloak_admin_password,
-                    },
-                    timeout=10.0,
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data["access_token"]
-
-            except httpx.HTTPStatusError as e:
-                logger.error("admin_token_failed", status=e.response.status_code)
-                raise KeycloakAdminError("Failed to obtain admin token", 503)
-            except httpx.HTTPError as e:
-                logger.error("admin_token_error", error=str(e))
-                raise KeycloakAdminError("Keycloak connection error", 503)
+        try:
+            response = await self.http.post(
+                token_url,
+                data={
+                    "grant_type": "password",
+                    "client_id": "admin-cli",
+                    "username": self.settings.keycloak_admin_user,
+                    "password": self.settings.keycloak_admin_password,
+                },
+                timeout=10.0,
+            )
+            response.raise_for_status()
+            data = response.json()
+            return data["access_token"]
+
+        except httpx.HTTPStatusError as e:
+            logger.error("admin_token_failed", status=e.response.status_code)
+            raise KeycloakAdminError("Failed to obtain admin token", 503)
+        except httpx.HTTPError as e:
+            logger.error("admin_token_error", error=str(e))
+            raise KeycloakAdminError("Keycloak connection error", 503)
 
     async def _get_headers(self) -> dict[str, str]:
         """Obtiene headers con token de autorizacion."""
@@ -74,26 +99,25 @@ class KeycloakAdminClient:
         url = f"{self.settings.keycloak_admin_url}/{endpoint}"
         headers = await self._get_headers()
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.request(
-                    method,
-                    url,
-                    headers=headers,
-                    json=json_data,
-                    timeout=15.0,
-                )
+        try:
+            response = await self.http.request(
+                method,
+                url,
+                headers=headers,
+                json=json_data,
+                timeout=15.0,
+            )
 
-                # Token expirado, reintentar
-                if response.status_code == 401 and retry:
-                    self._access_token = None
-                    return await self._request(method, endpoint, json_data, retry=False)
+            # Token expirado, reintentar
+            if response.status_code == 401 and retry:
+                self._access_token = None
+                return await self._request(method, endpoint, json_data, retry=False)
 
-                return response
+            return response
 
-            except httpx.HTTPError as e:
-                logger.error("keycloak_request_error", error=str(e), endpoint=endpoint)
-                raise KeycloakAdminError("Keycloak connection error", 503)
+        except httpx.HTTPError as e:
+            logger.error("keycloak_request_error", error=str(e), endpoint=endpoint)
+            raise KeycloakAdminError("Keycloak connection error", 503)
 
     # ----------------------------------------------------------------
     # Operaciones CRUD de usuarios
@@ -136,6 +160,7 @@ class KeycloakAdminClient:
             # Extraer ID del header Location
             location = response.headers.get("Location", "")
             user_id = location.split("/")[-1]
+            self.cache.invalidate_kind("users")
             logger.info("user_created", user_id=user_id, username=username)
             return user_id
 
@@ -145,17 +170,22 @@ class KeycloakAdminClient:
         error = response.json().get("errorMessage", "Unknown error")
         raise KeycloakAdminError(f"Failed to create user: {error}", response.status_code)
 
-    async def get_user(self, user_id: str) -> dict[str, Any]:
-        """Obtiene un usuario por ID."""
-        response = await self._request("GET", f"users/{user_id}")
+    async def get_user(self, user_id: str, fresh: bool = False) -> dict[str, Any]:
+        """Obtiene un usuario por ID. Con fresh=True se lee de Keycloak sin pasar por la cache."""
+        async def load() -> dict[str, Any]:
+            response = await self._request("GET", f"users/{user_id}")
 
-        if response.status_code == 200:
-            return response.json()
+            if response.status_code == 200:
+                return response.json()
 
-        if response.status_code == 404:
-            raise KeycloakAdminError("User not found", 404)
+            if response.status_code == 404:
+                raise KeycloakAdminError("User not found", 404)
 
-        raise KeycloakAdminError("Failed to get user", response.status_code)
+            raise KeycloakAdminError("Failed to get user", response.status_code)
+
+        if fresh:
+            return await load()
+        return await self.cache.get_or_load(("user", user_id), load)
 
     async def get_user_by_email(self, email: str) -> dict[str, Any] | None:
         """Busca un usuario por email."""
@@ -192,6 +222,8 @@ class KeycloakAdminClient:
         response = await self._request("PUT", f"users/{user_id}", update_data)
 
         if response.status_code == 204:
+            self.cache.invalidate(("user", user_id))
+            self.cache.invalidate_kind("users")
             logger.info("user_updated", user_id=user_id)
             return
 
@@ -205,6 +237,8 @@ class KeycloakAdminClient:
         response = await self._request("DELETE", f"users/{user_id}")
 
         if response.status_code == 204:
+            self.cache.invalidate(("user", user_id), ("user_roles", user_id))
+            self.cache.invalidate_kind("users")
             logger.info("user_deleted", user_id=user_id)
             return
 
@@ -218,18 +252,42 @@ class KeycloakAdminClient:
         first: int = 0,
         max_results: int = 100,
         search: str | None = None,
+        brief: bool = False,
     ) -> list[dict[str, Any]]:
-        """Lista usuarios con paginacion."""
+        """
+        Lista usuarios con paginacion.
+        Con `brief` Keycloak omite atributos y datos extra (briefRepresentation).
+        """
         params = f"first={first}&max={max_results}"
         if search:
             params += f"&search={search}"
+        if brief:
+            params += "&briefRepresentation=true"
 
-        response = await self._request("GET", f"users?{params}")
+        async def load() -> list[dict[str, Any]]:
+            response = await self._request("GET", f"users?{params}")
 
-        if response.status_code == 200:
-            return response.json()
+            if response.status_code == 200:
+                return response.json()
 
-        raise KeycloakAdminError("Failed to list users", response.status_code)
+            raise KeycloakAdminError("Failed to list users", response.status_code)
+
+        return await self.cache.get_or_load(("users", params), load)
+
+    async def count_users(self, search: str | None = None) -> int:
+        """Cuenta usuarios (opcionalmente filtrados por busqueda)."""
+        endpoint = f"users/count?search={search}" if search else "users/count"
+
+        async def load() -> int:
+            response = await self._request("GET", endpoint)
+
+            if response.status_code == 200:
+                return response.json()
+
+            raise KeycloakAdminError("Failed to count users", response.status_code)
+
+        # Misma familia de claves que list_users: se invalida junto con ella
+        return await self.cache.get_or_load(("users", "count", search), load)
 
     async def set_password(self, user_id: str, password: str, temporary: bool = False) -> None:
         """Establece una nueva contraseña para el usuario."""
@@ -264,6 +322,7 @@ class KeycloakAdminClient:
         response = await self._request("POST", "roles", role_data)
 
         if response.status_code == 201:
+            self.cache.invalidate(("roles",))
             logger.info("role_created", role_name=name)
             return
 
@@ -275,15 +334,18 @@ class KeycloakAdminClient:
 
     async def get_role(self, role_name: str) -> dict[str, Any]:
         """Obtiene un rol por nombre."""
-        response = await self._request("GET", f"roles/{role_name}")
+        async def load() -> dict[str, Any]:
+            response = await self._request("GET", f"roles/{role_name}")
 
-        if response.status_code == 200:
-            return response.json()
+            if response.status_code == 200:
+                return response.json()
 
-        if response.status_code == 404:
-            raise KeycloakAdminError("Role not found", 404)
+            if response.status_code == 404:
+                raise KeycloakAdminError("Role not found", 404)
+
+            raise KeycloakAdminError("Failed to get role", response.status_code)
 
-        raise KeycloakAdminError("Failed to get role", response.status_code)
+        return await self.cache.get_or_load(("role", role_name), load)
 
     async def update_role(self, role_name: str, description: str) -> None:
         """Actualiza la descripcion de un rol."""
@@ -295,6 +357,7 @@ class KeycloakAdminClient:
         response = await self._request("PUT", f"roles/{role_name}", role_data)
 
         if response.status_code == 204:
+            self._invalidate_role(role_name)
             logger.info("role_updated", role_name=role_name)
             return
 
@@ -308,6 +371,7 @@ class KeycloakAdminClient:
         response = await self._request("DELETE", f"roles/{role_name}")
 
         if response.status_code == 204:
+            self._invalidate_role(role_name)
             logger.info("role_deleted", role_name=role_name)
             return
 
@@ -318,22 +382,45 @@ class KeycloakAdminClient:
 
     async def list_roles(self) -> list[dict[str, Any]]:
         """Lista todos los roles del realm."""
-        response = await self._request("GET", "roles")
+        async def load() -> list[dict[str, Any]]:
+            response = await self._request("GET", "roles")
 
-        if response.status_code == 200:
-            return response.json()
+            if response.status_code == 200:
+                return response.json()
+
+            raise KeycloakAdminError("Failed to list roles", response.status_code)
 
-        raise KeycloakAdminError("Failed to list roles", response.status_code)
+        return await self.cache.get_or_load(("roles",), load)
+
+    def _invalidate_role(self, role_name: str) -> None:
+        """Invalida un rol y las vistas que lo incluyen (lista y roles por usuario)."""
+        self.cache.invalidate(("role", role_name), ("roles",))
+        self.cache.invalidate_kind("user_roles")
 
     async def assign_role_to_user(self, user_id: str, role_name: str) -> None:
         """Asigna un rol a un usuario."""
-        role = await self.get_role(role_name)
-        role_data = [{"id": role["id"], "name": role["name"]}]
+        await self.assign_roles_to_user(user_id, [role_name])
+
+    async def assign_roles_to_user(self, user_id: str, role_names: list[str]) -> None:
+        """
+        Asigna varios roles a un usuario en una sola llamada.
+        Los ids se resuelven desde la lista de roles cacheada.
+        """
+        roles_by_name = {r["name"]: r for r in await self.list_roles()}
+        missing = [name for name in role_names if name not in roles_by_name]
+        if missing:
+            raise KeycloakAdminError(f"Role not found: {', '.join(missing)}", 404)
+
+        role_data = [
+            {"id": roles_by_name[name]["id"], "name": name}
+            for name in dict.fromkeys(role_names)
+        ]
 
         response = await self._request("POST", f"users/{user_id}/role-mappings/realm", role_data)
 
         if response.status_code == 204:
-            logger.info("role_assigned", user_id=user_id, role_name=role_name)
+            self.cache.invalidate(("user_roles", user_id))
+            logger.info("roles_assigned", user_id=user_id, role_names=role_names)
             return
 
         if response.status_code == 404:
@@ -349,6 +436,7 @@ class KeycloakAdminClient:
         response = await self._request("DELETE", f"users/{user_id}/role-mappings/realm", role_data)
 
         if response.status_code == 204:
+            self.cache.invalidate(("user_roles", user_id))
             logger.info("role_removed", user_id=user_id, role_name=role_name)
             return
 
@@ -359,15 +447,18 @@ class KeycloakAdminClient:
 
     async def get_user_roles(self, user_id: str) -> list[dict[str, Any]]:
         """Obtiene los roles asignados a un usuario."""
-        response = await self._request("GET", f"users/{user_id}/role-mappings/realm")
+        async def load() -> list[dict[str, Any]]:
+            response = await self._request("GET", f"users/{user_id}/role-mappings/realm")
 
-        if response.status_code == 200:
-            return response.json()
+            if response.status_code == 200:
+                return response.json()
 
-        if response.status_code == 404:
-            raise KeycloakAdminError("User not found", 404)
+            if response.status_code == 404:
+                raise KeycloakAdminError("User not found", 404)
+
+            raise KeycloakAdminError("Failed to get user roles", response.status_code)
 
-        raise KeycloakAdminError("Failed to get user roles", response.status_code)
+        return await self.cache.get_or_load(("user_roles", user_id), load)
 
     # ----------------------------------------------------------------
     # Operaciones CRUD de grupos
@@ -497,11 +588,6 @@ class KeycloakAdminClient:
 
 
 # Singleton
-_keycloak_client: KeycloakAdminClient | None = None
-
-
+@lru_cache
 def get_keycloak_client() -> KeycloakAdminClient:
-    global _keycloak_client
-    if _keycloak_client is None:
-        _keycloak_client = KeycloakAdminClient()
-    return _keycloak_client
\ No newline at end of file
+    return KeycloakAdminClient()
\ No newline at end of file
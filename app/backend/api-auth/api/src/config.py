@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+import logging
 
 
 class Settings(BaseSettings):
@@ -9,6 +10,7 @@ class Settings(BaseSettings):
     app_env: str = "development"
     app_debug: bool = False
     app_secret_key: str
+    log_level: str = "INFO"
 
     # Keycloak
     keycloak_url: str
@@ -17,6 +19,8 @@ class Settings(BaseSettings):
     keycloak_client_secret: str
     keycloak_admin_user: str
     keycloak_admin_password: str
+    keycloak_cache_ttl: int = 30
+    keycloak_cache_max_size: int = 4096
 
     # Base de datos de negocio
     business_db_host: str
@@ -25,6 +29,8 @@ class Settings(BaseSettings):
     business_db_password: str
     business_db_name: str
     business_db_schema: str
+    business_db_pool_size: int = 5
+    business_db_max_overflow: int = 10
 
     # Seguridad
     cors_origins: str = "http://localhost:3000"
@@ -46,6 +52,11 @@ class Settings(BaseSettings):
             f"@{self.business_db_host}:{self.business_db_port}/{self.business_db_name}"
         )
 
+    @property
+    def log_level_value(self) -> int:
+        # Un nivel desconocido cae en INFO (getLevelName retornaba un string)
+        return logging.getLevelNamesMapping().get(self.log_level.upper(), logging.INFO)
+
     @property
     def cors_origins_list(self) -> list[str]:
         return [origin.strip() for origin in self.cors_origins.split(",")]
@@ -1,3 +1,4 @@
+import msgspec
 from pydantic import BaseModel, Field
 
 
@@ -14,7 +15,7 @@ class GroupUpdate(BaseModel):
     name: str = Field(..., min_length=2, max_length=100)
 
 
-class GroupResponse(BaseModel):
+class GroupResponse(msgspec.Struct):
     """Schema de respuesta de grupo."""
 
     id: str
@@ -23,14 +24,14 @@ class GroupResponse(BaseModel):
     subgroups: list["GroupResponse"] = []
 
 
-class GroupListResponse(BaseModel):
+class GroupListResponse(msgspec.Struct):
     """Schema de respuesta para lista de grupos."""
 
     groups: list[GroupResponse]
     total: int
 
 
-class GroupMemberResponse(BaseModel):
+class GroupMemberResponse(msgspec.Struct):
     """Schema de respuesta para miembro de grupo."""
 
     id: str
@@ -40,7 +41,7 @@ class GroupMemberResponse(BaseModel):
     last_name: str
 
 
-class GroupMembersResponse(BaseModel):
+class GroupMembersResponse(msgspec.Struct):
     """Schema de respuesta para lista de miembros."""
 
     members: list[GroupMemberResponse]
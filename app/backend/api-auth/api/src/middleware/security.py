@@ -2,7 +2,8 @@ from litestar.middleware import DefineMiddleware
 from litestar.middleware.base import MiddlewareProtocol
 from litestar.types import ASGIApp, Receive, Scope, Send
 from litestar.connection import Request
-from collections import defaultdict
+from collections import defaultdict, deque
+import logging
 import time
 import structlog
 
@@ -10,6 +11,17 @@ from src.config import get_settings
 
 logger = structlog.get_logger()
 
+# Referencia local para los caminos calientes (evita el lookup del modulo)
+_time = time.time
+
+
+def _xff(headers) -> str:
+    """Devuelve el header X-Forwarded-For sin construir un dict de headers."""
+    for key, value in headers:
+        if key == b"x-forwarded-for":
+            return value.decode()
+    return ""
+
 
 class SecurityHeadersMiddleware(MiddlewareProtocol):
     """
@@ -57,36 +69,51 @@ class RateLimitMiddleware(MiddlewareProtocol):
 
     def __init__(self, app: ASGIApp) -> None:
         self.app = app
-        self.requests: dict[str, list[float]] = defaultdict(list)
         settings = get_settings()
         self.max_requests = settings.rate_limit_requests
         self.window_seconds = settings.rate_limit_period
+        self.requests: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.max_requests)
+        )
+        self._last_sweep = _time()
 
     def _get_client_ip(self, scope: Scope) -> str:
         # Obtener IP real considerando proxies
-        headers = dict(scope.get("headers", []))
-        forwarded = headers.get(b"x-forwarded-for", b"").decode()
+        forwarded = _xff(scope.get("headers", ()))
         if forwarded:
-            return forwarded.split(",")[0].strip()
+            return forwarded.split(",", 1)[0].strip()
 
         client = scope.get("client")
         return client[0] if client else "unknown"
 
     def _is_rate_limited(self, client_ip: str) -> bool:
-        now = time.time()
+        now = _time()
         window_start = now - self.window_seconds
 
+        if now - self._last_sweep > self.window_seconds:
+            self._sweep(window_start)
+            self._last_sweep = now
+
         # Limpiar requests antiguos
-        self.requests[client_ip] = [
-            ts for ts in self.requests[client_ip] if ts > window_start
-        ]
+        timestamps = self.requests[client_ip]
+        while timestamps and timestamps[0] <= window_start:
+            timestamps.popleft()
 
-        if len(self.requests[client_ip]) >= self.max_requests:
+        if len(timestamps) >= self.max_requests:
             return True
 
-        self.requests[client_ip].append(now)
+        timestamps.append(now)
         return False
 
+    def _sweep(self, window_start: float) -> None:
+        """Elimina las IPs sin requests dentro de la ventana para acotar memoria."""
+        stale = [
+            ip for ip, timestamps in self.requests.items()
+            if not timestamps or timestamps[-1] <= window_start
+        ]
+        for ip in stale:
+            del self.requests[ip]
+
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] != "http":
             await self.app(scope, receive, send)
@@ -122,21 +149,22 @@ class AuditLogMiddleware(MiddlewareProtocol):
 
     def __init__(self, app: ASGIApp) -> None:
         self.app = app
+        self.enabled = get_settings().log_level_value <= logging.INFO
 
     def _get_client_ip(self, scope: Scope) -> str:
-        headers = dict(scope.get("headers", []))
-        forwarded = headers.get(b"x-forwarded-for", b"").decode()
+        forwarded = _xff(scope.get("headers", ()))
         if forwarded:
-            return forwarded.split(",")[0].strip()
+            return forwarded.split(",", 1)[0].strip()
         client = scope.get("client")
         return client[0] if client else "unknown"
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
-        if scope["type"] != "http":
+        # Sin nivel INFO el evento se descartaria: evitar todo el trabajo de auditoria
+        if scope["type"] != "http" or not self.enabled:
             await self.app(scope, receive, send)
             return
 
-        start_time = time.time()
+        start_time = _time()
         status_code = 0
 
         async def capture_status(message):
@@ -148,7 +176,7 @@ class AuditLogMiddleware(MiddlewareProtocol):
         try:
             await self.app(scope, receive, capture_status)
         finally:
-            duration = time.time() - start_time
+            duration = _time() - start_time
             logger.info(
                 "http_request",
                 method=scope.get("method"),
@@ -1,3 +1,4 @@
+import asyncio
 from litestar import Controller, get, post, put, delete
 from litestar.exceptions import HTTPException
 
@@ -8,8 +9,30 @@ from src.roles.schemas import (
     RoleResponse,
     RoleListResponse,
     UserRoleAssignment,
+    UserRoleBulkAssignment,
 )
 
+# Roles compuestos que Keycloak crea por realm; no se exponen en la API
+_DEFAULT_PREFIX = "default-roles-"
+
+
+def _to_role_response(r: dict) -> RoleResponse:
+    return RoleResponse(
+        id=r.get("id", ""),
+        name=r.get("name", ""),
+        description=r.get("description", ""),
+    )
+
+
+def _to_role_list(kc_roles: list[dict]) -> RoleListResponse:
+    """Filtra los roles por defecto y arma la respuesta en una sola pasada."""
+    roles = [
+        _to_role_response(r)
+        for r in kc_roles
+        if not r.get("name", "").startswith(_DEFAULT_PREFIX)
+    ]
+    return RoleListResponse(roles=roles, total=len(roles))
+
 
 class RoleController(Controller):
     """Controller REST para gestion de roles."""
@@ -40,16 +63,7 @@ class RoleController(Controller):
         try:
             keycloak = get_keycloak_client()
             kc_roles = await keycloak.list_roles()
-            roles = [
-                RoleResponse(
-                    id=r.get("id", ""),
-                    name=r.get("name", ""),
-                    description=r.get("description", ""),
-                )
-                for r in kc_roles
-                if not r.get("name", "").startswith("default-roles-")
-            ]
-            return RoleListResponse(roles=roles, total=len(roles))
+            return _to_role_list(kc_roles)
         except KeycloakAdminError as e:
             raise HTTPException(status_code=e.status_code, detail=e.message)
 
@@ -62,11 +76,7 @@ class RoleController(Controller):
         try:
             keycloak = get_keycloak_client()
             role = await keycloak.get_role(role_name)
-            return RoleResponse(
-                id=role.get("id", ""),
-                name=role.get("name", ""),
-                description=role.get("description", ""),
-            )
+            return _to_role_response(role)
         except KeycloakAdminError as e:
             raise HTTPException(status_code=e.status_code, detail=e.message)
 
@@ -78,14 +88,18 @@ class RoleController(Controller):
     async def update_role(self, role_name: str, data: RoleUpdate) -> RoleResponse:
         try:
             keycloak = get_keycloak_client()
-            if data.description is not None:
-                await keycloak.update_role(role_name, data.description)
-            role = await keycloak.get_role(role_name)
-            return RoleResponse(
-                id=role.get("id", ""),
-                name=role.get("name", ""),
-                description=role.get("description", ""),
+            if data.description is None:
+                return _to_role_response(await keycloak.get_role(role_name))
+
+            # El rol actual (posiblemente cacheado) se obtiene en paralelo al PUT
+            # y la respuesta se arma con la descripcion enviada, sin releer
+            role, _ = await asyncio.gather(
+                keycloak.get_role(role_name),
+                keycloak.update_role(role_name, data.description),
             )
+            response = _to_role_response(role)
+            response.description = data.description
+            return response
         except KeycloakAdminError as e:
             raise HTTPException(status_code=e.status_code, detail=e.message)
 
@@ -118,16 +132,7 @@ class UserRoleController(Controller):
         try:
             keycloak = get_keycloak_client()
             kc_roles = await keycloak.get_user_roles(user_id)
-            roles = [
-                RoleResponse(
-                    id=r.get("id", ""),
-                    name=r.get("name", ""),
-                    description=r.get("description", ""),
-                )
-                for r in kc_roles
-                if not r.get("name", "").startswith("default-roles-")
-            ]
-            return RoleListResponse(roles=roles, total=len(roles))
+            return _to_role_list(kc_roles)
         except KeycloakAdminError as e:
             raise HTTPException(status_code=e.status_code, detail=e.message)
 
@@ -144,6 +149,19 @@ class UserRoleController(Controller):
         except KeycloakAdminError as e:
             raise HTTPException(status_code=e.status_code, detail=e.message)
 
+    @post(
+        path="/bulk",
+        summary="Asignar roles a usuario",
+        description="Asigna varios roles a un usuario en una sola llamada a Keycloak.",
+        status_code=204,
+    )
+    async def bulk_assign_roles(self, user_id: str, data: UserRoleBulkAssignment) -> None:
+        try:
+            keycloak = get_keycloak_client()
+            await keycloak.assign_roles_to_user(user_id, data.role_names)
+        except KeycloakAdminError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.message)
+
     @delete(
         path="/{role_name:str}",
         summary="Remover rol de usuario",
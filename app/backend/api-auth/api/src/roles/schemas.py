@@ -1,3 +1,4 @@
+import msgspec
 from pydantic import BaseModel, Field
 
 
@@ -14,7 +15,7 @@ class RoleUpdate(BaseModel):
     description: str | None = Field(None, max_length=255)
 
 
-class RoleResponse(BaseModel):
+class RoleResponse(msgspec.Struct):
     """Schema de respuesta de rol."""
 
     id: str
@@ -22,7 +23,7 @@ class RoleResponse(BaseModel):
     description: str
 
 
-class RoleListResponse(BaseModel):
+class RoleListResponse(msgspec.Struct):
     """Schema de respuesta para lista de roles."""
 
     roles: list[RoleResponse]
@@ -32,4 +33,10 @@ class RoleListResponse(BaseModel):
 class UserRoleAssignment(BaseModel):
     """Schema para asignar/desasignar rol a usuario."""
 
-    role_name: str
\ No newline at end of file
+    role_name: str
+
+
+class UserRoleBulkAssignment(BaseModel):
+    """Schema para asignar varios roles a un usuario."""
+
+    role_names: list[str] = Field(..., min_length=1)
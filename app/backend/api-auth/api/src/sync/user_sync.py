@@ -1,7 +1,18 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import text
-from datetime import datetime
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import (
+    Column,
+    DateTime,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    func,
+    text,
+    update,
+)
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from functools import lru_cache
 import structlog
 
 from src.config import get_settings
@@ -19,104 +30,127 @@ class UserSyncService:
         self.settings = get_settings()
         # Leemos el esquema desde la configuración
         self.schema = self.settings.business_db_schema
+        # Logger con el esquema ya ligado (no se rearma el contexto en cada evento)
+        self.log = logger.bind(schema=self.schema)
         
         self.engine = create_async_engine(
             self.settings.business_db_url,
             echo=self.settings.app_debug,
-            pool_size=5,
-            max_overflow=10,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=self.settings.business_db_pool_size,
+            max_overflow=self.settings.business_db_max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            # Cache de sentencias preparadas de asyncpg (servidor) y del adaptador
+            # de SQLAlchemy (cliente): los UPSERT repetidos no se re-planifican
+            connect_args={
+                "statement_cache_size": 1024,
+                "prepared_statement_cache_size": 512,
+                "command_timeout": 10,
+            },
         )
-        self.async_session = sessionmaker(
-            self.engine,
-            class_=AsyncSession,
-            expire_on_commit=False,
+
+        # Definicion de la tabla y sentencias construidas una sola vez; se
+        # ejecutan directo sobre una conexion (sin sesion ORM) y SQLAlchemy
+        # reutiliza su forma compilada entre llamadas
+        self.users_table = Table(
+            "users",
+            MetaData(schema=self.schema),
+            Column("id", UUID(as_uuid=False), primary_key=True),
+            Column("email", String(255), nullable=False),
+            Column("full_name", String(200)),
+            Column("synced_at", DateTime, nullable=False, server_default=text("CURRENT_TIMESTAMP")),
+            Column("deleted_at", DateTime, nullable=True),
         )
 
-    async def ensure_table_exists(self) -> None:
-        """
-        Crea el esquema y la tabla de usuarios si no existen.
-        Esta tabla es una proyeccion de solo lectura para la base de negocio.
-        """
-        # 1. Asegurar que el esquema existe
-        create_schema_sql = text(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+        # Las marcas de tiempo las pone Postgres (en UTC, la columna no tiene zona)
+        utc_now = func.timezone("utc", func.now())
+
+        insert_stmt = pg_insert(self.users_table).values(synced_at=utc_now)
+        self._upsert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[self.users_table.c.id],
+            set_={
+                "email": insert_stmt.excluded.email,
+                "full_name": insert_stmt.excluded.full_name,
+                "synced_at": insert_stmt.excluded.synced_at,
+                "deleted_at": None,
+            },
+        )
+        self._soft_delete_stmt = (
+            update(self.users_table)
+            .where(self.users_table.c.id == bindparam("user_id"))
+            .values(deleted_at=utc_now)
+        )
+
+        # DDL de la proyeccion, con el prefijo del esquema configurado. Se envia
+        # como un solo script (protocolo simple de asyncpg, una ida y vuelta)
+        self._ddl_sql = f"""
+            CREATE SCHEMA IF NOT EXISTS {self.schema};
 
-        # 2. Crear la tabla dentro del esquema configurado
-        create_table_sql = text(f"""
             CREATE TABLE IF NOT EXISTS {self.schema}.users (
                 id UUID PRIMARY KEY,
                 email VARCHAR(255) NOT NULL,
                 full_name VARCHAR(200),
                 synced_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 deleted_at TIMESTAMP NULL
-            )
-        """)
-
-        # 3. Indices con el prefijo del esquema
-        create_index_email = text(
-            f"CREATE INDEX IF NOT EXISTS idx_users_email ON {self.schema}.users(email)"
-        )
+            );
 
-        create_index_deleted = text(
-            f"CREATE INDEX IF NOT EXISTS idx_users_deleted_at ON {self.schema}.users(deleted_at)"
-        )
+            CREATE INDEX IF NOT EXISTS idx_users_email ON {self.schema}.users(email);
+            CREATE INDEX IF NOT EXISTS idx_users_deleted_at ON {self.schema}.users(deleted_at);
+        """
 
-        async with self.engine.begin() as conn:
-            await conn.execute(create_schema_sql)
-            await conn.execute(create_table_sql)
-            await conn.execute(create_index_email)
-            await conn.execute(create_index_deleted)
-            logger.info("users_table_ensured", schema=self.schema)
+    async def ensure_table_exists(self) -> None:
+        """
+        Crea el esquema y la tabla de usuarios si no existen.
+        Esta tabla es una proyeccion de solo lectura para la base de negocio.
+        """
+        async with self.engine.connect() as conn:
+            # Un script con varias sentencias no se puede preparar; se ejecuta
+            # directo en la conexion asyncpg (Postgres lo corre en una transaccion implicita)
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.execute(self._ddl_sql)
+        self.log.info("users_table_ensured")
 
     async def sync_user(self, user_id: str, email: str, full_name: str) -> None:
         """
         Sincroniza o actualiza un usuario en la base de negocio.
         Usa UPSERT para manejar creacion y actualizacion.
         """
-        # Inserción apuntando al esquema configurado
-        upsert_sql = text(f"""
-            INSERT INTO {self.schema}.users (id, email, full_name, synced_at, deleted_at)
-            VALUES (:id, :email, :full_name, :synced_at, NULL)
-            ON CONFLICT (id) DO UPDATE SET
-                email = EXCLUDED.email,
-                full_name = EXCLUDED.full_name,
-                synced_at = EXCLUDED.synced_at,
-                deleted_at = NULL
-        """)
-
-        async with self.async_session() as session:
-            await session.execute(
-                upsert_sql,
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                self._upsert_stmt,
                 {
                     "id": user_id,
                     "email": email,
                     "full_name": full_name,
-                    "synced_at": datetime.utcnow(),
                 },
             )
-            await session.commit()
-            logger.info("user_synced", user_id=user_id, schema=self.schema)
+        self.log.info("user_synced", user_id=user_id)
+
+    async def sync_users_bulk(self, rows: list[dict[str, str]]) -> None:
+        """
+        Sincroniza varios usuarios en una sola transaccion.
+        Cada fila trae `id`, `email` y `full_name`; se ejecuta el mismo UPSERT
+        preparado en modo executemany (un solo plan para todas las filas).
+        """
+        if not rows:
+            return
+
+        async with self.engine.begin() as conn:
+            await conn.execute(self._upsert_stmt, rows)
+        self.log.info("users_synced", count=len(rows))
 
     async def delete_user(self, user_id: str) -> None:
         """
         Marca un usuario como eliminado (soft delete).
         No elimina fisicamente para mantener integridad referencial.
         """
-        soft_delete_sql = text(f"""
-            UPDATE {self.schema}.users 
-            SET deleted_at = :deleted_at
-            WHERE id = :id
-        """)
-
-        async with self.async_session() as session:
-            await session.execute(
-                soft_delete_sql,
-                {
-                    "id": user_id,
-                    "deleted_at": datetime.utcnow(),
-                },
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                self._soft_delete_stmt,
+                {"user_id": user_id},
             )
-            await session.commit()
-            logger.info("user_soft_deleted", user_id=user_id, schema=self.schema)
+        self.log.info("user_soft_deleted", user_id=user_id)
 
     async def close(self) -> None:
         """Cierra las conexiones a la base de datos."""
@@ -124,11 +158,6 @@ class UserSyncService:
 
 
 # Singleton
-_sync_service: UserSyncService | None = None
-
-
+@lru_cache
 def get_user_sync_service() -> UserSyncService:
-    global _sync_service
-    if _sync_service is None:
-        _sync_service = UserSyncService()
-    return _sync_service
\ No newline at end of file
+    return UserSyncService()
\ No newline at end of file
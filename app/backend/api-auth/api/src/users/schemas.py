@@ -1,3 +1,4 @@
+import msgspec
 from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime
 import re
@@ -62,7 +63,7 @@ class PasswordChange(BaseModel):
         return v
 
 
-class UserResponse(BaseModel):
+class UserResponse(msgspec.Struct):
     """Schema de respuesta de usuario."""
 
     id: str
@@ -75,7 +76,7 @@ class UserResponse(BaseModel):
     created_at: datetime | None = None
 
 
-class UserListResponse(BaseModel):
+class UserListResponse(msgspec.Struct):
     """Schema de respuesta para lista de usuarios."""
 
     users: list[UserResponse]
@@ -1,4 +1,7 @@
 from datetime import datetime
+from functools import lru_cache
+import asyncio
+import msgspec
 import structlog
 
 from src.auth.keycloak import get_keycloak_client, KeycloakAdminError
@@ -13,6 +16,9 @@ from src.users.schemas import (
 
 logger = structlog.get_logger()
 
+# Campos de UserUpdate que se proyectan a la base de negocio
+_SYNC_FIELDS = frozenset({"email", "first_name", "last_name"})
+
 
 class UserServiceError(Exception):
     """Error en operacion de servicio de usuarios."""
@@ -65,9 +71,19 @@ class UserService:
                 last_name=data.last_name,
             )
 
-            # Obtener datos completos
-            kc_user = await self.keycloak.get_user(user_id)
-            user = self._map_keycloak_user(kc_user)
+            # Construir la respuesta localmente: Keycloak ya retorno el ID y el resto
+            # de los datos son los enviados (Keycloak normaliza username/email a minusculas).
+            # created_at queda en None: el timestamp real solo lo conoce Keycloak
+            user = UserResponse(
+                id=user_id,
+                username=data.username,
+                email=data.email.lower(),
+                first_name=data.first_name,
+                last_name=data.last_name,
+                enabled=True,
+                email_verified=False,
+                created_at=None,
+            )
 
             # Sincronizar con base de negocio
             await self.sync_service.sync_user(
@@ -95,17 +111,27 @@ class UserService:
         Actualiza un usuario en Keycloak y sincroniza cambios.
         """
         try:
-            await self.keycloak.update_user(
+            update = self.keycloak.update_user(
                 user_id=user_id,
                 email=data.email,
                 first_name=data.first_name,
                 last_name=data.last_name,
                 enabled=data.enabled,
             )
-
-            # Obtener datos actualizados
-            kc_user = await self.keycloak.get_user(user_id)
-            user = self._map_keycloak_user(kc_user)
+            changes = data.model_dump(exclude_none=True)
+            if "email" in changes:
+                changes["email"] = changes["email"].lower()
+
+            if _SYNC_FIELDS.issubset(changes):
+                # Todos los campos proyectados vienen en el request: el estado actual
+                # (posiblemente cacheado) solo aporta el resto y se obtiene en paralelo al PUT
+                kc_user, _ = await asyncio.gather(self.keycloak.get_user(user_id), update)
+                user = msgspec.structs.replace(self._map_keycloak_user(kc_user), **changes)
+            else:
+                # Actualizacion parcial: se relee tras el PUT sin cache, para no
+                # proyectar valores viejos de los campos que no se enviaron
+                await update
+                user = self._map_keycloak_user(await self.keycloak.get_user(user_id, fresh=True))
 
             # Sincronizar cambios
             await self.sync_service.sync_user(
@@ -138,17 +164,22 @@ class UserService:
         """Lista usuarios con paginacion."""
         try:
             first = (page - 1) * page_size
-            kc_users = await self.keycloak.list_users(
-                first=first,
-                max_results=page_size,
-                search=search,
+            # La pagina y el total se piden en paralelo (Keycloak no retorna total en la lista)
+            kc_users, total = await asyncio.gather(
+                self.keycloak.list_users(
+                    first=first,
+                    max_results=page_size,
+                    search=search,
+                    brief=True,
+                ),
+                self.keycloak.count_users(search=search),
             )
 
             users = [self._map_keycloak_user(u) for u in kc_users]
 
             return UserListResponse(
                 users=users,
-                total=len(users),  # Keycloak no retorna total real
+                total=total,
                 page=page,
                 page_size=page_size,
             )
@@ -165,11 +196,6 @@ class UserService:
 
 
 # Singleton
-_user_service: UserService | None = None
-
-
+@lru_cache
 def get_user_service() -> UserService:
-    global _user_service
-    if _user_service is None:
-        _user_service = UserService()
-    return _user_service
\ No newline at end of file
+    return UserService()
\ No newline at end of file
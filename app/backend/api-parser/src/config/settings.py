@@ -34,6 +34,10 @@ class Settings(BaseSettings):
     TIMEOUT_AZURE_BASE: int = 60
     TIMEOUT_AZURE_PER_PAGE: int = 2
     TIMEOUT_AZURE_MAX: int = 600
+    AZURE_BATCH_SIZE: int = 4        # PDFs concurrentes agrupados en un análisis de layout; 1 = sin agrupar
+    AZURE_BATCH_WAIT_MS: int = 200   # Espera máxima para completar un lote
+    AZURE_BATCH_MAX_PAGES: int = 200  # Páginas máximas de un lote (más grandes se analizan solos)
+    AZURE_BATCH_MAX_MB: int = 50      # Tamaño máximo de un lote en MB
     
     # Conversión
     TIMEOUT_EXCEL_BASE: int = 30
@@ -47,10 +51,13 @@ class Settings(BaseSettings):
     
     # Límites
     MAX_FILE_SIZE_MB: int = 100
+    MAX_CONCURRENT_DOCS: int = 8    # Documentos de un despacho procesados en paralelo
+    MAX_CONCURRENT_EXTRACCIONES: int = 16  # Extracciones con modelo custom en curso (todo el proceso)
 
     # Thread Pool - Configuración dinámica del executor
     EXECUTOR_MAX_WORKERS: int = 32  # Máximo número de workers (se calcula como min(32, cpu_count * 4))
     EXECUTOR_MIN_WORKERS: int = 4   # Mínimo número de workers como fallback
+    PROCESS_POOL_WORKERS: int = 0   # Procesos para etapas CPU (calidad/segmentación); 0 = os.cpu_count()
 
     # Timeout para procesamiento de calidad - Adaptativo según número de páginas
     TIMEOUT_QUALITY_BASE: int = 30       # Tiempo base en segundos para cualquier documento
@@ -91,10 +98,11 @@ def calcular_timeout_calidad(num_paginas: int) -> int:
     return timeout
 
 
-def get_valid_api_tokens() -> set:
-    """Obtiene el conjunto de tokens API válidos desde la configuración."""
+@lru_cache()
+def get_valid_api_tokens() -> frozenset:
+    """Obtiene el conjunto de tokens API válidos desde la configuración (parseado una vez)."""
     settings = get_settings()
     if not settings.API_TOKENS:
-        return set()
-    tokens = [token.strip() for token in settings.API_TOKENS.split(',') if token.strip()]
-    return set(tokens)
\ No newline at end of file
+        return frozenset()
+    tokens = (token.strip() for token in settings.API_TOKENS.split(','))
+    return frozenset(token for token in tokens if token)
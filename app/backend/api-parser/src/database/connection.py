@@ -3,10 +3,10 @@ Módulo de persistencia para caché de resultados de procesamiento.
 Almacena clasificaciones y procesamientos en PostgreSQL.
 """
 import asyncpg
-import json
+import orjson
 import hashlib
 import logging
-from typing import Optional, Dict, List, Any
+from typing import AsyncIterator, Optional, Dict, List, Any
 from datetime import datetime
 from contextlib import asynccontextmanager
 
@@ -15,6 +15,18 @@ from config.settings import get_settings
 logger = logging.getLogger(__name__)
 
 
+def _json_dumps(value: Any) -> str:
+    """Serializa resultados para columnas JSONB; tipos no soportados se pasan a str."""
+    return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+async def _configurar_conexion(conn: asyncpg.Connection) -> None:
+    """Codifica y decodifica JSONB con orjson en el driver, en vez del módulo json."""
+    await conn.set_type_codec(
+        "jsonb", encoder=_json_dumps, decoder=orjson.loads, schema="pg_catalog"
+    )
+
+
 class DatabaseManager:
     """Gestor de conexiones y operaciones de base de datos."""
 
@@ -40,7 +52,8 @@ class DatabaseManager:
                 database=self._settings.DB_NAME,
                 min_size=2,
                 max_size=10,
-                command_timeout=60
+                command_timeout=60,
+                init=_configurar_conexion
             )
             await self._create_schema()
             logger.info("Pool de conexiones PostgreSQL inicializado")
@@ -109,26 +122,46 @@ class DatabaseManager:
 
 def calcular_hash_documentos(documentos: List[Dict]) -> str:
     """
-    Calcula un hash único basado en los documentos de un despacho.
+    Calcula un hash único basado en los documentos (dicts) de un despacho.
     Permite detectar cambios en la documentación.
     """
+    # Solo se hashean campos de identidad (nombre:id), nunca el contenido base64
     contenido = []
     for doc in documentos:
-        if isinstance(doc, dict):
-            nombre = doc.get("nombre_documento", doc.get("nombre", ""))
-            doc_id = doc.get("documento_id", doc.get("id", ""))
-            contenido.append(f"{nombre}:{doc_id}")
+        nombre = doc.get("nombre_documento", doc.get("nombre", ""))
+        doc_id = doc.get("documento_id", doc.get("id", ""))
+        contenido.append(f"{nombre}:{doc_id}")
     
     contenido.sort()
-    texto = "|".join(contenido)
-    return hashlib.sha256(texto.encode()).hexdigest()
+    # Incremental, equivalente a hashear "|".join(contenido) sin armar el string completo
+    hasher = hashlib.sha256()
+    for i, parte in enumerate(contenido):
+        if i:
+            hasher.update(b"|")
+        hasher.update(parte.encode())
+    return hasher.hexdigest()
 
 
 def calcular_hash_archivo(file_bytes: bytes) -> str:
-    """Calcula el hash SHA256 de un archivo."""
+    """
+    Calcula el hash SHA256 de un archivo.
+    Se mantiene SHA256 (no BLAKE3): es el hash que los clientes envían en X-Content-SHA256
+    y el que se expone en `hash_documentos`; OpenSSL ya lo acelera con SHA-NI.
+    """
     return hashlib.sha256(file_bytes).hexdigest()
 
 
+async def calcular_hash_archivo_streaming(chunks: AsyncIterator[bytes]) -> str:
+    """
+    Calcula el hash SHA256 a medida que se leen los bloques del archivo, sin
+    retenerlos: en memoria hay a lo sumo un bloque a la vez.
+    """
+    hasher = hashlib.sha256()
+    async for chunk in chunks:
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
 class CacheRepository:
     """Repositorio para operaciones de caché."""
 
@@ -173,7 +206,7 @@ class CacheRepository:
                     "estado": row["estado"],
                     "tipo": row["tipo"],
                     "total_documentos_segmentados": row["total_documentos_segmentados"],
-                    "resultado": json.loads(row["resultado"]) if isinstance(row["resultado"], str) else row["resultado"],
+                    "resultado": row["resultado"],
                     "created_at": row["created_at"],
                     "updated_at": row["updated_at"]
                 }
@@ -208,7 +241,7 @@ class CacheRepository:
                     updated_at = NOW()
                 RETURNING id
             """, codigo_despacho, tipo_operacion, documentos_hash, cliente, estado, tipo,
-                total_documentos_segmentados, json.dumps(resultado, default=str))
+                total_documentos_segmentados, resultado)
             
             logger.info(f"Despacho {codigo_despacho} guardado en caché ({tipo_operacion})")
             return row["id"]
@@ -218,24 +251,23 @@ class CacheRepository:
         archivo_hash: str,
         tipo_operacion: str
     ) -> Optional[Dict[str, Any]]:
-        """Obtiene un documento procesado del caché."""
+        """
+        Obtiene un documento procesado del caché.
+        Los documentos se retornan como texto JSON crudo (`documentos_json`) para que el
+        llamador los valide directamente, sin pasar por un árbol de dicts intermedio.
+        """
         async with self._db.connection() as conn:
             row = await conn.fetchrow(f"""
-                SELECT * FROM {self.schema}.documentos_procesados
+                SELECT id, archivo_hash, nombre_archivo, tipo_operacion,
+                       total_documentos_segmentados,
+                       (resultado->'documentos')::text AS documentos_json,
+                       created_at, updated_at
+                FROM {self.schema}.documentos_procesados
                 WHERE archivo_hash = $1 AND tipo_operacion = $2
             """, archivo_hash, tipo_operacion)
             
             if row:
-                return {
-                    "id": row["id"],
-                    "archivo_hash": row["archivo_hash"],
-                    "nombre_archivo": row["nombre_archivo"],
-                    "tipo_operacion": row["tipo_operacion"],
-                    "total_documentos_segmentados": row["total_documentos_segmentados"],
-                    "resultado": json.loads(row["resultado"]) if isinstance(row["resultado"], str) else row["resultado"],
-                    "created_at": row["created_at"],
-                    "updated_at": row["updated_at"]
-                }
+                return dict(row)
             return None
 
     async def guardar_documento(
@@ -260,7 +292,7 @@ class CacheRepository:
                     updated_at = NOW()
                 RETURNING id
             """, archivo_hash, nombre_archivo, tipo_operacion, 
-                total_documentos_segmentados, json.dumps(resultado, default=str))
+                total_documentos_segmentados, resultado)
             
             logger.info(f"Documento {nombre_archivo} guardado en caché ({tipo_operacion})")
             return row["id"]
@@ -4,6 +4,10 @@ from litestar.openapi import OpenAPIConfig
 from litestar.openapi.spec import Components, SecurityScheme
 
 from database.connection import db_manager
+from services.document_service import cerrar_process_executor
+from services.azure_service import close_azure_client
+from services.classification_engine import close_layout_batcher
+from services.legacy_service import close_legacy_client
 from routers.sgd import sgd_router
 from routers.documentos import documentos_router
 from routers.admin import admin_router, cache_router
@@ -28,7 +32,11 @@ async def on_startup():
 
 async def on_shutdown():
     """Cierra conexiones al detener la aplicación."""
+    await close_layout_batcher()
     await db_manager.close()
+    await close_azure_client()
+    await close_legacy_client()
+    cerrar_process_executor()
     logger.info("Conexiones cerradas")
 
 app = Litestar(
@@ -1,60 +1,81 @@
-import sys
-import io
-from contextlib import contextmanager
-from litestar import Request
+import hmac
+from litestar.connection import ASGIConnection
+from litestar.handlers.base import BaseRouteHandler
 from litestar.exceptions import HTTPException
 from litestar.status_codes import HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN, HTTP_500_INTERNAL_SERVER_ERROR
 
 # Ajustar imports asumiendo que config.py y token_manager.py están en el root
 from config.settings import get_settings, get_valid_api_tokens
 from services.token_service import token_manager
+from utils.validators import validar_content_length
 
 settings = get_settings()
 
-@contextmanager
-def suprimir_prints():
-    """Suprime temporalmente la salida a stdout."""
-    original_stdout = sys.stdout
-    sys.stdout = io.StringIO()
-    try:
-        yield
-    finally:
-        sys.stdout = original_stdout
-
-
-def get_bearer_token(request: Request) -> str:
-    """Extrae el token Bearer del header Authorization."""
-    auth_header = request.headers.get("Authorization", "")
-    if not auth_header.startswith("Bearer "):
+# Se calcula una vez al importar: la configuracion no cambia en caliente
+_ADMIN_TOKEN = settings.ADMIN_TOKEN.encode()
+
+
+def _is_admin_token(token: str) -> bool:
+    """Comparacion en tiempo constante contra ADMIN_TOKEN."""
+    return bool(_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), _ADMIN_TOKEN)
+
+
+def get_bearer_token(connection: ASGIConnection) -> str:
+    """Extrae el token Bearer del header Authorization (se guarda en el scope)."""
+    token = connection.scope.get("parsed_bearer")
+    if token is not None:
+        return token
+
+    auth_header = connection.headers.get("authorization") or ""
+    token = auth_header.removeprefix("Bearer ")
+    # removeprefix retorna el mismo objeto si el prefijo no estaba
+    if token is auth_header or not token:
         raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Token de autenticación requerido")
-    return auth_header[7:]
+
+    connection.scope["parsed_bearer"] = token
+    return token
 
 
-def verify_api_token(request: Request) -> str:
+def verify_api_token(connection: ASGIConnection) -> str:
     """Verifica que el token API proporcionado sea válido."""
-    token = get_bearer_token(request)
+    token = get_bearer_token(connection)
     
-    if settings.ADMIN_TOKEN and token == settings.ADMIN_TOKEN:
+    # Ambas verificaciones se evalúan siempre para no revelar cuál coincidió
+    is_admin = _is_admin_token(token)
+    # get_valid_api_tokens() ya esta cacheado; se consulta en cada request para
+    # respetar un cache_clear() posterior
+    is_env = token in get_valid_api_tokens()
+    if is_admin | is_env:
         return token
 
     if token_manager.is_valid_token(token):
         return token
 
-    valid_tokens = get_valid_api_tokens()
-    if valid_tokens and token in valid_tokens:
-        return token
-
     raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Token de autenticación inválido")
 
 
-def verify_admin_token(request: Request) -> str:
+def verify_admin_token(connection: ASGIConnection) -> str:
     """Verifica que el token de administrador sea válido."""
-    token = get_bearer_token(request)
+    token = get_bearer_token(connection)
     
     if not settings.ADMIN_TOKEN:
         raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail="ADMIN_TOKEN no configurado en el servidor")
 
-    if token != settings.ADMIN_TOKEN:
+    if not _is_admin_token(token):
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Se requiere token de administrador")
 
     return token
+
+
+async def admin_guard(connection: ASGIConnection, _: BaseRouteHandler) -> None:
+    """Guard de Litestar para routers de administración."""
+    verify_admin_token(connection)
+
+
+async def upload_guard(connection: ASGIConnection, _: BaseRouteHandler) -> None:
+    """
+    Guard para endpoints de carga de archivos. Corre antes de parsear el body
+    multipart: un token inválido o un Content-Length excesivo no consumen el upload.
+    """
+    verify_api_token(connection)
+    validar_content_length(connection.headers.get("content-length"))
@@ -1,10 +1,10 @@
 from typing import List, Optional
-from litestar import Router, get, post, delete, Request
+from litestar import Router, get, post, delete
 from litestar.status_codes import HTTP_200_OK, HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR
 from litestar.exceptions import HTTPException
 
 from config.settings import get_settings, get_valid_api_tokens
-from middleware import verify_admin_token
+from middleware import admin_guard
 from schemas import TokenInfo, TokenCreateRequest, TokenCreateResponse, TokenDeleteResponse
 from database.connection import cache_repo
 from services.token_service import token_manager
@@ -12,10 +12,8 @@ from services.token_service import token_manager
 settings = get_settings()
 
 @get("/")
-async def listar_tokens(request: Request) -> List[TokenInfo]:
+async def listar_tokens() -> List[TokenInfo]:
     """Lista todos los tokens de la API con su metadata."""
-    verify_admin_token(request)
-    
     tokens = token_manager.list_tokens()
 
     env_tokens = get_valid_api_tokens()
@@ -36,10 +34,8 @@ async def listar_tokens(request: Request) -> List[TokenInfo]:
 
 
 @post("/generate")
-async def generar_token(request: Request, data: TokenCreateRequest) -> TokenCreateResponse:
+async def generar_token(data: TokenCreateRequest) -> TokenCreateResponse:
     """Genera un nuevo token de autenticación API."""
-    verify_admin_token(request)
-    
     result = token_manager.generate_token(
         name=data.name,
         created_by="admin"
@@ -48,10 +44,8 @@ async def generar_token(request: Request, data: TokenCreateRequest) -> TokenCrea
 
 
 @delete("/{token_id:str}", status_code=HTTP_200_OK)
-async def eliminar_token(request: Request, token_id: str) -> TokenDeleteResponse:
+async def eliminar_token(token_id: str) -> TokenDeleteResponse:
     """Elimina un token por su ID."""
-    verify_admin_token(request)
-    
     success = token_manager.delete_token(token_id)
 
     if success:
@@ -68,13 +62,10 @@ async def eliminar_token(request: Request, token_id: str) -> TokenDeleteResponse
 
 @delete("/cache/despacho/{codigo_despacho:str}", status_code=HTTP_200_OK)
 async def eliminar_cache_despacho(
-    request: Request, 
     codigo_despacho: str,
     tipo_operacion: Optional[str] = None
 ) -> dict:
     """Elimina el caché de un despacho específico."""
-    verify_admin_token(request)
-    
     try:
         count = await cache_repo.eliminar_cache_despacho(codigo_despacho, tipo_operacion)
         return {
@@ -92,11 +83,13 @@ async def eliminar_cache_despacho(
 admin_router = Router(
     path="/admin/tokens",
     route_handlers=[listar_tokens, generar_token, eliminar_token],
+    guards=[admin_guard],
     tags=["Admin - Gestión de Tokens"]
 )
 
 cache_router = Router(
     path="/admin",
     route_handlers=[eliminar_cache_despacho],
+    guards=[admin_guard],
     tags=["Admin - Gestión de Caché"]
 )
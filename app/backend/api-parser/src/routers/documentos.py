@@ -1,280 +1,357 @@
+import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Annotated
-from litestar import Router, post, Request
+import msgspec
+import orjson
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Literal, Optional, Set, Tuple, Annotated
+from litestar import Response, Router, get, post
 from litestar.exceptions import HTTPException
-from litestar.status_codes import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR
+from litestar.status_codes import HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR
 from litestar.datastructures import UploadFile
-from litestar.enums import RequestEncodingType
+from litestar.enums import MediaType, RequestEncodingType
 from litestar.params import Body
+from litestar.openapi.datastructures import ResponseSpec
+from litestar.response import Stream
 
 from config.settings import get_settings
-from middleware import verify_api_token
+from middleware import upload_guard
 from schemas import (
-    ProcesamientoIndividualResponse, DocumentoFinal, Alerta, CacheInfo
+    ProcesamientoIndividualResponse, CacheInfo
 )
-from services.azure_service import eliminar_campos_vacios
-from services.pdf_service import convertir_excel_a_pdf, convertir_imagen_a_pdf
+from services.pdf_service import CONVERSOR_VERSION, FORMATOS
 from services.document_service import (
-    clasificar_pdf_completo, procesar_pdf_completo
+    clasificar_pdf_completo, procesar_pdf_completo,
+    documentos_respuesta, serializar_documentos_para_cache
 )
-from utils.validators import (
-    validar_tamano_archivo, es_archivo_excel, es_archivo_imagen, 
-    validar_excel, validar_imagen, validar_pdf
-)
-from database.connection import cache_repo, calcular_hash_archivo
+from utils.validators import iterar_archivo, nombre_pdf, tipo_archivo
+from database.connection import cache_repo, calcular_hash_archivo, calcular_hash_archivo_streaming
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-# In-memory storage for processed individual documents
-documentos_finales_individuales: Dict[str, List[Dict]] = {}
+# Sustantivo de cada operación para los logs
+_ETIQUETAS = {"clasificar": "clasificación", "procesar": "procesamiento"}
 
-@post("/clasificar")
-async def clasificar_documento_individual(
-    request: Request,
-    data: Annotated[UploadFile, Body(media_type=RequestEncodingType.MULTI_PART)],
-    force: bool = False
-) -> ProcesamientoIndividualResponse:
-    verify_api_token(request)
-    
-    nombre_archivo = data.filename.lower()
-    es_pdf = nombre_archivo.endswith('.pdf')
-    es_excel = es_archivo_excel(data.filename)
-    es_imagen = es_archivo_imagen(data.filename)
-
-    if not es_pdf and not es_excel and not es_imagen:
+
+def _respuesta_desde_cache(cached: Dict, archivo_origen: str, archivo_hash: str) -> Response:
+    """
+    Arma la respuesta a partir de una entrada de caché. Los documentos se escribieron
+    desde el pipeline propio, así que su JSON almacenado se envía tal cual, sin
+    reconstruir los structs de respuesta ni volver a serializarlos.
+    """
+    fecha_cache = str(cached["updated_at"])
+    cabecera = orjson.dumps({
+        "archivo_origen": archivo_origen,
+        "total_documentos_segmentados": cached["total_documentos_segmentados"],
+        "cache_info": {
+            "desde_cache": True,
+            "hash_documentos": archivo_hash,
+            "fecha_cache": fecha_cache,
+            "hay_cambios": None,
+        },
+    })
+    # Se reemplaza la "}" final de la cabecera por la lista de documentos almacenada
+    cuerpo = cabecera[:-1] + b',"documentos":' + cached["documentos_json"].encode() + b"}"
+    return Response(
+        content=cuerpo,
+        media_type=MediaType.JSON,
+        headers={"X-Cache": "HIT", "X-Cache-Date": fecha_cache},
+    )
+
+
+_encoder = msgspec.json.Encoder()
+
+
+def _serializar_por_partes(respuesta: ProcesamientoIndividualResponse) -> Iterator[bytes]:
+    """Serializa la respuesta emitiendo un documento a la vez."""
+    campos = msgspec.structs.asdict(respuesta)
+    documentos = campos.pop("documentos")
+    cabecera = _encoder.encode(campos)
+    # Se reemplaza la "}" final de la cabecera por el inicio de la lista de documentos
+    yield cabecera[:-1] + b',"documentos":['
+    for i, doc in enumerate(documentos):
+        if i:
+            yield b","
+        yield _encoder.encode(doc)
+    yield b"]}"
+
+
+def _respuesta_stream(respuesta: ProcesamientoIndividualResponse) -> Stream:
+    """Respuesta JSON en streaming: el primer byte sale sin serializar el resultado completo."""
+    return Stream(_serializar_por_partes(respuesta), media_type=MediaType.JSON)
+
+
+# Las respuestas no exponen el modelo; se documenta explícitamente en OpenAPI
+_RESPUESTAS_OPENAPI = {201: ResponseSpec(data_container=ProcesamientoIndividualResponse)}
+
+
+# Referencias fuertes a las escrituras de caché en curso (evita que el GC las cancele)
+_tareas_cache: Set[asyncio.Task] = set()
+
+
+# Ejecuciones en curso por (hash del PDF, operación): uploads simultáneos del mismo
+# archivo esperan la misma ejecución en vez de procesarlo de nuevo
+_inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+
+async def _ejecutar_y_guardar(
+    runner: Callable[[bytes, str], Awaitable[Dict[str, Any]]],
+    pdf_bytes: bytes,
+    nombre_procesamiento: str,
+    tipo_operacion: str,
+    claves: List[str],
+    nombre_archivo: str,
+) -> Tuple[Optional[str], List[Dict]]:
+    """
+    Cuerpo de la ejecución compartida: corre el pipeline y agenda el guardado en caché.
+    Al ser parte de la tarea (y no del handler), el resultado se guarda aunque el
+    solicitante que la inició se desconecte. Retorna (error, documentos).
+    """
+    resultado = await runner(pdf_bytes, nombre_procesamiento)
+    if resultado["error"]:
+        return resultado["error"], []
+
+    docs_dicts = serializar_documentos_para_cache(resultado["documentos_finales"])
+
+    # Archivo original y, si hubo conversión, el PDF generado
+    if settings.CACHE_ENABLED:
+        resultado_cache = {"documentos": docs_dicts}
+        for clave in claves:
+            _programar_guardado(
+                archivo_hash=clave,
+                nombre_archivo=nombre_archivo,
+                tipo_operacion=tipo_operacion,
+                total_documentos_segmentados=len(docs_dicts),
+                resultado=resultado_cache
+            )
+    return None, docs_dicts
+
+
+async def _ejecutar_una_vez(
+    claves: List[str],
+    tipo_operacion: str,
+    runner: Callable[[bytes, str], Awaitable[Dict[str, Any]]],
+    pdf_bytes: bytes,
+    nombre_procesamiento: str,
+    nombre_archivo: str,
+) -> Tuple[Optional[str], List[Dict]]:
+    """
+    Ejecuta `runner` (y el guardado en caché) o se une a una ejecución en curso
+    del mismo PDF (single-flight). Retorna (error, documentos).
+    """
+    key = (claves[-1], tipo_operacion)
+    task = _inflight.get(key)
+    if task is not None:
+        logger.info(f"Esperando {_ETIQUETAS[tipo_operacion]} en curso para {nombre_procesamiento}")
+        # shield: si este solicitante se cancela, la ejecución sigue para los demás
+        return await asyncio.shield(task)
+
+    task = asyncio.ensure_future(_ejecutar_y_guardar(
+        runner, pdf_bytes, nombre_procesamiento, tipo_operacion, claves, nombre_archivo
+    ))
+    _inflight[key] = task
+    task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def _guardar_en_cache(**kwargs: Any) -> None:
+    """Guarda un resultado en caché registrando (sin propagar) cualquier error."""
+    try:
+        await cache_repo.guardar_documento(**kwargs)
+    except Exception as e:
+        logger.warning(f"Error guardando en caché: {e}")
+
+
+def _programar_guardado(**kwargs: Any) -> None:
+    """Agenda la escritura en caché en segundo plano; la respuesta no la espera."""
+    tarea = asyncio.create_task(_guardar_en_cache(**kwargs))
+    _tareas_cache.add(tarea)
+    tarea.add_done_callback(_tareas_cache.discard)
+
+
+def _clave_cache(archivo_hash: str, tipo: str) -> str:
+    """
+    Clave de caché del archivo subido. Los PDF usan su propio hash; los formatos
+    convertidos incluyen la versión del conversor, para que un cambio en la
+    conversión invalide sus resultados.
+    """
+    if tipo == 'pdf':
+        return archivo_hash
+    return hashlib.sha256(f"{archivo_hash}:{tipo}:{CONVERSOR_VERSION}".encode()).hexdigest()
+
+
+async def _consultar_cache(clave: str, tipo_operacion: str) -> Optional[Dict[str, Any]]:
+    """Consulta la caché; un error se registra y se trata como fallo de caché."""
+    try:
+        return await cache_repo.obtener_documento(clave, tipo_operacion)
+    except Exception as e:
+        logger.warning(f"Error consultando caché: {e}")
+        return None
+
+
+_HEX = frozenset("0123456789abcdef")
+
+
+async def _consultar_por_hash(
+    archivo_hash: str,
+    nombre_archivo: str,
+    tipo_operacion: Literal["clasificar", "procesar"],
+) -> Response:
+    """
+    Flujo común de /{operación}/cache/{hash}: el cliente envía solo el SHA256 del
+    archivo y su nombre (para el tipo), sin body. Retorna el resultado cacheado o 404.
+    El contenido no se verifica: se confía en el hash declarado por el cliente.
+    """
+    archivo_hash = archivo_hash.strip().lower()
+    if len(archivo_hash) != 64 or not _HEX.issuperset(archivo_hash):
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Hash SHA256 inválido")
+
+    tipo = tipo_archivo(nombre_archivo)
+    if tipo is None:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail="Tipo de archivo no soportado")
+
+    cached = None
+    if settings.CACHE_ENABLED:
+        cached = await _consultar_cache(_clave_cache(archivo_hash, tipo), tipo_operacion)
+    if not cached:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Resultado no encontrado en caché")
+
+    logger.info(f"Retornando {_ETIQUETAS[tipo_operacion]} desde caché (hash del cliente) para {nombre_archivo}")
+    return _respuesta_desde_cache(cached, nombre_archivo, archivo_hash)
+
+
+async def _procesar_upload(
+    data: UploadFile,
+    force: bool,
+    tipo_operacion: Literal["clasificar", "procesar"],
+    runner: Callable[[bytes, str], Awaitable[Dict[str, Any]]],
+) -> Response:
+    """
+    Flujo común de /clasificar y /procesar: validación, caché, conversión y ejecución.
+    Token y tamaño declarado ya fueron verificados por `upload_guard`.
+    """
+    tipo = tipo_archivo(data.filename)
+
+    if tipo is None:
         raise HTTPException(
             status_code=HTTP_400_BAD_REQUEST,
             detail="Solo se aceptan archivos PDF, Excel (.xls, .xlsx, .xlsm, .xlsb, .xltx, .xltm) o imágenes (.jpg, .jpeg, .png, .gif, .bmp, .tiff, .webp)"
         )
 
     try:
+        # Primera pasada por bloques: valida el tamaño y calcula el hash sin retener el
+        # contenido; luego se lee una sola vez (nunca hay dos copias del archivo en memoria)
+        archivo_hash = await calcular_hash_archivo_streaming(iterar_archivo(data))
+        await data.seek(0)
         file_bytes = await data.read()
-        archivo_hash = calcular_hash_archivo(file_bytes)
-
-        validar_tamano_archivo(file_bytes)
 
         # Verificar caché
+        clave = _clave_cache(archivo_hash, tipo)
+        consultar = settings.CACHE_ENABLED and not force
         cache_info = None
-        if settings.CACHE_ENABLED and not force:
-            try:
-                cached = await cache_repo.obtener_documento(archivo_hash, "clasificar")
+        if consultar:
+            cached = await _consultar_cache(clave, tipo_operacion)
+            if cached:
+                logger.info(f"Retornando {_ETIQUETAS[tipo_operacion]} desde caché para {data.filename}")
+                return _respuesta_desde_cache(cached, data.filename, archivo_hash)
+            cache_info = CacheInfo(desde_cache=False, hash_documentos=archivo_hash)
+
+        # La validación de formato (CPU) corre en un hilo, y solo ante un miss de caché:
+        # un hilo no se puede cancelar, así que no se lanza si la respuesta ya está cacheada
+        formato = FORMATOS[tipo]
+        if not await asyncio.to_thread(formato.validador, file_bytes, data.filename):
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail=formato.mensaje_invalido
+            )
+
+        claves = [clave]
+        if formato.conversor is None:
+            pdf_bytes = file_bytes
+            nombre_procesamiento = data.filename
+        else:
+            pdf_bytes = await formato.conversor(file_bytes, data.filename)
+            nombre_procesamiento = nombre_pdf(data.filename)
+
+            # La conversión es determinista: un archivo con el mismo contenido pero
+            # distintos bytes (p. ej. otra compresión) genera el mismo PDF
+            # hashlib libera el GIL: el hash del PDF (potencialmente grande) corre en un hilo
+            pdf_hash = await asyncio.to_thread(calcular_hash_archivo, pdf_bytes)
+            claves.append(pdf_hash)
+            if consultar:
+                cached = await _consultar_cache(pdf_hash, tipo_operacion)
                 if cached:
-                    logger.info(f"Retornando clasificación desde caché para {data.filename}")
-                    docs_response = [
-                        DocumentoFinal(**doc) for doc in cached["resultado"]["documentos"]
-                    ]
-                    return ProcesamientoIndividualResponse(
-                        archivo_origen=data.filename,
+                    logger.info(f"Retornando {_ETIQUETAS[tipo_operacion]} desde caché (PDF convertido) para {data.filename}")
+                    # Se registra también bajo la clave del archivo original para omitir la conversión la próxima vez
+                    _programar_guardado(
+                        archivo_hash=clave,
+                        nombre_archivo=data.filename,
+                        tipo_operacion=tipo_operacion,
                         total_documentos_segmentados=cached["total_documentos_segmentados"],
-                        documentos=docs_response,
-                        cache_info=CacheInfo(
-                            desde_cache=True,
-                            hash_documentos=archivo_hash,
-                            fecha_cache=str(cached["updated_at"])
-                        )
+                        resultado={"documentos": orjson.loads(cached["documentos_json"])}
                     )
-                cache_info = CacheInfo(desde_cache=False, hash_documentos=archivo_hash)
-            except Exception as e:
-                logger.warning(f"Error consultando caché: {e}")
-                cache_info = CacheInfo(desde_cache=False, hash_documentos=archivo_hash)
-
-        if es_excel:
-            if not validar_excel(file_bytes, data.filename):
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST,
-                    detail="El archivo no es un Excel válido"
-                )
-            pdf_bytes = await convertir_excel_a_pdf(file_bytes, data.filename)
-            nombre_procesamiento = data.filename.rsplit('.', 1)[0] + '.pdf'
-        elif es_imagen:
-            if not validar_imagen(file_bytes, data.filename):
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST,
-                    detail="El archivo no es una imagen válida"
-                )
-            pdf_bytes = await convertir_imagen_a_pdf(file_bytes, data.filename)
-            nombre_procesamiento = data.filename.rsplit('.', 1)[0] + '.pdf'
-        else:
-            if not validar_pdf(file_bytes):
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST,
-                    detail="El archivo no es un PDF válido"
-                )
-            pdf_bytes = file_bytes
-            nombre_procesamiento = data.filename
+                    return _respuesta_desde_cache(cached, data.filename, archivo_hash)
+
+        error, docs_dicts = await _ejecutar_una_vez(
+            claves, tipo_operacion, runner, pdf_bytes, nombre_procesamiento, data.filename
+        )
 
-        resultado = await clasificar_pdf_completo(pdf_bytes, nombre_procesamiento)
-
-        if resultado["error"]:
-            raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error al clasificar: {resultado['error']}")
-
-        documentos_finales_individuales[data.filename] = resultado["documentos_finales"]
-
-        docs_response = []
-        for doc_final in resultado["documentos_finales"]:
-            datos_limpios = None
-            if doc_final.get("datos_extraidos"):
-                datos_limpios = eliminar_campos_vacios(doc_final.get("datos_extraidos"))
-
-            docs_response.append(DocumentoFinal(
-                archivo_origen=doc_final["archivo_origen"],
-                nombre_salida=doc_final["nombre_salida"],
-                tipo=doc_final["tipo"],
-                paginas=doc_final["paginas"],
-                alertas=[Alerta(**alerta) for alerta in doc_final["alertas"]] if doc_final["alertas"] else None,
-                datos_extraidos=datos_limpios
-            ))
-
-        # Guardar en caché
-        if settings.CACHE_ENABLED:
-            try:
-                await cache_repo.guardar_documento(
-                    archivo_hash=archivo_hash,
-                    nombre_archivo=data.filename,
-                    tipo_operacion="clasificar",
-                    total_documentos_segmentados=len(docs_response),
-                    resultado={"documentos": [doc.model_dump() for doc in docs_response]}
-                )
-            except Exception as e:
-                logger.warning(f"Error guardando en caché: {e}")
-
-        return ProcesamientoIndividualResponse(
+        if error:
+            raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error al {tipo_operacion}: {error}")
+
+        docs_response = documentos_respuesta(docs_dicts)
+
+        return _respuesta_stream(ProcesamientoIndividualResponse(
             archivo_origen=data.filename,
             total_documentos_segmentados=len(docs_response),
             documentos=docs_response,
             cache_info=cache_info
-        )
+        ))
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error al clasificar documento: {str(e)}")
+        raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error al {tipo_operacion} documento: {str(e)}")
 
 
-@post("/procesar")
+@post("/clasificar", responses=_RESPUESTAS_OPENAPI)
+async def clasificar_documento_individual(
+    data: Annotated[UploadFile, Body(media_type=RequestEncodingType.MULTI_PART)],
+    force: bool = False
+) -> Response:
+    return await _procesar_upload(data, force, "clasificar", clasificar_pdf_completo)
+
+
+@post("/procesar", responses=_RESPUESTAS_OPENAPI)
 async def procesar_documento_individual(
-    request: Request,
     data: Annotated[UploadFile, Body(media_type=RequestEncodingType.MULTI_PART)],
     force: bool = False
-) -> ProcesamientoIndividualResponse:
-    verify_api_token(request)
-    
-    nombre_archivo = data.filename.lower()
-    es_pdf = nombre_archivo.endswith('.pdf')
-    es_excel = es_archivo_excel(data.filename)
-    es_imagen = es_archivo_imagen(data.filename)
-
-    if not es_pdf and not es_excel and not es_imagen:
-        raise HTTPException(
-            status_code=HTTP_400_BAD_REQUEST,
-            detail="Solo se aceptan archivos PDF, Excel (.xls, .xlsx, .xlsm, .xlsb, .xltx, .xltm) o imágenes (.jpg, .jpeg, .png, .gif, .bmp, .tiff, .webp)"
-        )
+) -> Response:
+    return await _procesar_upload(data, force, "procesar", procesar_pdf_completo)
 
-    try:
-        file_bytes = await data.read()
-        archivo_hash = calcular_hash_archivo(file_bytes)
 
-        validar_tamano_archivo(file_bytes)
+_DESCRIPCION_CACHE = (
+    "Consulta sin subir el archivo: el cliente envía el SHA256 del archivo y su nombre. "
+    "El resultado se sirve sin verificar el contenido (se confía en el hash declarado); "
+    "ante un 404, subir el archivo al endpoint normal."
+)
 
-        # Verificar caché
-        cache_info = None
-        if settings.CACHE_ENABLED and not force:
-            try:
-                cached = await cache_repo.obtener_documento(archivo_hash, "procesar")
-                if cached:
-                    logger.info(f"Retornando procesamiento desde caché para {data.filename}")
-                    docs_response = [
-                        DocumentoFinal(**doc) for doc in cached["resultado"]["documentos"]
-                    ]
-                    return ProcesamientoIndividualResponse(
-                        archivo_origen=data.filename,
-                        total_documentos_segmentados=cached["total_documentos_segmentados"],
-                        documentos=docs_response,
-                        cache_info=CacheInfo(
-                            desde_cache=True,
-                            hash_documentos=archivo_hash,
-                            fecha_cache=str(cached["updated_at"])
-                        )
-                    )
-                cache_info = CacheInfo(desde_cache=False, hash_documentos=archivo_hash)
-            except Exception as e:
-                logger.warning(f"Error consultando caché: {e}")
-                cache_info = CacheInfo(desde_cache=False, hash_documentos=archivo_hash)
-
-        if es_excel:
-            if not validar_excel(file_bytes, data.filename):
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST,
-                    detail="El archivo no es un Excel válido"
-                )
-            pdf_bytes = await convertir_excel_a_pdf(file_bytes, data.filename)
-            nombre_procesamiento = data.filename.rsplit('.', 1)[0] + '.pdf'
-        elif es_imagen:
-            if not validar_imagen(file_bytes, data.filename):
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST,
-                    detail="El archivo no es una imagen válida"
-                )
-            pdf_bytes = await convertir_imagen_a_pdf(file_bytes, data.filename)
-            nombre_procesamiento = data.filename.rsplit('.', 1)[0] + '.pdf'
-        else:
-            if not validar_pdf(file_bytes):
-                raise HTTPException(
-                    status_code=HTTP_400_BAD_REQUEST,
-                    detail="El archivo no es un PDF válido"
-                )
-            pdf_bytes = file_bytes
-            nombre_procesamiento = data.filename
 
-        resultado = await procesar_pdf_completo(pdf_bytes, nombre_procesamiento)
-        
-        if resultado["error"]:
-            raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error al procesar: {resultado['error']}")
-        
-        documentos_finales_individuales[data.filename] = resultado["documentos_finales"]
-        
-        docs_response = []
-        for doc_final in resultado["documentos_finales"]:
-            datos_limpios = None
-            if doc_final.get("datos_extraidos"):
-                datos_limpios = eliminar_campos_vacios(doc_final.get("datos_extraidos"))
-
-            docs_response.append(DocumentoFinal(
-                archivo_origen=doc_final["archivo_origen"],
-                nombre_salida=doc_final["nombre_salida"],
-                tipo=doc_final["tipo"],
-                paginas=doc_final["paginas"],
-                alertas=[Alerta(**alerta) for alerta in doc_final["alertas"]] if doc_final["alertas"] else None,
-                datos_extraidos=datos_limpios
-            ))
-
-        # Guardar en caché
-        if settings.CACHE_ENABLED:
-            try:
-                await cache_repo.guardar_documento(
-                    archivo_hash=archivo_hash,
-                    nombre_archivo=data.filename,
-                    tipo_operacion="procesar",
-                    total_documentos_segmentados=len(docs_response),
-                    resultado={"documentos": [doc.model_dump() for doc in docs_response]}
-                )
-            except Exception as e:
-                logger.warning(f"Error guardando en caché: {e}")
-
-        return ProcesamientoIndividualResponse(
-            archivo_origen=data.filename,
-            total_documentos_segmentados=len(docs_response),
-            documentos=docs_response,
-            cache_info=cache_info
-        )
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error al procesar documento: {str(e)}")
+@get("/clasificar/cache/{archivo_hash:str}", responses=_RESPUESTAS_OPENAPI, description=_DESCRIPCION_CACHE)
+async def clasificar_desde_cache(archivo_hash: str, nombre_archivo: str) -> Response:
+    return await _consultar_por_hash(archivo_hash, nombre_archivo, "clasificar")
+
+
+@get("/procesar/cache/{archivo_hash:str}", responses=_RESPUESTAS_OPENAPI, description=_DESCRIPCION_CACHE)
+async def procesar_desde_cache(archivo_hash: str, nombre_archivo: str) -> Response:
+    return await _consultar_por_hash(archivo_hash, nombre_archivo, "procesar")
 
 
 documentos_router = Router(
     path="/documentos",
-    route_handlers=[clasificar_documento_individual, procesar_documento_individual],
+    route_handlers=[
+        clasificar_documento_individual, procesar_documento_individual,
+        clasificar_desde_cache, procesar_desde_cache,
+    ],
+    guards=[upload_guard],
     tags=["Documentos"]
 )
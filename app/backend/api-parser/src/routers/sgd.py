@@ -1,6 +1,7 @@
-import base64
+import asyncio
+import pybase64
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional
 from litestar import Router, get, post, Request
 from litestar.exceptions import HTTPException
 from litestar.status_codes import HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_ERROR
@@ -8,26 +9,137 @@ from litestar.status_codes import HTTP_404_NOT_FOUND, HTTP_500_INTERNAL_SERVER_E
 from config.settings import get_settings
 from middleware import verify_api_token
 from schemas import (
-    ProcesamientoResponse, DocumentoFinal, Alerta, CacheInfo, 
+    ProcesamientoResponse, CacheInfo, 
     DocumentoSimplificado, Usuarios
 )
 from services.legacy_service import consultar_despacho_detalle, consultar_documentacion
-from services.azure_service import eliminar_campos_vacios
-from services.pdf_service import convertir_excel_a_pdf, convertir_imagen_a_pdf
+from services.pdf_service import FORMATOS
 from services.document_service import (
-    clasificar_pdf_completo, procesar_pdf_completo, serializar_documentos_para_cache
-)
-from utils.validators import (
-    validar_tamano_archivo, es_archivo_excel, es_archivo_imagen, 
-    validar_excel, validar_imagen, validar_pdf
+    clasificar_pdf_completo, procesar_pdf_completo,
+    documentos_respuesta, serializar_documentos_para_cache
 )
+from utils.validators import firma_valida, nombre_pdf, validar_tamano_archivo, tipo_archivo
 from database.connection import cache_repo, calcular_hash_documentos, calcular_hash_archivo
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-# In-memory storage for processed documents (migrated from main.py)
-documentos_finales_sgd: Dict[str, List[Dict]] = {}
+# Rol del SGD -> grupo de usuarios en la respuesta de /consultar
+_GRUPO_POR_ROL = {
+    "pedidor": "pedidor",
+    "pedidor_exportaciones": "pedidor",
+    "jefe_operaciones": "jefe_operaciones",
+}
+_GRUPOS_USUARIOS = ("pedidor", "jefe_operaciones")
+
+_MAX_BYTES = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+# Caracteres base64 que se decodifican para revisar la firma del archivo (258 bytes)
+_CARACTERES_CABECERA = 344
+
+
+def _solo_dicts(items: Any) -> List[Dict[str, Any]]:
+    """Filtra una lista del SGD dejando solo los objetos (una lista inválida se trata como vacía)."""
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if isinstance(item, dict)]
+
+
+def _inicio_contenido(base64_data: str) -> int:
+    """Posición donde empieza el base64, después del prefijo data URI ("data:...;base64,") si existe."""
+    return base64_data.find(",", 0, 64) + 1
+
+
+def _tamano_decodificado(base64_data: str, inicio: int) -> int:
+    """Tamaño en bytes del contenido decodificado, calculado sin decodificar."""
+    caracteres = len(base64_data) - inicio
+    if caracteres * 3 // 4 > _MAX_BYTES:
+        # Solo cerca del límite vale la pena recorrer el payload: en base64 con saltos
+        # de línea (MIME, cada 76 caracteres) los separadores no son contenido
+        caracteres -= base64_data.count("\n", inicio) + base64_data.count("\r", inicio)
+    return caracteres * 3 // 4 - base64_data[-2:].count("=")
+
+
+def _cabecera_valida(base64_data: str, inicio: int, tipo: str, nombre_documento: str) -> bool:
+    """Decodifica solo el inicio del documento y verifica la firma de su tipo."""
+    try:
+        cabecera = pybase64.b64decode(base64_data[inicio:inicio + _CARACTERES_CABECERA], validate=False)
+    except ValueError:
+        # Base64 con saltos de línea u otros separadores: se valida sobre el archivo completo
+        return True
+    return firma_valida(cabecera, tipo, nombre_documento)
+
+
+def _decodificar_documento(base64_data: str, inicio: int) -> bytes:
+    """
+    Decodifica el contenido base64 desde `inicio`. Se decodifica desde una vista, sin
+    copiar el payload completo.
+    """
+    datos = base64_data.encode("ascii")
+    return pybase64.b64decode(memoryview(datos)[inicio:], validate=False)
+
+
+async def _procesar_documento(
+    doc: Dict[str, Any],
+    runner: Callable[[bytes, str], Awaitable[Dict[str, Any]]],
+) -> List[Dict[str, Any]]:
+    """
+    Decodifica, valida, convierte a PDF y ejecuta `runner` sobre un documento del SGD.
+    Un documento inválido o con error se omite (retorna lista vacía).
+    """
+    try:
+        nombre_documento = doc.get("nombre_documento", "documento.pdf")
+        base64_data = doc.get("documento", "")
+        # Extensiones no reconocidas se tratan como PDF
+        tipo = tipo_archivo(nombre_documento) or 'pdf'
+
+        # Un documento sobre el límite o con firma inválida se descarta sin decodificarlo
+        inicio = _inicio_contenido(base64_data)
+        if _tamano_decodificado(base64_data, inicio) > _MAX_BYTES:
+            return []
+        if not _cabecera_valida(base64_data, inicio, tipo, nombre_documento):
+            return []
+
+        # Decodificación y validación son CPU (pybase64 libera el GIL): corren en hilos
+        # para no bloquear el event loop
+        file_bytes = await asyncio.to_thread(_decodificar_documento, base64_data, inicio)
+
+        validar_tamano_archivo(file_bytes)
+
+        formato = FORMATOS[tipo]
+        if not await asyncio.to_thread(formato.validador, file_bytes, nombre_documento):
+            return []
+        if formato.conversor is None:
+            pdf_bytes = file_bytes
+            nombre_procesamiento = nombre_documento
+        else:
+            pdf_bytes = await formato.conversor(file_bytes, nombre_documento)
+            nombre_procesamiento = nombre_pdf(nombre_documento)
+
+        resultado = await runner(pdf_bytes, nombre_procesamiento)
+        if resultado["error"]:
+            return []
+        return resultado["documentos_finales"]
+    except Exception:
+        return []
+
+
+async def _procesar_documentos(
+    documentos: List[Dict[str, Any]],
+    runner: Callable[[bytes, str], Awaitable[Dict[str, Any]]],
+) -> List[Dict[str, Any]]:
+    """
+    Procesa los documentos de un despacho en paralelo (hasta MAX_CONCURRENT_DOCS a la vez).
+    Los documentos no dependen entre sí; el resultado conserva el orden original.
+    """
+    semaforo = asyncio.Semaphore(max(settings.MAX_CONCURRENT_DOCS, 1))
+
+    async def acotado(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+        async with semaforo:
+            return await _procesar_documento(doc, runner)
+
+    resultados = await asyncio.gather(*(acotado(doc) for doc in documentos))
+    return [doc_final for docs in resultados for doc_final in docs]
+
 
 @get("/consultar/{codigo_despacho:str}")
 async def consultar_despacho(request: Request, codigo_despacho: str) -> dict:
@@ -48,40 +160,26 @@ async def consultar_despacho(request: Request, codigo_despacho: str) -> dict:
             cliente_nombre = cliente.get("nombre", "N/A") if isinstance(cliente, dict) else "N/A"
             
             documentos_list = despacho_data.get("documentos", [])
-            if not isinstance(documentos_list, list):
-                documentos_list = []
             
             documentos_simplificados = []
-            for doc in documentos_list:
-                if isinstance(doc, dict):
-                    tipo = doc.get("tipo", {})
-                    documentos_simplificados.append({
-                        "nombre": tipo.get("nombre", "Sin nombre") if isinstance(tipo, dict) else "Sin nombre",
-                        "estado": doc.get("estado", "N/A"),
-                        "fecha_recepcion": doc.get("fecha_recepcion", "N/A")
-                    })
+            for doc in _solo_dicts(documentos_list):
+                tipo = doc.get("tipo", {})
+                documentos_simplificados.append({
+                    "nombre": tipo.get("nombre", "Sin nombre") if isinstance(tipo, dict) else "Sin nombre",
+                    "estado": doc.get("estado", "N/A"),
+                    "fecha_recepcion": doc.get("fecha_recepcion", "N/A")
+                })
             
             usuarios_list = despacho_data.get("usuarios", [])
-            if not isinstance(usuarios_list, list):
-                usuarios_list = []
             
-            pedidores = []
-            jefes_operaciones = []
+            grupos: Dict[str, List[str]] = {grupo: [] for grupo in _GRUPOS_USUARIOS}
             
-            for user in usuarios_list:
-                if isinstance(user, dict):
-                    role_name = user.get("role_name", "")
-                    nombre = user.get("name", "")
-                    
-                    if role_name in ("pedidor", "pedidor_exportaciones"):
-                        pedidores.append(nombre)
-                    elif role_name == "jefe_operaciones":
-                        jefes_operaciones.append(nombre)
+            for user in _solo_dicts(usuarios_list):
+                grupo = _GRUPO_POR_ROL.get(user.get("role_name", ""))
+                if grupo is not None:
+                    grupos[grupo].append(user.get("name", ""))
             
-            usuarios_datos = {
-                "pedidor": pedidores if pedidores else None,
-                "jefe_operaciones": jefes_operaciones if jefes_operaciones else None
-            }
+            usuarios_datos = {grupo: nombres or None for grupo, nombres in grupos.items()}
             
             return {
                 "codigo_despacho": codigo_visible,
@@ -97,13 +195,13 @@ async def consultar_despacho(request: Request, codigo_despacho: str) -> dict:
     documentos_base64_list = await consultar_documentacion(codigo_despacho, settings.BEARER_TOKEN)
     
     if documentos_base64_list and isinstance(documentos_base64_list, list):
-        documentos_info = []
-        for doc in documentos_base64_list:
-            if isinstance(doc, dict):
-                documentos_info.append({
-                    "nombre": doc.get("nombre_documento", "Sin nombre"),
-                    "documento_id": doc.get("documento_id", "N/A")
-                })
+        documentos_info = [
+            {
+                "nombre": doc.get("nombre_documento", "Sin nombre"),
+                "documento_id": doc.get("documento_id", "N/A")
+            }
+            for doc in _solo_dicts(documentos_base64_list)
+        ]
         
         return {
             "codigo": codigo_despacho,
@@ -115,12 +213,17 @@ async def consultar_despacho(request: Request, codigo_despacho: str) -> dict:
     raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Despacho no encontrado")
 
 
-@post("/clasificar/{codigo_despacho:str}")
-async def clasificar_despacho(
-    request: Request, 
+async def _ejecutar_despacho(
+    request: Request,
     codigo_despacho: str,
-    force: bool = False
+    force: bool,
+    tipo_operacion: Literal["clasificar", "procesar"],
+    runner: Callable[[bytes, str], Awaitable[Dict[str, Any]]],
 ) -> ProcesamientoResponse:
+    """
+    Flujo común de /clasificar y /procesar: obtiene los documentos del despacho,
+    consulta el caché, ejecuta `runner` sobre cada documento y guarda el resultado.
+    """
     verify_api_token(request)
     
     if not settings.BEARER_TOKEN:
@@ -153,6 +256,9 @@ async def clasificar_despacho(
     if not documentos_base64_list or not isinstance(documentos_base64_list, list):
         raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No se pudieron obtener los documentos")
 
+    # Entradas que no son objetos se descartan una vez; hash y procesamiento no las revisan
+    documentos_base64_list = _solo_dicts(documentos_base64_list)
+
     # Calcular hash de documentos actuales
     documentos_hash = calcular_hash_documentos(documentos_base64_list)
 
@@ -161,19 +267,17 @@ async def clasificar_despacho(
     if settings.CACHE_ENABLED and not force:
         try:
             estado_cache = await cache_repo.verificar_cambios_despacho(
-                codigo_despacho, "clasificar", documentos_hash
+                codigo_despacho, tipo_operacion, documentos_hash
             )
             
             if estado_cache["existe_cache"] and not estado_cache["hay_cambios"]:
                 # Retornar desde caché
                 cached = await cache_repo.obtener_despacho(
-                    codigo_despacho, "clasificar", documentos_hash
+                    codigo_despacho, tipo_operacion, documentos_hash
                 )
                 if cached:
-                    logger.info(f"Retornando clasificación desde caché para {codigo_despacho}")
-                    docs_response = [
-                        DocumentoFinal(**doc) for doc in cached["resultado"]["documentos"]
-                    ]
+                    logger.info(f"Retornando {tipo_operacion} desde caché para {codigo_despacho}")
+                    docs_response = documentos_respuesta(cached["resultado"]["documentos"])
                     return ProcesamientoResponse(
                         codigo_despacho=codigo_despacho,
                         cliente=cached["cliente"],
@@ -200,84 +304,23 @@ async def clasificar_despacho(
             cache_info = CacheInfo(desde_cache=False, hash_documentos=documentos_hash)
 
     # Procesar documentos
-    todos_documentos_finales = []
-
-    for doc in documentos_base64_list:
-        if isinstance(doc, dict):
-            base64_data = doc.get("documento", "")
-
-            if ',' in base64_data:
-                _, base64_content = base64_data.split(',', 1)
-            else:
-                base64_content = base64_data
-
-            try:
-                file_bytes = base64.b64decode(base64_content)
-                nombre_documento = doc.get("nombre_documento", "documento.pdf")
-
-                validar_tamano_archivo(file_bytes)
-
-                if es_archivo_excel(nombre_documento):
-                    if not validar_excel(file_bytes, nombre_documento):
-                        continue
-                    try:
-                        pdf_bytes = await convertir_excel_a_pdf(file_bytes, nombre_documento)
-                        nombre_procesamiento = nombre_documento.rsplit('.', 1)[0] + '.pdf'
-                    except Exception:
-                        continue
-                elif es_archivo_imagen(nombre_documento):
-                    if not validar_imagen(file_bytes, nombre_documento):
-                        continue
-                    try:
-                        pdf_bytes = await convertir_imagen_a_pdf(file_bytes, nombre_documento)
-                        nombre_procesamiento = nombre_documento.rsplit('.', 1)[0] + '.pdf'
-                    except Exception:
-                        continue
-                else:
-                    if not validar_pdf(file_bytes):
-                        continue
-                    pdf_bytes = file_bytes
-                    nombre_procesamiento = nombre_documento
-
-                resultado = await clasificar_pdf_completo(pdf_bytes, nombre_procesamiento)
-
-                if resultado["error"]:
-                    continue
-
-                todos_documentos_finales.extend(resultado["documentos_finales"])
-
-            except Exception:
-                continue
-
-    documentos_finales_sgd[codigo_despacho] = todos_documentos_finales
-
-    docs_response = []
-    for doc_final in todos_documentos_finales:
-        datos_limpios = None
-        if doc_final.get("datos_extraidos"):
-             datos_limpios = eliminar_campos_vacios(doc_final.get("datos_extraidos"))
-
-        docs_response.append(DocumentoFinal(
-            archivo_origen=doc_final["archivo_origen"],
-            nombre_salida=doc_final["nombre_salida"],
-            tipo=doc_final["tipo"],
-            paginas=doc_final["paginas"],
-            alertas=[Alerta(**alerta) for alerta in doc_final["alertas"]] if doc_final["alertas"] else None,
-            datos_extraidos=datos_limpios
-        ))
+    todos_documentos_finales = await _procesar_documentos(documentos_base64_list, runner)
+
+    docs_dicts = serializar_documentos_para_cache(todos_documentos_finales)
+    docs_response = documentos_respuesta(docs_dicts)
 
     # Guardar en caché
     if settings.CACHE_ENABLED:
         try:
             await cache_repo.guardar_despacho(
                 codigo_despacho=codigo_despacho,
-                tipo_operacion="clasificar",
+                tipo_operacion=tipo_operacion,
                 documentos_hash=documentos_hash,
                 cliente=cliente_nombre,
                 estado=estado_despacho,
                 tipo=tipo_despacho,
                 total_documentos_segmentados=len(docs_response),
-                resultado={"documentos": [doc.model_dump() for doc in docs_response]}
+                resultado={"documentos": docs_dicts}
             )
         except Exception as e:
             logger.warning(f"Error guardando en caché: {e}")
@@ -293,179 +336,23 @@ async def clasificar_despacho(
     )
 
 
-@post("/procesar/{codigo_despacho:str}")
-async def procesar_despacho(
+@post("/clasificar/{codigo_despacho:str}")
+async def clasificar_despacho(
     request: Request, 
     codigo_despacho: str,
     force: bool = False
 ) -> ProcesamientoResponse:
-    verify_api_token(request)
-    
-    if not settings.BEARER_TOKEN:
-        raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail="BEARER_TOKEN no configurado")
-    
-    datos_despacho_detalle = await consultar_despacho_detalle(codigo_despacho, settings.BEARER_TOKEN)
-    
-    codigo_visible = None
-    cliente_nombre = "N/A"
-    estado_despacho = "N/A"
-    tipo_despacho = "N/A"
-    
-    if datos_despacho_detalle and "data" in datos_despacho_detalle:
-        despacho_data = datos_despacho_detalle["data"]
-        if isinstance(despacho_data, dict):
-            codigo_visible = str(despacho_data.get("codigo", ""))
-            cliente = despacho_data.get("cliente", {})
-            cliente_nombre = cliente.get("nombre", "N/A") if isinstance(cliente, dict) else "N/A"
-            estado_despacho = despacho_data.get("estado_despacho", "N/A")
-            tipo_despacho = despacho_data.get("tipo_despacho", "N/A")
-    
-    documentos_base64_list = None
-    
-    if codigo_visible:
-        documentos_base64_list = await consultar_documentacion(codigo_visible, settings.BEARER_TOKEN)
-    
-    if not documentos_base64_list:
-        documentos_base64_list = await consultar_documentacion(codigo_despacho, settings.BEARER_TOKEN)
-    
-    if not documentos_base64_list or not isinstance(documentos_base64_list, list):
-        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No se pudieron obtener los documentos")
-    
-    # Calcular hash de documentos actuales
-    documentos_hash = calcular_hash_documentos(documentos_base64_list)
-
-    # Verificar caché si está habilitado y no se fuerza reprocesamiento
-    cache_info = None
-    if settings.CACHE_ENABLED and not force:
-        try:
-            estado_cache = await cache_repo.verificar_cambios_despacho(
-                codigo_despacho, "procesar", documentos_hash
-            )
-            
-            if estado_cache["existe_cache"] and not estado_cache["hay_cambios"]:
-                cached = await cache_repo.obtener_despacho(
-                    codigo_despacho, "procesar", documentos_hash
-                )
-                if cached:
-                    logger.info(f"Retornando procesamiento desde caché para {codigo_despacho}")
-                    docs_response = [
-                        DocumentoFinal(**doc) for doc in cached["resultado"]["documentos"]
-                    ]
-                    return ProcesamientoResponse(
-                        codigo_despacho=codigo_despacho,
-                        cliente=cached["cliente"],
-                        estado=cached["estado"],
-                        tipo=cached["tipo"],
-                        total_documentos_segmentados=cached["total_documentos_segmentados"],
-                        documentos=docs_response,
-                        cache_info=CacheInfo(
-                            desde_cache=True,
-                            hash_documentos=documentos_hash,
-                            fecha_cache=str(cached["updated_at"]),
-                            hay_cambios=False
-                        )
-                    )
-            
-            cache_info = CacheInfo(
-                desde_cache=False,
-                hash_documentos=documentos_hash,
-                hay_cambios=estado_cache.get("hay_cambios", True)
-            )
-        except Exception as e:
-            logger.warning(f"Error consultando caché: {e}")
-            cache_info = CacheInfo(desde_cache=False, hash_documentos=documentos_hash)
+    return await _ejecutar_despacho(request, codigo_despacho, force, "clasificar", clasificar_pdf_completo)
 
-    todos_documentos_finales = []
-    
-    for doc in documentos_base64_list:
-        if isinstance(doc, dict):
-            base64_data = doc.get("documento", "")
-            
-            if ',' in base64_data:
-                _, base64_content = base64_data.split(',', 1)
-            else:
-                base64_content = base64_data
-            
-            try:
-                file_bytes = base64.b64decode(base64_content)
-                nombre_documento = doc.get("nombre_documento", "documento.pdf")
-                
-                validar_tamano_archivo(file_bytes)
-
-                if es_archivo_excel(nombre_documento):
-                    if not validar_excel(file_bytes, nombre_documento):
-                        continue
-                    try:
-                        pdf_bytes = await convertir_excel_a_pdf(file_bytes, nombre_documento)
-                        nombre_procesamiento = nombre_documento.rsplit('.', 1)[0] + '.pdf'
-                    except Exception:
-                        continue
-                elif es_archivo_imagen(nombre_documento):
-                    if not validar_imagen(file_bytes, nombre_documento):
-                        continue
-                    try:
-                        pdf_bytes = await convertir_imagen_a_pdf(file_bytes, nombre_documento)
-                        nombre_procesamiento = nombre_documento.rsplit('.', 1)[0] + '.pdf'
-                    except Exception:
-                        continue
-                else:
-                    if not validar_pdf(file_bytes):
-                        continue
-                    pdf_bytes = file_bytes
-                    nombre_procesamiento = nombre_documento
-
-                resultado = await procesar_pdf_completo(pdf_bytes, nombre_procesamiento)
-                
-                if resultado["error"]:
-                    continue
-                
-                todos_documentos_finales.extend(resultado["documentos_finales"])
-                
-            except Exception:
-                continue
-    
-    documentos_finales_sgd[codigo_despacho] = todos_documentos_finales
-    
-    docs_response = []
-    for doc_final in todos_documentos_finales:
-        datos_limpios = None
-        if doc_final.get("datos_extraidos"):
-             datos_limpios = eliminar_campos_vacios(doc_final.get("datos_extraidos"))
-
-        docs_response.append(DocumentoFinal(
-            archivo_origen=doc_final["archivo_origen"],
-            nombre_salida=doc_final["nombre_salida"],
-            tipo=doc_final["tipo"],
-            paginas=doc_final["paginas"],
-            alertas=[Alerta(**alerta) for alerta in doc_final["alertas"]] if doc_final["alertas"] else None,
-            datos_extraidos=datos_limpios
-        ))
 
-    # Guardar en caché
-    if settings.CACHE_ENABLED:
-        try:
-            await cache_repo.guardar_despacho(
-                codigo_despacho=codigo_despacho,
-                tipo_operacion="procesar",
-                documentos_hash=documentos_hash,
-                cliente=cliente_nombre,
-                estado=estado_despacho,
-                tipo=tipo_despacho,
-                total_documentos_segmentados=len(docs_response),
-                resultado={"documentos": [doc.model_dump() for doc in docs_response]}
-            )
-        except Exception as e:
-            logger.warning(f"Error guardando en caché: {e}")
+@post("/procesar/{codigo_despacho:str}")
+async def procesar_despacho(
+    request: Request, 
+    codigo_despacho: str,
+    force: bool = False
+) -> ProcesamientoResponse:
+    return await _ejecutar_despacho(request, codigo_despacho, force, "procesar", procesar_pdf_completo)
 
-    return ProcesamientoResponse(
-        codigo_despacho=codigo_despacho,
-        cliente=cliente_nombre,
-        estado=estado_despacho,
-        tipo=tipo_despacho,
-        total_documentos_segmentados=len(docs_response),
-        documentos=docs_response,
-        cache_info=cache_info
-    )
 
 sgd_router = Router(
     path="/sgd",
@@ -1,3 +1,4 @@
+import msgspec
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 
@@ -23,13 +24,15 @@ class ConsultaResponse(BaseModel):
     usuarios: Usuarios
 
 
-class Alerta(BaseModel):
+# Modelos de resultado de procesamiento: se construyen en cada respuesta, por lo que
+# son structs de msgspec (serializador nativo de Litestar) en vez de modelos Pydantic
+class Alerta(msgspec.Struct):
     pagina: int
     tipo: str
     descripcion: str
 
 
-class DocumentoFinal(BaseModel):
+class DocumentoFinal(msgspec.Struct):
     archivo_origen: str
     nombre_salida: str
     tipo: str
@@ -38,14 +41,14 @@ class DocumentoFinal(BaseModel):
     datos_extraidos: Optional[Dict[str, Any]] = None
 
 
-class CacheInfo(BaseModel):
+class CacheInfo(msgspec.Struct):
     desde_cache: bool
     hash_documentos: Optional[str] = None
     fecha_cache: Optional[str] = None
     hay_cambios: Optional[bool] = None
 
 
-class ProcesamientoResponse(BaseModel):
+class ProcesamientoResponse(msgspec.Struct):
     codigo_despacho: str
     cliente: str
     estado: str
@@ -55,7 +58,7 @@ class ProcesamientoResponse(BaseModel):
     cache_info: Optional[CacheInfo] = None
 
 
-class ProcesamientoIndividualResponse(BaseModel):
+class ProcesamientoIndividualResponse(msgspec.Struct):
     archivo_origen: str
     total_documentos_segmentados: int
     documentos: List[DocumentoFinal]
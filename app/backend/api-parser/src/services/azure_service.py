@@ -1,7 +1,8 @@
 import httpx
 import logging
 import asyncio
-from typing import Any, Dict, Optional
+import simdjson
+from typing import Any, Dict, Optional, Tuple
 from litestar.exceptions import HTTPException
 
 from config.settings import get_settings
@@ -11,6 +12,34 @@ settings = get_settings()
 
 API_VERSION = "2024-11-30"
 
+# Intervalos de polling de análisis (segundos)
+POLL_DELAY_INICIAL = 0.25
+POLL_DELAY_MAXIMO = 4.0
+
+# Cliente compartido: conexiones y sesiones TLS con Azure se reutilizan entre
+# análisis, polls y documentos procesados en paralelo
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_azure_client() -> httpx.AsyncClient:
+    """Retorna el cliente HTTP compartido para Azure DI (se crea en el primer uso)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+            http2=True,
+        )
+    return _client
+
+
+async def close_azure_client() -> None:
+    """Cierra el cliente compartido de Azure DI."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
 def get_azure_headers() -> Dict[str, str]:
     """Retorna headers para autenticación con Azure DI Cloud."""
     return {
@@ -19,71 +48,109 @@ def get_azure_headers() -> Dict[str, str]:
     }
 
 
+def segundos_retry_after(response: httpx.Response, por_defecto: float) -> float:
+    """Segundos indicados en el header Retry-After, o `por_defecto` si no viene o no es numérico."""
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return por_defecto
+
+
 def get_azure_base_url() -> str:
     """Retorna la URL base de Azure DI."""
     endpoint = settings.AZURE_ENDPOINT.rstrip('/')
     return f"{endpoint}/documentintelligence"
 
 
+# Claves de Azure DI que contienen directamente el valor de un campo
+_CLAVES_VALOR = (
+    "valueString", "valueNumber", "valueDate", "valueTime",
+    "valuePhoneNumber", "valueBoolean", "valueSelectionMark",
+)
+# Metadata que se descarta (posiciones, spans, confianza)
+_CLAVES_METADATA = frozenset({"boundingRegions", "polygon", "spans", "confidence", "type"})
+# Tipos cuyo valor vacío ({}, [], "") se descarta, junto con None. Se prueba con
+# `v is not None and (v or not isinstance(...))`: sin comparaciones __eq__ por valor
+# y conservando 0 y False
+_TIPOS_VACIABLES = (str, dict, list)
+
+
 def limpiar_datos_azure(data: Any) -> Any:
     """
-    Limpia recursivamente la respuesta de Azure DI para eliminar metadata
-    (polygons, spans, confidence) y dejar solo los valores.
+    Limpia recursivamente la respuesta de Azure DI: elimina metadata (polygons, spans,
+    confidence), deja solo los valores y descarta claves con None, {}, [] o strings vacíos.
+    Limpieza y poda ocurren en la misma pasada.
     """
     if isinstance(data, list):
-        return [limpiar_datos_azure(item) for item in data]
-    
+        limpia = []
+        for item in data:
+            item = limpiar_datos_azure(item)
+            if item is not None and (item or not isinstance(item, _TIPOS_VACIABLES)):
+                limpia.append(item)
+        return limpia
+
     if isinstance(data, dict):
-        if "valueString" in data: return data["valueString"]
-        if "valueNumber" in data: return data["valueNumber"]
-        if "valueDate" in data: return data["valueDate"]
-        if "valueTime" in data: return data["valueTime"]
-        if "valuePhoneNumber" in data: return data["valuePhoneNumber"]
-        if "valueBoolean" in data: return data["valueBoolean"]
-        if "valueSelectionMark" in data: return data["valueSelectionMark"]
-        
+        for clave in _CLAVES_VALOR:
+            if clave in data:
+                return data[clave]
+
         if "valueArray" in data:
             return limpiar_datos_azure(data["valueArray"])
         if "valueObject" in data:
-            return {k: limpiar_datos_azure(v) for k, v in data["valueObject"].items()}
-        
-        cleaned = {}
+            data = data["valueObject"]
+            metadata = ()
+        else:
+            metadata = _CLAVES_METADATA
+
+        limpio = {}
         for k, v in data.items():
-            if k in ["boundingRegions", "polygon", "spans", "confidence", "type"]:
+            if k in metadata:
                 continue
-            cleaned[k] = limpiar_datos_azure(v)
-        
-        if not cleaned and "content" in data:
-            return data["content"]
-            
-        return cleaned
+            v = limpiar_datos_azure(v)
+            if v is not None and (v or not isinstance(v, _TIPOS_VACIABLES)):
+                limpio[k] = v
+        return limpio
 
     return data
 
 
-def eliminar_campos_vacios(data: Any) -> Any:
+def _leer_resultado_analisis(contenido: bytes) -> Tuple[Optional[str], Any, int, Dict[str, Any]]:
     """
-    Elimina recursivamente claves con valores None, {}, [] o strings vacíos.
+    Lee la respuesta de polling con simdjson. Solo se convierten a objetos Python el
+    status, el error y los `fields` del primer documento; páginas, palabras y polígonos
+    del resto del resultado (la mayor parte del payload) nunca se materializan.
+    Retorna (status, error, cantidad_documentos, fields).
     """
-    if isinstance(data, dict):
-        cleaned = {
-            k: eliminar_campos_vacios(v)
-            for k, v in data.items()
-        }
-        return {
-            k: v for k, v in cleaned.items() 
-            if v not in [None, {}, [], ""]
-        }
-    
-    elif isinstance(data, list):
-        cleaned = [eliminar_campos_vacios(item) for item in data]
-        return [item for item in cleaned if item not in [None, {}, [], ""]]
-        
-    return data
+    resultado = simdjson.Parser().parse(contenido)
+    status = resultado.get("status")
 
+    if status == "failed":
+        error = resultado.get("error")
+        if isinstance(error, simdjson.Object):
+            error = error.as_dict()
+        return status, error, 0, {}
 
-async def verificar_modelo_entrenado(model_id: str) -> bool:
-    """Verifica si un modelo custom está entrenado en Azure DI Cloud."""
+    if status != "succeeded":
+        return status, None, 0, {}
+
+    analyze_result = resultado.get("analyzeResult")
+    documentos = analyze_result.get("documents") if analyze_result is not None else None
+    if not documentos:
+        return status, None, 0, {}
+    fields = documentos[0].get("fields")
+    return status, None, len(documentos), fields.as_dict() if fields is not None else {}
+
+
+# Estado de entrenamiento de modelos: respuestas definitivas de Azure (200/404) se
+# reutilizan por MODELO_VERIFICADO_TTL segundos; los errores no se cachean
+MODELO_VERIFICADO_TTL = 300.0
+_modelos_verificados: Dict[str, Tuple[float, bool]] = {}
+# Verificaciones en curso por modelo: segmentos y requests concurrentes esperan la misma
+_verificaciones_en_curso: Dict[str, asyncio.Task] = {}
+
+
+async def _consultar_modelo(model_id: str) -> bool:
+    """Consulta a Azure DI Cloud si un modelo custom está entrenado."""
     base_url = get_azure_base_url()
     url = f"{base_url}/documentModels/{model_id}?api-version={API_VERSION}"
 
@@ -99,19 +166,38 @@ async def verificar_modelo_entrenado(model_id: str) -> bool:
     )
 
     try:
-        async with httpx.AsyncClient(timeout=timeout_config) as client:
-            response = await client.get(url, headers=headers)
-            if response.status_code == 200:
-                logger.info(f"Modelo {model_id} verificado en Azure Cloud")
-                return True
-            else:
-                logger.warning(f"Modelo {model_id} no encontrado: {response.status_code}")
-                return False
+        client = get_azure_client()
+        response = await client.get(url, headers=headers, timeout=timeout_config)
+        expira = asyncio.get_running_loop().time() + MODELO_VERIFICADO_TTL
+        if response.status_code == 200:
+            logger.info(f"Modelo {model_id} verificado en Azure Cloud")
+            _modelos_verificados[model_id] = (expira, True)
+            return True
+        else:
+            logger.warning(f"Modelo {model_id} no encontrado: {response.status_code}")
+            if response.status_code == 404:
+                _modelos_verificados[model_id] = (expira, False)
+            return False
     except Exception as e:
         logger.error(f"Error verificando modelo {model_id}: {str(e)}")
         return False
 
 
+async def verificar_modelo_entrenado(model_id: str) -> bool:
+    """Verifica si un modelo custom está entrenado en Azure DI Cloud (con caché TTL)."""
+    cacheado = _modelos_verificados.get(model_id)
+    if cacheado is not None and cacheado[0] > asyncio.get_running_loop().time():
+        return cacheado[1]
+
+    task = _verificaciones_en_curso.get(model_id)
+    if task is None:
+        task = asyncio.ensure_future(_consultar_modelo(model_id))
+        _verificaciones_en_curso[model_id] = task
+        task.add_done_callback(lambda _: _verificaciones_en_curso.pop(model_id, None))
+    # shield: si este solicitante se cancela, la consulta sigue para los demás
+    return await asyncio.shield(task)
+
+
 async def extraer_datos_con_modelo(pdf_bytes: bytes, model_id: str) -> Optional[Dict[str, Any]]:
     """Extrae datos estructurados de un PDF usando un modelo custom de Azure DI Cloud."""
     base_url = get_azure_base_url()
@@ -127,64 +213,68 @@ async def extraer_datos_con_modelo(pdf_bytes: bytes, model_id: str) -> Optional[
     )
 
     try:
-        async with httpx.AsyncClient(timeout=timeout_config) as client:
-            logger.info(f"Enviando documento a modelo {model_id} en Azure Cloud")
-            response = await client.post(url, headers=headers, content=pdf_bytes)
-
-            if response.status_code != 202:
-                logger.warning(f"Error iniciando análisis: {response.status_code} - {response.text[:500]}")
-                return None
+        client = get_azure_client()
+        logger.info(f"Enviando documento a modelo {model_id} en Azure Cloud")
+        response = await client.post(url, headers=headers, content=pdf_bytes, timeout=timeout_config)
 
-            operation_location = response.headers.get('Operation-Location')
-            if not operation_location:
-                logger.warning("No se recibió Operation-Location")
-                return None
-
-            logger.info(f"Análisis iniciado, polling: {operation_location}")
+        if response.status_code != 202:
+            logger.warning(f"Error iniciando análisis: {response.status_code} - {response.text[:500]}")
+            return None
 
-            poll_headers = {
-                "Ocp-Apim-Subscription-Key": settings.AZURE_KEY
-            }
+        operation_location = response.headers.get('Operation-Location')
+        if not operation_location:
+            logger.warning("No se recibió Operation-Location")
+            return None
 
-            max_intentos = 60
-            for intento in range(max_intentos):
-                status_response = await client.get(operation_location, headers=poll_headers)
+        logger.info(f"Análisis iniciado, polling: {operation_location}")
 
-                if status_response.status_code != 200:
-                    logger.warning(f"Error en polling: {status_response.status_code}")
-                    return None
+        poll_headers = {
+            "Ocp-Apim-Subscription-Key": settings.AZURE_KEY
+        }
 
-                resultado = status_response.json()
-                status = resultado.get('status')
+        # Backoff exponencial: los análisis cortos se detectan pronto y los largos
+        # pueden correr hasta TIMEOUT_AZURE_MAX sin un número fijo de consultas
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.TIMEOUT_AZURE_MAX
+        delay = POLL_DELAY_INICIAL
+        while True:
+            status_response = await client.get(operation_location, headers=poll_headers, timeout=timeout_config)
+
+            if status_response.status_code == 429:
+                # Throttling: se respeta Retry-After en vez de abortar
+                espera = segundos_retry_after(status_response, delay)
+                if loop.time() + espera > deadline:
+                    break
+                await asyncio.sleep(espera)
+                continue
 
-                if status == 'succeeded':
-                    analyze_result = resultado.get('analyzeResult', {})
-                    documentos = analyze_result.get('documents', [])
-                    
-                    logger.info(f"Análisis exitoso. Documentos encontrados: {len(documentos)}")
+            if status_response.status_code != 200:
+                logger.warning(f"Error en polling: {status_response.status_code}")
+                return None
 
-                    if documentos:
-                        fields = documentos[0].get('fields', {})
-                        logger.info(f"Campos extraídos: {list(fields.keys())}")
+            status, error, num_documentos, fields = _leer_resultado_analisis(status_response.content)
 
-                        datos_aplanados = {
-                            k: limpiar_datos_azure(v) for k, v in fields.items()
-                        }
+            if status == 'succeeded':
+                logger.info(f"Análisis exitoso. Documentos encontrados: {num_documentos}")
 
-                        datos_finales = eliminar_campos_vacios(datos_aplanados)
+                if num_documentos:
+                    logger.info(f"Campos extraídos: {list(fields.keys())}")
 
-                        return datos_finales
-                    return {}
+                    # Se limpia como un valueObject: los nombres de campo no son metadata
+                    return limpiar_datos_azure({"valueObject": fields})
+                return {}
 
-                elif status == 'failed':
-                    error = resultado.get('error', {})
-                    logger.error(f"Análisis fallido: {error}")
-                    return None
+            elif status == 'failed':
+                logger.error(f"Análisis fallido: {error}")
+                return None
 
-                await asyncio.sleep(2)
+            if loop.time() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, POLL_DELAY_MAXIMO)
 
-            logger.warning("Timeout en análisis")
-            return None
+        logger.warning("Timeout en análisis")
+        return None
 
     except Exception as e:
         logger.error(f"Error en extracción: {str(e)}")
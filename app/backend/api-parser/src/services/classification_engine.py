@@ -1,40 +1,76 @@
 import fitz
 import httpx
+import logging
 import asyncio
-from typing import List, Dict, Tuple
+import ahocorasick
+import simdjson
+from multiprocessing import shared_memory
+from typing import List, Dict, Optional, Set, Tuple
 from utils.patterns import PATRONES_INICIO, PATRON_DEFAULT
 from config.settings import get_settings, calcular_timeout_azure
-import re
+from services.azure_service import (
+    get_azure_client, segundos_retry_after, POLL_DELAY_INICIAL, POLL_DELAY_MAXIMO
+)
 
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 
 # Azure Document Intelligence - Cloud
 API_VERSION = "2024-11-30"
 
+# URL y headers del análisis de layout: dependen solo de la configuración, se arman una vez
+_URL_LAYOUT = (
+    f"{settings.AZURE_ENDPOINT.rstrip('/')}/documentintelligence"
+    f"/documentModels/prebuilt-layout:analyze?api-version={API_VERSION}"
+)
+_HEADERS_ANALISIS = {
+    "Ocp-Apim-Subscription-Key": settings.AZURE_KEY,
+    "Content-Type": "application/pdf"
+}
+# Headers para polling (sin Content-Type)
+_HEADERS_POLL = {
+    "Ocp-Apim-Subscription-Key": settings.AZURE_KEY
+}
 
-def get_azure_base_url() -> str:
-    """Retorna la URL base de Azure DI."""
-    endpoint = settings.AZURE_ENDPOINT.rstrip('/')
-    return f"{endpoint}/documentintelligence"
 
-
-def recortar_header(pdf_bytes: bytes) -> bytes:
-    """Recorta el 35% superior de cada página del PDF."""
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    new_doc = fitz.open()
-    
+def recortar_header(doc: fitz.Document) -> bytes:
+    """
+    Recorta el 35% superior de cada página de un documento ya abierto y retorna el PDF
+    recortado. El cropbox se fija sobre el mismo documento (que queda modificado) y se
+    serializa una vez; deflate reduce además el PDF que se sube a Azure.
+    """
     for page in doc:
         rect = page.rect
         crop_rect = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * 0.35)
         page.set_cropbox(crop_rect)
-        new_doc.insert_pdf(doc, from_page=page.number, to_page=page.number)
-    
-    pdf_recortado = new_doc.tobytes()
-    new_doc.close()
-    doc.close()
     
-    return pdf_recortado
+    return doc.tobytes(garbage=1, deflate=True)
+
+
+def _leer_resultado_layout(contenido: bytes) -> Tuple[Optional[str], Dict[int, str]]:
+    """
+    Lee la respuesta de polling del análisis de layout con simdjson. De las páginas solo
+    se materializan el número y el contenido de cada línea; palabras, polígonos, spans,
+    tablas y estilos nunca se convierten a objetos Python.
+    Retorna (status, {numero_pagina: texto}); el texto solo se arma si el análisis terminó.
+    """
+    resultado = simdjson.Parser().parse(contenido)
+    status = resultado.get("status")
+    texto_por_pagina: Dict[int, str] = {}
+    if status != "succeeded":
+        return status, texto_por_pagina
+
+    analyze_result = resultado.get("analyzeResult")
+    pages = analyze_result.get("pages") if analyze_result is not None else None
+    for page in pages or ():
+        page_number = page.get("pageNumber", 0)
+        lines = page.get("lines")
+        # strip: líneas vacías en los extremos no dejan espacios sobrantes
+        texto_por_pagina[page_number] = " ".join(
+            line.get("content", "") for line in lines or ()
+        ).strip()
+    return status, texto_por_pagina
 
 
 async def extraer_texto_documento_completo(
@@ -53,15 +89,6 @@ async def extraer_texto_documento_completo(
         doc.close()
         
         timeout_total = calcular_timeout_azure(num_paginas)
-        max_attempts = int(timeout_total / 2)  # Poll cada 2 segundos
-        
-        base_url = get_azure_base_url()
-        url = f"{base_url}/documentModels/prebuilt-layout:analyze?api-version={API_VERSION}"
-        
-        headers = {
-            "Ocp-Apim-Subscription-Key": settings.AZURE_KEY,
-            "Content-Type": "application/pdf"
-        }
         
         timeout_config = httpx.Timeout(
             connect=settings.TIMEOUT_CONNECT,
@@ -70,102 +97,265 @@ async def extraer_texto_documento_completo(
             pool=5.0
         )
         
-        async with httpx.AsyncClient(timeout=timeout_config) as client:
-            response = await client.post(url, headers=headers, content=pdf_bytes)
+        client = get_azure_client()
+        response = await client.post(_URL_LAYOUT, headers=_HEADERS_ANALISIS, content=pdf_bytes, timeout=timeout_config)
+        
+        if response.status_code != 202:
+            return {}, f"error_status_{response.status_code}"
+        
+        operation_location = response.headers.get("Operation-Location")
+        if not operation_location:
+            return {}, "error_no_operation_location"
+        
+        # Polling hasta el timeout total: se espera lo que indique Retry-After (acotado)
+        # o, si no viene, un backoff exponencial desde 1s
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_total
+        delay = 1.0
+        espera = min(max(segundos_retry_after(response, delay), POLL_DELAY_INICIAL), POLL_DELAY_MAXIMO)
+        while loop.time() + espera <= deadline:
+            await asyncio.sleep(espera)
             
-            if response.status_code != 202:
-                return {}, f"error_status_{response.status_code}"
+            result_response = await client.get(operation_location, headers=_HEADERS_POLL, timeout=timeout_config)
             
-            operation_location = response.headers.get("Operation-Location")
-            if not operation_location:
-                return {}, "error_no_operation_location"
+            if result_response.status_code == 429:
+                # Throttling: se respeta Retry-After completo sin avanzar el backoff
+                espera = segundos_retry_after(result_response, delay)
+                continue
             
-            # Headers para polling (sin Content-Type)
-            poll_headers = {
-                "Ocp-Apim-Subscription-Key": settings.AZURE_KEY
-            }
+            status, texto_por_pagina = _leer_resultado_layout(result_response.content)
+            
+            if status == "succeeded":
+                return texto_por_pagina, "success"
             
-            # Polling con backoff exponencial
-            for attempt in range(max_attempts):
-                wait_time = min(1 * (1.5 ** attempt), 5)  # Max 5s entre polls
-                await asyncio.sleep(wait_time)
-                
-                result_response = await client.get(operation_location, headers=poll_headers)
-                result_data = result_response.json()
-                
-                if result_data.get("status") == "succeeded":
-                    texto_por_pagina = {}
-                    
-                    if "analyzeResult" in result_data:
-                        pages = result_data["analyzeResult"].get("pages", [])
-                        for page in pages:
-                            page_number = page.get("pageNumber", 0)
-                            texto_pagina = ""
-                            
-                            for line in page.get("lines", []):
-                                texto_pagina += line.get("content", "") + " "
-                            
-                            texto_por_pagina[page_number] = texto_pagina.strip()
-                    
-                    return texto_por_pagina, "success"
-                
-                elif result_data.get("status") in ["failed", "invalid"]:
-                    return {}, f"error_azure_status_{result_data.get('status')}"
+            elif status in ["failed", "invalid"]:
+                return {}, f"error_azure_status_{status}"
             
-            return {}, "error_timeout"
+            delay = min(delay * 1.5, POLL_DELAY_MAXIMO)
+            espera = min(max(segundos_retry_after(result_response, delay), POLL_DELAY_INICIAL), POLL_DELAY_MAXIMO)
         
+        return {}, "error_timeout"
+
     except httpx.TimeoutException:
         return {}, "error_timeout"
     except Exception as e:
         return {}, f"error_exception_{type(e).__name__}"
 
 
+# Agrupación de análisis de layout: requests concurrentes (documentos de un despacho
+# procesados en paralelo, uploads simultáneos) se combinan en un solo PDF y un solo
+# job de Azure; el texto se reparte luego por rango de páginas
+_cola_layout: Optional[asyncio.Queue] = None
+_tarea_layout: Optional[asyncio.Task] = None
+_tareas_lote: Set[asyncio.Task] = set()
+
+
+def _combinar_pdfs(pdfs: List[bytes]) -> Tuple[bytes, List[int]]:
+    """Concatena PDFs en uno solo. Retorna (pdf_combinado, páginas de cada PDF)."""
+    combinado = fitz.open()
+    paginas = []
+    for pdf_bytes in pdfs:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        paginas.append(len(doc))
+        combinado.insert_pdf(doc)
+        doc.close()
+    pdf_combinado = combinado.tobytes()
+    combinado.close()
+    return pdf_combinado, paginas
+
+
+async def _analizar_individual(lote: List[Tuple[bytes, int, asyncio.Future]]) -> List[Tuple[Dict[int, str], str]]:
+    """Analiza cada PDF del lote en su propio job (en paralelo)."""
+    return await asyncio.gather(*(extraer_texto_documento_completo(pdf) for pdf, _, _ in lote))
+
+
+async def _analizar_lote(lote: List[Tuple[bytes, int, asyncio.Future]]) -> None:
+    """Analiza un lote en un solo job y entrega a cada PDF el texto de sus páginas."""
+    try:
+        if len(lote) == 1:
+            resultados = await _analizar_individual(lote)
+        else:
+            try:
+                pdf_combinado, paginas = await asyncio.to_thread(_combinar_pdfs, [pdf for pdf, _, _ in lote])
+                texto_por_pagina, estado = await extraer_texto_documento_completo(pdf_combinado)
+            except Exception as e:
+                estado = f"error_exception_{type(e).__name__}"
+
+            if estado == "success":
+                resultados = []
+                inicio = 0
+                for num_paginas in paginas:
+                    resultados.append((
+                        {n: texto_por_pagina.get(inicio + n, "") for n in range(1, num_paginas + 1)},
+                        estado
+                    ))
+                    inicio += num_paginas
+            else:
+                # Un PDF dañado o un fallo del job combinado no debe arrastrar al resto
+                # del lote: cada PDF se reintenta por separado
+                logger.warning(f"Análisis de layout agrupado falló ({estado}), se analizan {len(lote)} PDFs por separado")
+                resultados = await _analizar_individual(lote)
+    except asyncio.CancelledError:
+        for _, _, futuro in lote:
+            futuro.cancel()
+        raise
+    except Exception as e:
+        resultados = [({}, f"error_exception_{type(e).__name__}")] * len(lote)
+
+    for (_, _, futuro), resultado in zip(lote, resultados):
+        if not futuro.done():
+            futuro.set_result(resultado)
+
+
+def _excede_lote(paginas: int, tamano: int) -> bool:
+    """True si un lote con estas páginas y bytes supera los límites de agrupación."""
+    return (
+        paginas > settings.AZURE_BATCH_MAX_PAGES
+        or tamano > settings.AZURE_BATCH_MAX_MB * 1024 * 1024
+    )
+
+
+async def _despachar_lotes(cola: asyncio.Queue) -> None:
+    """
+    Arma lotes de hasta AZURE_BATCH_SIZE PDFs o lo reunido en AZURE_BATCH_WAIT_MS,
+    sin superar AZURE_BATCH_MAX_PAGES páginas ni AZURE_BATCH_MAX_MB en total.
+    """
+    loop = asyncio.get_running_loop()
+    pendiente = None
+    while True:
+        lote = [pendiente if pendiente is not None else await cola.get()]
+        pendiente = None
+        paginas = lote[0][1]
+        tamano = len(lote[0][0])
+        limite = loop.time() + settings.AZURE_BATCH_WAIT_MS / 1000
+        while len(lote) < settings.AZURE_BATCH_SIZE:
+            restante = limite - loop.time()
+            if restante <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(cola.get(), restante)
+            except asyncio.TimeoutError:
+                break
+            if _excede_lote(paginas + item[1], tamano + len(item[0])):
+                # No cabe: abre el lote siguiente
+                pendiente = item
+                break
+            lote.append(item)
+            paginas += item[1]
+            tamano += len(item[0])
+
+        tarea = asyncio.create_task(_analizar_lote(lote))
+        _tareas_lote.add(tarea)
+        tarea.add_done_callback(_tareas_lote.discard)
+
+
+async def extraer_texto_agrupado(pdf_bytes: bytes, num_paginas: int) -> Tuple[Dict[int, str], str]:
+    """
+    Igual que extraer_texto_documento_completo, pero el PDF puede compartir el job
+    de Azure con otros PDFs recibidos en la misma ventana de AZURE_BATCH_WAIT_MS.
+    """
+    global _cola_layout, _tarea_layout
+    if settings.AZURE_BATCH_SIZE <= 1 or _excede_lote(num_paginas, len(pdf_bytes)):
+        return await extraer_texto_documento_completo(pdf_bytes)
+
+    if _tarea_layout is None or _tarea_layout.done():
+        _cola_layout = asyncio.Queue()
+        _tarea_layout = asyncio.create_task(_despachar_lotes(_cola_layout))
+
+    futuro = asyncio.get_running_loop().create_future()
+    await _cola_layout.put((pdf_bytes, num_paginas, futuro))
+    return await futuro
+
+
+async def close_layout_batcher() -> None:
+    """Detiene el despachador de lotes y los análisis en curso (al apagar la app)."""
+    global _cola_layout, _tarea_layout
+    tareas = list(_tareas_lote)
+    if _tarea_layout is not None:
+        tareas.append(_tarea_layout)
+    for tarea in tareas:
+        tarea.cancel()
+    await asyncio.gather(*tareas, return_exceptions=True)
+
+    # PDFs que quedaron en cola sin lote
+    if _cola_layout is not None:
+        while not _cola_layout.empty():
+            _, _, futuro = _cola_layout.get_nowait()
+            futuro.cancel()
+    _cola_layout = None
+    _tarea_layout = None
+
+
+# Autómata Aho-Corasick con todos los patrones: recorre el texto una sola vez sin
+# importar cuántos patrones haya. La prioridad conserva el orden de PATRONES_INICIO:
+# si dos patrones empiezan en la misma posición gana el primero
+_TIPO_POR_PATRON: Dict[str, str] = {}
+for _tipo_documento, _patrones in PATRONES_INICIO.items():
+    for _patron in _patrones:
+        _TIPO_POR_PATRON.setdefault(_patron.upper(), _tipo_documento)
+
+_AUTOMATA_INICIO = ahocorasick.Automaton()
+for _prioridad, (_patron, _tipo_documento) in enumerate(_TIPO_POR_PATRON.items()):
+    _AUTOMATA_INICIO.add_word(_patron, (_prioridad, len(_patron), _tipo_documento))
+_AUTOMATA_INICIO.make_automaton()
+_LARGO_MAXIMO_PATRON = max(map(len, _TIPO_POR_PATRON))
+
+
+def _es_palabra(caracter: str) -> bool:
+    """Mismo criterio que \\w en expresiones regulares."""
+    return caracter.isalnum() or caracter == '_'
+
+
+def _limite_palabra(texto: str, posicion: int) -> bool:
+    """Equivalente a \\b: hay un límite de palabra antes de `posicion`."""
+    antes = posicion > 0 and _es_palabra(texto[posicion - 1])
+    despues = posicion < len(texto) and _es_palabra(texto[posicion])
+    return antes != despues
+
+
 def clasificar_pagina(texto: str) -> str:
     """
     Clasifica una página buscando la aparición más temprana de cualquier
     patrón de documento en el texto. Usa búsqueda de palabras completas
     para evitar falsos positivos con subcadenas.
     """
-    texto_upper = texto.upper()
-    matches = []
-    
-    for tipo_documento, patrones in PATRONES_INICIO.items():
-        for patron in patrones:
-            # Buscar como palabra completa (word boundary)
-            pattern = r'\b' + re.escape(patron.upper()) + r'\b'
-            match = re.search(pattern, texto_upper)
-            
-            if match:
-                matches.append({
-                    "index": match.start(),
-                    "tipo": tipo_documento
-                })
-    
-    if not matches:
-        return PATRON_DEFAULT
-    
-    matches.sort(key=lambda x: x["index"])
-    return matches[0]["tipo"]
+    # Los encabezados suelen venir en mayúsculas: en ese caso no se copia el texto.
+    # No se usa una tabla de traducción ASCII porque hay patrones con tildes y diéresis
+    texto_upper = texto if texto.isupper() else texto.upper()
+    mejor = None
 
+    # Las coincidencias llegan ordenadas por posición de término
+    for fin, (prioridad, largo, tipo_documento) in _AUTOMATA_INICIO.iter(texto_upper):
+        inicio = fin - largo + 1
+        if mejor is not None:
+            if fin - _LARGO_MAXIMO_PATRON + 1 > mejor[0]:
+                # Ninguna coincidencia posterior puede empezar antes
+                break
+            if (inicio, prioridad) >= mejor[:2]:
+                continue
+        if _limite_palabra(texto_upper, inicio) and _limite_palabra(texto_upper, fin + 1):
+            mejor = (inicio, prioridad, tipo_documento)
 
-async def clasificar_documento_completo(pdf_bytes: bytes) -> List[Dict]:
+    return mejor[2] if mejor is not None else PATRON_DEFAULT
+
+
+async def clasificar_documento_completo(pdf_recortado: bytes, total_paginas: int) -> List[Dict]:
     """
     Clasifica todas las páginas de un PDF:
-    1. Recorta el 30% superior de todas las páginas
-    2. Envía el PDF completo recortado a Azure DI (una sola llamada)
+    1. Recibe el PDF con el 35% superior de cada página ya recortado (recortar_header)
+    2. Envía el PDF recortado a Azure DI (una sola llamada, posiblemente
+       compartida con otros PDFs concurrentes)
     3. Clasifica cada página según el texto extraído
     
     Retorna lista con clasificación por página.
     """
-    pdf_recortado = recortar_header(pdf_bytes)
-    texto_por_pagina, _ = await extraer_texto_documento_completo(pdf_recortado)
+    texto_por_pagina, estado = await extraer_texto_agrupado(pdf_recortado, total_paginas)
+    if estado != "success":
+        # Sin texto todas las páginas quedan como PATRON_DEFAULT: se deja constancia
+        logger.warning(f"Extracción de layout para clasificación falló ({estado}), páginas sin clasificar")
     
     clasificaciones = []
     
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    total_paginas = len(doc)
-    doc.close()
-    
     for num_pagina in range(1, total_paginas + 1):
         texto_pagina = texto_por_pagina.get(num_pagina, "")
         tipo_documento = clasificar_pagina(texto_pagina)
@@ -178,15 +368,13 @@ async def clasificar_documento_completo(pdf_bytes: bytes) -> List[Dict]:
     return clasificaciones
 
 
-def segmentar_pdf(pdf_bytes: bytes, clasificaciones: List[Dict]) -> List[Dict]:
+def rangos_segmentos(clasificaciones: List[Dict]) -> List[Tuple[str, int, int]]:
     """
-    Segmenta un PDF en múltiples documentos según las clasificaciones.
-    Retorna lista de documentos segmentados con sus metadatos.
+    Calcula los segmentos de un PDF según las clasificaciones (una por página).
+    Retorna [(tipo, pagina_inicio, pagina_fin)] con páginas base 0; si no se reconoce
+    ningún tipo, un solo segmento PATRON_DEFAULT con todo el documento.
     """
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    documentos_segmentados = []
-    
-    paginas_por_tipo = {}
+    rangos = []
     tipo_actual = None
     inicio_segmento = 0
     
@@ -195,43 +383,58 @@ def segmentar_pdf(pdf_bytes: bytes, clasificaciones: List[Dict]) -> List[Dict]:
         
         if tipo != tipo_actual and tipo != PATRON_DEFAULT:
             if tipo_actual is not None:
-                paginas_por_tipo[f"{tipo_actual}_{inicio_segmento}"] = {
-                    "tipo": tipo_actual,
-                    "inicio": inicio_segmento,
-                    "fin": i - 1
-                }
+                rangos.append((tipo_actual, inicio_segmento, i - 1))
             tipo_actual = tipo
             inicio_segmento = i
-        elif tipo == PATRON_DEFAULT and tipo_actual is not None:
-            continue
     
     if tipo_actual is not None:
-        paginas_por_tipo[f"{tipo_actual}_{inicio_segmento}"] = {
-            "tipo": tipo_actual,
-            "inicio": inicio_segmento,
-            "fin": len(clasificaciones) - 1
-        }
+        rangos.append((tipo_actual, inicio_segmento, len(clasificaciones) - 1))
     
-    if not paginas_por_tipo:
-        nuevo_doc = fitz.open()
-        nuevo_doc.insert_pdf(doc)
-        documentos_segmentados.append({
-            "tipo": PATRON_DEFAULT,
-            "paginas": list(range(1, len(doc) + 1)),
-            "pdf_bytes": nuevo_doc.tobytes()
-        })
-        nuevo_doc.close()
-    else:
-        for key, segmento in paginas_por_tipo.items():
-            nuevo_doc = fitz.open()
-            nuevo_doc.insert_pdf(doc, from_page=segmento["inicio"], to_page=segmento["fin"])
-            
-            documentos_segmentados.append({
-                "tipo": segmento["tipo"],
-                "paginas": list(range(segmento["inicio"] + 1, segmento["fin"] + 2)),
-                "pdf_bytes": nuevo_doc.tobytes()
-            })
-            nuevo_doc.close()
+    if not rangos:
+        rangos.append((PATRON_DEFAULT, 0, len(clasificaciones) - 1))
     
-    doc.close()
-    return documentos_segmentados
\ No newline at end of file
+    return rangos
+
+
+def _serializar_rango(doc: fitz.Document, inicio: int, fin: int) -> bytes:
+    """PDF con las páginas [inicio, fin] (base 0) de un documento abierto."""
+    nuevo_doc = fitz.open()
+    nuevo_doc.insert_pdf(doc, from_page=inicio, to_page=fin)
+    pdf_bytes = nuevo_doc.tobytes()
+    nuevo_doc.close()
+    return pdf_bytes
+
+
+def serializar_segmento_compartido(nombre_memoria: str, tamano: int, inicio: int, fin: int) -> bytes:
+    """
+    Serializa un segmento leyendo el PDF origen desde memoria compartida (pensado para
+    correr en un proceso del pool sin enviar el PDF completo por cada segmento).
+    """
+    memoria = shared_memory.SharedMemory(name=nombre_memoria)
+    try:
+        doc = fitz.open(stream=bytes(memoria.buf[:tamano]), filetype="pdf")
+    finally:
+        memoria.close()
+    try:
+        return _serializar_rango(doc, inicio, fin)
+    finally:
+        doc.close()
+
+
+def segmentar_pdf(pdf_bytes: bytes, clasificaciones: List[Dict]) -> List[Dict]:
+    """
+    Segmenta un PDF en múltiples documentos según las clasificaciones.
+    Retorna lista de documentos segmentados con sus metadatos.
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [
+            {
+                "tipo": tipo,
+                "paginas": list(range(inicio + 1, fin + 2)),
+                "pdf_bytes": _serializar_rango(doc, inicio, fin)
+            }
+            for tipo, inicio, fin in rangos_segmentos(clasificaciones)
+        ]
+    finally:
+        doc.close()
@@ -3,13 +3,19 @@ import time
 import os
 import fitz
 import logging
-from typing import Dict, List, Any
-from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from config.settings import get_settings, calcular_timeout_calidad
-from middleware import suprimir_prints
+from schemas import Alerta, DocumentoFinal
 from services.quality_engine import paso_1_analizar_documento, paso_2_corregir_rotacion
-from services.classification_engine import clasificar_documento_completo, segmentar_pdf
+from services.classification_engine import (
+    clasificar_documento_completo, recortar_header, segmentar_pdf,
+    rangos_segmentos, serializar_segmento_compartido
+)
 from services.azure_service import verificar_modelo_entrenado, extraer_datos_con_modelo
 
 logger = logging.getLogger(__name__)
@@ -28,21 +34,136 @@ DOCUMENT_TYPE_TO_MODEL = {
     "UNKNOWN_DOCUMENT": None
 }
 
-executor = ThreadPoolExecutor(max_workers=min(settings.EXECUTOR_MAX_WORKERS, (os.cpu_count() or 1) * 4))
+# Las etapas CPU (calidad con OpenCV/PyMuPDF y segmentación) corren en procesos
+# separados para no competir por el GIL entre requests concurrentes.
+# "spawn" evita heredar por fork los hilos y conexiones del proceso del servidor.
+def _crear_process_executor() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=settings.PROCESS_POOL_WORKERS or os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+process_executor = _crear_process_executor()
+
+
+async def _ejecutar_en_proceso(fn, *args):
+    """
+    Ejecuta fn en el pool de procesos. Si un worker murió (OOM, crash de una librería
+    nativa) el pool queda inutilizable: se reemplaza por uno nuevo y se reintenta una vez.
+    """
+    global process_executor
+    loop = asyncio.get_running_loop()
+    executor = process_executor
+    try:
+        return await loop.run_in_executor(executor, fn, *args)
+    except BrokenProcessPool:
+        # Con varias tareas fallando a la vez, solo la primera recrea el pool
+        if process_executor is executor:
+            logger.warning("Pool de procesos roto, se crea uno nuevo")
+            process_executor = _crear_process_executor()
+            executor.shutdown(wait=False, cancel_futures=True)
+        return await loop.run_in_executor(process_executor, fn, *args)
+
+
+def cerrar_process_executor() -> None:
+    """Detiene el pool de procesos vigente (al apagar la app)."""
+    process_executor.shutdown(wait=False, cancel_futures=True)
 
 def _procesar_calidad_sync(pdf_bytes: bytes) -> tuple:
-    """Función síncrona interna para procesamiento de calidad."""
+    """
+    Función síncrona interna para procesamiento de calidad. Con el documento ya
+    abierto se genera también el PDF de encabezados para clasificación, sin volver a
+    parsearlo. Retorna (pdf_bytes, resultados_paso_1, pdf_recortado).
+    """
     pdf_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    
-    with suprimir_prints():
+    try:
         resultados_paso_1 = paso_1_analizar_documento(pdf_doc)
         paginas_corregidas = paso_2_corregir_rotacion(pdf_doc, resultados_paso_1)
-    
-    if paginas_corregidas > 0:
-        pdf_bytes = pdf_doc.tobytes()
-    
-    pdf_doc.close()
-    return pdf_bytes, resultados_paso_1
+        
+        if paginas_corregidas > 0:
+            pdf_bytes = pdf_doc.tobytes()
+        
+        # El recorte modifica el documento: va después de serializar el PDF corregido
+        pdf_recortado = recortar_header(pdf_doc)
+    finally:
+        pdf_doc.close()
+    return pdf_bytes, resultados_paso_1, pdf_recortado
+
+
+# Orientaciones de páginas escaneadas que no generan alerta
+_ORIENTACIONES_SIN_ALERTA = frozenset({'NORMAL', 'SIN TEXTO', 'SIN IMAGEN'})
+
+
+def _alertas_por_pagina(resultados_paso_1: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """Alertas de calidad por número de página (solo páginas con alguna alerta)."""
+    alertas_por_pagina: Dict[int, List[Dict[str, Any]]] = {}
+    for resultado in resultados_paso_1:
+        pagina = resultado['pagina']
+        orientacion = resultado['orientacion']
+        escaneada = resultado['escaneada']
+
+        if escaneada:
+            if 'INCLINADA' in orientacion:
+                alertas_por_pagina.setdefault(pagina, []).append({
+                    "pagina": pagina,
+                    "tipo": "inclinado",
+                    "descripcion": f"Página escaneada {orientacion}"
+                })
+            elif orientacion not in _ORIENTACIONES_SIN_ALERTA:
+                alertas_por_pagina.setdefault(pagina, []).append({
+                    "pagina": pagina,
+                    "tipo": "escaneado",
+                    "descripcion": f"Página escaneada: {orientacion}"
+                })
+
+        if resultado['rotacion_formal'] != 0:
+            alertas_por_pagina.setdefault(pagina, []).append({
+                "pagina": pagina,
+                "tipo": "rotado",
+                "descripcion": f"Rotación de {resultado['rotacion_formal']}° corregida"
+            })
+
+        if not escaneada and orientacion == 'ROTADA':
+            alertas_por_pagina.setdefault(pagina, []).append({
+                "pagina": pagina,
+                "tipo": "rotado",
+                "descripcion": "Texto vertical corregido"
+            })
+
+    return alertas_por_pagina
+
+
+# Desde esta cantidad de segmentos, cada uno se serializa en un proceso distinto
+SEGMENTOS_EN_PARALELO_MIN = 4
+
+
+async def _segmentar(pdf_bytes: bytes, clasificaciones: List[Dict]) -> List[Dict]:
+    """
+    Segmenta el PDF en el pool de procesos. Con pocos segmentos se hace en una sola
+    tarea; con SEGMENTOS_EN_PARALELO_MIN o más, cada segmento se serializa en paralelo
+    y los procesos leen el PDF origen desde memoria compartida (se copia una sola vez).
+    """
+    rangos = rangos_segmentos(clasificaciones)
+    if len(rangos) < SEGMENTOS_EN_PARALELO_MIN:
+        return await _ejecutar_en_proceso(segmentar_pdf, pdf_bytes, clasificaciones)
+
+    tamano = len(pdf_bytes)
+    memoria = shared_memory.SharedMemory(create=True, size=tamano)
+    try:
+        memoria.buf[:tamano] = pdf_bytes
+        pdfs = await asyncio.gather(*(
+            _ejecutar_en_proceso(serializar_segmento_compartido, memoria.name, tamano, inicio, fin)
+            for _, inicio, fin in rangos
+        ))
+    finally:
+        memoria.close()
+        memoria.unlink()
+
+    return [
+        {"tipo": tipo, "paginas": list(range(inicio + 1, fin + 2)), "pdf_bytes": pdf}
+        for (tipo, inicio, fin), pdf in zip(rangos, pdfs)
+    ]
 
 
 async def clasificar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict[str, Any]:
@@ -58,68 +179,25 @@ async def clasificar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict
         logger.info(f"Iniciando procesamiento de calidad para {nombre_archivo} ({num_paginas} páginas, timeout={timeout_calidad}s)")
         start_time = time.time()
 
-        loop = asyncio.get_event_loop()
-        pdf_bytes, resultados_paso_1 = await asyncio.wait_for(
-            loop.run_in_executor(
-                executor,
-                _procesar_calidad_sync,
-                pdf_bytes
-            ),
+        pdf_bytes, resultados_paso_1, pdf_recortado = await asyncio.wait_for(
+            _ejecutar_en_proceso(_procesar_calidad_sync, pdf_bytes),
             timeout=timeout_calidad
         )
 
         elapsed_time = time.time() - start_time
         logger.info(f"Procesamiento de calidad completado para {nombre_archivo} en {elapsed_time:.2f}s")
 
-        clasificaciones = await clasificar_documento_completo(pdf_bytes)
-
-        logger.info(f"Iniciando segmentación para {nombre_archivo}")
-        start_time = time.time()
-
-        documentos_segmentados = await loop.run_in_executor(
-            executor,
-            segmentar_pdf,
-            pdf_bytes,
-            clasificaciones
-        )
+        clasificaciones = await clasificar_documento_completo(pdf_recortado, num_paginas)
 
-        elapsed_time = time.time() - start_time
-        logger.info(f"Segmentación completada para {nombre_archivo} en {elapsed_time:.2f}s - {len(documentos_segmentados)} documentos")
+        # Solo se necesitan los rangos de páginas: los PDF de cada segmento no se
+        # incluyen en el resultado, así que no se serializan
+        documentos_segmentados = [
+            {"tipo": tipo, "paginas": list(range(inicio + 1, fin + 2))}
+            for tipo, inicio, fin in rangos_segmentos(clasificaciones)
+        ]
+        logger.info(f"Segmentación completada para {nombre_archivo} - {len(documentos_segmentados)} documentos")
 
-        alertas_por_documento = {}
-        for resultado in resultados_paso_1:
-            alertas = []
-
-            if resultado['escaneada']:
-                if 'INCLINADA' in resultado['orientacion']:
-                    alertas.append({
-                        "pagina": resultado['pagina'],
-                        "tipo": "inclinado",
-                        "descripcion": f"Página escaneada {resultado['orientacion']}"
-                    })
-                elif resultado['orientacion'] not in ['NORMAL', 'SIN TEXTO', 'SIN IMAGEN']:
-                    alertas.append({
-                        "pagina": resultado['pagina'],
-                        "tipo": "escaneado",
-                        "descripcion": f"Página escaneada: {resultado['orientacion']}"
-                    })
-
-            if resultado['rotacion_formal'] != 0:
-                alertas.append({
-                    "pagina": resultado['pagina'],
-                    "tipo": "rotado",
-                    "descripcion": f"Rotación de {resultado['rotacion_formal']}° corregida"
-                })
-
-            if not resultado['escaneada'] and resultado['orientacion'] == 'ROTADA':
-                alertas.append({
-                    "pagina": resultado['pagina'],
-                    "tipo": "rotado",
-                    "descripcion": "Texto vertical corregido"
-                })
-
-            if alertas:
-                alertas_por_documento[resultado['pagina']] = alertas
+        alertas_por_documento = _alertas_por_pagina(resultados_paso_1)
 
         documentos_finales = []
         for idx, doc_seg in enumerate(documentos_segmentados):
@@ -135,7 +213,6 @@ async def clasificar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict
                 "nombre_salida": nombre_salida,
                 "tipo": doc_seg['tipo'],
                 "paginas": doc_seg['paginas'],
-                "pdf_bytes": doc_seg['pdf_bytes'],
                 "alertas": alertas_segmento if alertas_segmento else None,
                 "datos_extraidos": None
             })
@@ -162,6 +239,21 @@ async def clasificar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict
         }
 
 
+# Límite global de extracciones concurrentes: los segmentos de todos los PDF en curso
+# comparten la cuota de Azure DI
+_semaforo_extracciones = asyncio.Semaphore(max(settings.MAX_CONCURRENT_EXTRACCIONES, 1))
+
+
+async def _extraer_datos_segmento(pdf_bytes: bytes, model_id: str) -> Optional[Dict[str, Any]]:
+    """Extrae los datos de un segmento con el modelo custom (None si falla)."""
+    try:
+        async with _semaforo_extracciones:
+            return await extraer_datos_con_modelo(pdf_bytes, model_id)
+    except Exception as e:
+        logger.error(f"Error extrayendo datos: {str(e)}")
+        return None
+
+
 async def procesar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict[str, Any]:
     """Flujo completo de procesamiento de PDF."""
     timeout_calidad = 0
@@ -175,68 +267,37 @@ async def procesar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict[s
         logger.info(f"Iniciando procesamiento de calidad para {nombre_archivo} ({num_paginas} páginas, timeout={timeout_calidad}s)")
         start_time = time.time()
 
-        loop = asyncio.get_event_loop()
-        pdf_bytes, resultados_paso_1 = await asyncio.wait_for(
-            loop.run_in_executor(
-                executor,
-                _procesar_calidad_sync,
-                pdf_bytes
-            ),
+        pdf_bytes, resultados_paso_1, pdf_recortado = await asyncio.wait_for(
+            _ejecutar_en_proceso(_procesar_calidad_sync, pdf_bytes),
             timeout=timeout_calidad
         )
 
         elapsed_time = time.time() - start_time
         logger.info(f"Procesamiento de calidad completado para {nombre_archivo} en {elapsed_time:.2f}s")
 
-        clasificaciones = await clasificar_documento_completo(pdf_bytes)
+        clasificaciones = await clasificar_documento_completo(pdf_recortado, num_paginas)
 
         logger.info(f"Iniciando segmentación para {nombre_archivo}")
         start_time = time.time()
 
-        documentos_segmentados = await loop.run_in_executor(
-            executor,
-            segmentar_pdf,
-            pdf_bytes,
-            clasificaciones
-        )
+        documentos_segmentados = await _segmentar(pdf_bytes, clasificaciones)
 
         elapsed_time = time.time() - start_time
         logger.info(f"Segmentación completada para {nombre_archivo} en {elapsed_time:.2f}s - {len(documentos_segmentados)} documentos")
 
-        alertas_por_documento = {}
-        for resultado in resultados_paso_1:
-            alertas = []
-
-            if resultado['escaneada']:
-                if 'INCLINADA' in resultado['orientacion']:
-                    alertas.append({
-                        "pagina": resultado['pagina'],
-                        "tipo": "inclinado",
-                        "descripcion": f"Página escaneada {resultado['orientacion']}"
-                    })
-                elif resultado['orientacion'] not in ['NORMAL', 'SIN TEXTO', 'SIN IMAGEN']:
-                    alertas.append({
-                        "pagina": resultado['pagina'],
-                        "tipo": "escaneado",
-                        "descripcion": f"Página escaneada: {resultado['orientacion']}"
-                    })
-
-            if resultado['rotacion_formal'] != 0:
-                alertas.append({
-                    "pagina": resultado['pagina'],
-                    "tipo": "rotado",
-                    "descripcion": f"Rotación de {resultado['rotacion_formal']}° corregida"
-                })
+        alertas_por_documento = _alertas_por_pagina(resultados_paso_1)
 
-            if not resultado['escaneada'] and resultado['orientacion'] == 'ROTADA':
-                alertas.append({
-                    "pagina": resultado['pagina'],
-                    "tipo": "rotado",
-                    "descripcion": "Texto vertical corregido"
-                })
+        # Cada modelo se verifica una vez y los segmentos se extraen en paralelo
+        modelos_por_segmento = [DOCUMENT_TYPE_TO_MODEL.get(doc_seg['tipo']) for doc_seg in documentos_segmentados]
+        modelos = list({model_id for model_id in modelos_por_segmento if model_id})
+        entrenados = dict(zip(modelos, await asyncio.gather(*map(verificar_modelo_entrenado, modelos))))
 
-            if alertas:
-                alertas_por_documento[resultado['pagina']] = alertas
+        extracciones = {
+            idx: _extraer_datos_segmento(doc_seg['pdf_bytes'], model_id)
+            for idx, (doc_seg, model_id) in enumerate(zip(documentos_segmentados, modelos_por_segmento))
+            if model_id and entrenados[model_id]
+        }
+        datos_por_segmento = dict(zip(extracciones, await asyncio.gather(*extracciones.values())))
 
         documentos_finales = []
         for idx, doc_seg in enumerate(documentos_segmentados):
@@ -247,30 +308,13 @@ async def procesar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict[s
 
             nombre_salida = f"{nombre_archivo.replace('.pdf', '')}_{doc_seg['tipo']}_{idx+1}.pdf"
 
-            tipo_documento = doc_seg['tipo']
-            model_id = DOCUMENT_TYPE_TO_MODEL.get(tipo_documento)
-
-            datos_extraidos = None
-
-            if model_id:
-                try:
-                    modelo_entrenado = await verificar_modelo_entrenado(model_id)
-
-                    if modelo_entrenado:
-                        datos_extraidos = await extraer_datos_con_modelo(
-                            doc_seg['pdf_bytes'],
-                            model_id
-                        )
-                except Exception as e:
-                    logger.error(f"Error extrayendo datos: {str(e)}")
-                    datos_extraidos = None
+            datos_extraidos = datos_por_segmento.get(idx)
 
             documentos_finales.append({
                 "archivo_origen": nombre_archivo,
                 "nombre_salida": nombre_salida,
                 "tipo": doc_seg['tipo'],
                 "paginas": doc_seg['paginas'],
-                "pdf_bytes": doc_seg['pdf_bytes'],
                 "alertas": alertas_segmento if alertas_segmento else None,
                 "datos_extraidos": datos_extraidos
             })
@@ -298,15 +342,32 @@ async def procesar_pdf_completo(pdf_bytes: bytes, nombre_archivo: str) -> Dict[s
 
 
 def serializar_documentos_para_cache(documentos: List[Dict]) -> List[Dict]:
-    """Prepara documentos para almacenamiento en caché (sin pdf_bytes)."""
+    """
+    Prepara documentos para respuesta y caché. `datos_extraidos`
+    ya viene limpio desde azure_service, así que no se vuelve a recorrer.
+    """
     return [
         {
             "archivo_origen": doc["archivo_origen"],
             "nombre_salida": doc["nombre_salida"],
             "tipo": doc["tipo"],
             "paginas": doc["paginas"],
-            "alertas": doc.get("alertas"),
-            "datos_extraidos": doc.get("datos_extraidos")
+            "alertas": doc.get("alertas") or None,
+            "datos_extraidos": doc.get("datos_extraidos") or None
         }
         for doc in documentos
     ]
+
+
+def documentos_respuesta(docs_dicts: List[Dict]) -> List[DocumentoFinal]:
+    """
+    Construye los structs de respuesta desde `serializar_documentos_para_cache` (sin
+    validación: los datos vienen del pipeline propio).
+    """
+    return [
+        DocumentoFinal(**{
+            **d,
+            "alertas": [Alerta(**a) for a in d["alertas"]] if d["alertas"] else None,
+        })
+        for d in docs_dicts
+    ]
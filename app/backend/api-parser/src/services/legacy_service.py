@@ -10,6 +10,31 @@ BASE_URL = "https://backend.juanleon.cl"
 ENDPOINT_DESPACHO = "/api/admin/despachos/{codigo}"
 ENDPOINT_DOCUMENTOS = "/api/admin/documentos64/despacho/{codigo_visible}"
 
+# Cliente compartido: las consultas de detalle y documentación de cada despacho (y sus
+# reintentos) reutilizan conexiones y sesiones TLS con el backend legacy
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_legacy_client() -> httpx.AsyncClient:
+    """Retorna el cliente HTTP compartido para el backend legacy (se crea en el primer uso)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            http2=True,
+        )
+    return _client
+
+
+async def close_legacy_client() -> None:
+    """Cierra el cliente compartido del backend legacy."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=2, max=10),
@@ -19,7 +44,7 @@ async def consultar_despacho_detalle(codigo_interno: str, token: str) -> Optiona
     if not token:
         return None
     
-    url = f"{BASE_URL}{ENDPOINT_DESPACHO.format(codigo=str(codigo_interno))}"
+    url = ENDPOINT_DESPACHO.format(codigo=str(codigo_interno))
     headers = {
         "Accept": "application/json",
         "Authorization": f"Bearer {token}"
@@ -33,15 +58,14 @@ async def consultar_despacho_detalle(codigo_interno: str, token: str) -> Optiona
     )
     
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            
-            if 'application/json' not in response.headers.get('Content-Type', ''):
-                return None
-            
-            datos = response.json()
-            return datos if isinstance(datos, dict) else None
+        response = await get_legacy_client().get(url, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        
+        if 'application/json' not in response.headers.get('Content-Type', ''):
+            return None
+        
+        datos = response.json()
+        return datos if isinstance(datos, dict) else None
     except (httpx.TimeoutException, httpx.NetworkError):
         raise
     except Exception:
@@ -57,7 +81,7 @@ async def consultar_documentacion(codigo: str, token: str) -> Optional[List]:
     if not token:
         return None
     
-    url = f"{BASE_URL}{ENDPOINT_DOCUMENTOS.format(codigo_visible=str(codigo))}"
+    url = ENDPOINT_DOCUMENTOS.format(codigo_visible=str(codigo))
     headers = {
         "Accept": "application/json",
         "Authorization": f"Bearer {token}"
@@ -71,19 +95,18 @@ async def consultar_documentacion(codigo: str, token: str) -> Optional[List]:
     )
     
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            
-            if 'application/json' not in response.headers.get('Content-Type', ''):
-                return None
-            
-            datos_json = response.json()
-            if not isinstance(datos_json, dict):
-                return None
-            
-            documentos = datos_json.get("data", [])
-            return documentos if isinstance(documentos, list) else None
+        response = await get_legacy_client().get(url, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        
+        if 'application/json' not in response.headers.get('Content-Type', ''):
+            return None
+        
+        datos_json = response.json()
+        if not isinstance(datos_json, dict):
+            return None
+        
+        documentos = datos_json.get("data", [])
+        return documentos if isinstance(documentos, list) else None
     except (httpx.TimeoutException, httpx.NetworkError):
         raise
     except Exception:
@@ -17,8 +17,10 @@ from litestar.exceptions import HTTPException
 from litestar.status_codes import HTTP_400_BAD_REQUEST, HTTP_408_REQUEST_TIMEOUT
 import logging
 from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
 
 from config.settings import get_settings, calcular_timeout_excel
+from utils.validators import extension_archivo, validar_excel, validar_imagen, validar_pdf
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -30,6 +32,10 @@ try:
 except Exception:
     FUENTE_PRINCIPAL = 'Helvetica'
 
+# Versión de la conversión a PDF: incrementarla invalida en caché los resultados de
+# archivos Excel/imagen convertidos con una versión anterior
+CONVERSOR_VERSION = "1"
+
 # Executor (Normally passed or shared, but recreated here for simplicity if not injected)
 # Ideally we should use a shared executor
 executor = ThreadPoolExecutor(max_workers=min(settings.EXECUTOR_MAX_WORKERS, (os.cpu_count() or 1) * 4))
@@ -162,7 +168,8 @@ def _convertir_imagen_a_pdf_sync(imagen_bytes: bytes, nombre_archivo: str) -> by
 
         if imagen.mode == 'RGBA':
             fondo = Image.new('RGB', imagen.size, (255, 255, 255))
-            fondo.paste(imagen, mask=imagen.split()[3])
+            # getchannel extrae solo el alfa; split() copiaba las cuatro bandas
+            fondo.paste(imagen, mask=imagen.getchannel('A'))
             imagen = fondo
         elif imagen.mode != 'RGB':
             imagen = imagen.convert('RGB')
@@ -183,7 +190,8 @@ def _convertir_imagen_a_pdf_sync(imagen_bytes: bytes, nombre_archivo: str) -> by
         y = (alto_pagina - alto_final) / 2
 
         buffer = io.BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
+        # invariant: sin fecha ni ID aleatorio, el mismo contenido produce los mismos bytes
+        c = canvas.Canvas(buffer, pagesize=A4, invariant=1)
 
         img_reader = ImageReader(imagen)
         c.drawImage(img_reader, x, y, width=ancho_final, height=alto_final, preserveAspectRatio=True)
@@ -201,12 +209,12 @@ def _convertir_imagen_a_pdf_sync(imagen_bytes: bytes, nombre_archivo: str) -> by
 def _convertir_excel_a_pdf_sync(excel_bytes: bytes, nombre_archivo: str) -> bytes:
     """Función síncrona interna para conversión Excel a PDF con soporte avanzado."""
     try:
-        extension = os.path.splitext(nombre_archivo.lower())[1]
+        extension = extension_archivo(nombre_archivo)
 
         df_dict = None
         errores = []
 
-        if extension in ['.xlsx', '.xlsm']:
+        if extension in ('.xlsx', '.xlsm'):
             try:
                 df_dict = pd.read_excel(io.BytesIO(excel_bytes), sheet_name=None, engine='openpyxl', header=None)
             except Exception as e1:
@@ -249,7 +257,8 @@ def _convertir_excel_a_pdf_sync(excel_bytes: bytes, nombre_archivo: str) -> byte
             leftMargin=0.3*inch,
             rightMargin=0.3*inch,
             topMargin=0.4*inch,
-            bottomMargin=0.4*inch
+            bottomMargin=0.4*inch,
+            invariant=1
         )
 
         elements = []
@@ -389,3 +398,18 @@ async def convertir_imagen_a_pdf(imagen_bytes: bytes, nombre_archivo: str) -> by
             status_code=HTTP_408_REQUEST_TIMEOUT,
             detail=f"Conversión imagen excedió el tiempo límite de {timeout}s"
         )
+
+
+class Formato(NamedTuple):
+    """Cómo validar y llevar a PDF un tipo de archivo aceptado."""
+    validador: Callable[[bytes, str], bool]
+    conversor: Optional[Callable[[bytes, str], Awaitable[bytes]]]
+    mensaje_invalido: str
+
+
+# Tipo de archivo (ver utils.validators.tipo_archivo) -> validación y conversión
+FORMATOS: Dict[str, Formato] = {
+    "pdf": Formato(validar_pdf, None, "El archivo no es un PDF válido"),
+    "excel": Formato(validar_excel, convertir_excel_a_pdf, "El archivo no es un Excel válido"),
+    "imagen": Formato(validar_imagen, convertir_imagen_a_pdf, "El archivo no es una imagen válida"),
+}
@@ -145,31 +145,32 @@ def analizar_pdf_completo(doc):
     return resultados
 
 
-def paso_1_analizar_documento(doc):
+def paso_1_analizar_documento(doc, verbose=False):
     """PASO 1: Analiza orientación y tipo de páginas del documento."""
-    print("=" * 60)
-    print("PASO 1: ANÁLISIS DE DOCUMENTO")
-    print("=" * 60)
-    print()
-    
     resultados = analizar_pdf_completo(doc)
     
-    for r in resultados:
-        tipo = "ESCANEADA" if r['escaneada'] else "DIGITAL"
-        print(f"Página {r['pagina']}: {tipo} ({r['num_imagenes']} imágenes)")
-        print(f"  Rotación: {r['rotacion_formal']}°")
-        print(f"  Orientación: {r['orientacion']}")
+    if verbose:
+        print("=" * 60)
+        print("PASO 1: ANÁLISIS DE DOCUMENTO")
+        print("=" * 60)
         print()
+        for r in resultados:
+            tipo = "ESCANEADA" if r['escaneada'] else "DIGITAL"
+            print(f"Página {r['pagina']}: {tipo} ({r['num_imagenes']} imágenes)")
+            print(f"  Rotación: {r['rotacion_formal']}°")
+            print(f"  Orientación: {r['orientacion']}")
+            print()
     
     return resultados
 
 
-def paso_2_corregir_rotacion(doc, resultados_paso_1):
+def paso_2_corregir_rotacion(doc, resultados_paso_1, verbose=False):
     """PASO 2: Corrige la rotación de páginas rotadas."""
-    print("=" * 60)
-    print("PASO 2: CORRECCIÓN DE ROTACIÓN")
-    print("=" * 60)
-    print()
+    if verbose:
+        print("=" * 60)
+        print("PASO 2: CORRECCIÓN DE ROTACIÓN")
+        print("=" * 60)
+        print()
     
     paginas_corregidas = 0
     
@@ -181,20 +182,23 @@ def paso_2_corregir_rotacion(doc, resultados_paso_1):
         if resultado['rotacion_formal'] != 0:
             pagina.set_rotation(0)
             paginas_corregidas += 1
-            print(f"Página {resultado['pagina']}: Rotación formal {resultado['rotacion_formal']}° corregida")
+            if verbose:
+                print(f"Página {resultado['pagina']}: Rotación formal {resultado['rotacion_formal']}° corregida")
         
         # Corregir páginas digitales rotadas (texto vertical)
         elif not resultado['escaneada'] and resultado['orientacion'] == "ROTADA":
             # Rotar 90° en sentido horario para páginas con texto vertical
             pagina.set_rotation(270)
             paginas_corregidas += 1
-            print(f"Página {resultado['pagina']}: Texto vertical corregido (rotación 270°)")
+            if verbose:
+                print(f"Página {resultado['pagina']}: Texto vertical corregido (rotación 270°)")
     
-    print()
-    if paginas_corregidas > 0:
-        print(f"Total de páginas corregidas: {paginas_corregidas}")
-    else:
-        print("No se encontraron páginas que requieran corrección de rotación.")
+    if verbose:
+        print()
+        if paginas_corregidas > 0:
+            print(f"Total de páginas corregidas: {paginas_corregidas}")
+        else:
+            print("No se encontraron páginas que requieran corrección de rotación.")
     
     return paginas_corregidas
 
@@ -215,10 +219,10 @@ if __name__ == "__main__":
     
     try:
         # PASO 1: Análisis de documento
-        resultados_paso_1 = paso_1_analizar_documento(doc)
+        resultados_paso_1 = paso_1_analizar_documento(doc, verbose=True)
         
         # PASO 2: Corrección de rotación
-        paginas_corregidas = paso_2_corregir_rotacion(doc, resultados_paso_1)
+        paginas_corregidas = paso_2_corregir_rotacion(doc, resultados_paso_1, verbose=True)
 
     except Exception as e:
         print(f"Error: {str(e)}", file=sys.stderr)
@@ -2,21 +2,57 @@
 Gestor de tokens API con persistencia en archivo JSON.
 Permite listar, crear y eliminar tokens de autenticación.
 """
+import hashlib
 import json
 import os
 import secrets
+import time
 from datetime import datetime
 from typing import Dict, List, Optional
 from pathlib import Path
 
+# Intervalo mínimo (segundos) entre escrituras de last_used para un mismo token
+LAST_USED_PERSIST_INTERVAL = 60.0
+
+
+def _hash_token(token: str) -> str:
+    """Hash del token usado como clave del índice en memoria."""
+    return hashlib.blake2b(token.encode(), digest_size=32).hexdigest()
+
 
 class TokenManager:
     """Gestiona tokens API con almacenamiento en archivo JSON."""
 
     def __init__(self, tokens_file: str = "tokens.json"):
         self.tokens_file = Path(tokens_file)
+        # Índice hash(token) -> id de los tokens activos; se recarga solo si el
+        # archivo cambia (p. ej. escrito por otro worker)
+        self._index: Dict[str, str] = {}
+        self._index_mtime: Optional[int] = None
+        self._last_used_saved: Dict[str, float] = {}
         self._ensure_file_exists()
 
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return self.tokens_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _build_index(self, tokens: Dict):
+        """Reconstruye el índice de tokens activos."""
+        self._index = {
+            _hash_token(token_value): metadata.get("id")
+            for token_value, metadata in tokens.items()
+            if metadata.get("is_active", True)
+        }
+
+    def _refresh_index(self):
+        """Recarga el índice si el archivo fue modificado desde la última lectura."""
+        mtime = self._file_mtime()
+        if mtime != self._index_mtime:
+            self._build_index(self._load_tokens())
+            self._index_mtime = mtime
+
     def _ensure_file_exists(self):
         """Crea el archivo de tokens si no existe."""
         if not self.tokens_file.exists():
@@ -34,6 +70,8 @@ class TokenManager:
         """Guarda los tokens en el archivo JSON."""
         with open(self.tokens_file, 'w', encoding='utf-8') as f:
             json.dump(tokens, f, indent=2, ensure_ascii=False)
+        self._build_index(tokens)
+        self._index_mtime = self._file_mtime()
 
     def list_tokens(self) -> List[Dict]:
         """
@@ -151,17 +189,19 @@ class TokenManager:
         Returns:
             True si el token es válido, False en caso contrario
         """
-        tokens = self._load_tokens()
-        metadata = tokens.get(token)
-
-        if metadata and metadata.get("is_active", True):
-            # Actualizar último uso
-            metadata["last_used"] = datetime.utcnow().isoformat()
-            tokens[token] = metadata
-            self._save_tokens(tokens)
-            return True
-
-        return False
+        self._refresh_index()
+        token_hash = _hash_token(token)
+        if token_hash not in self._index:
+            return False
+
+        # last_used se persiste como máximo una vez por intervalo y token
+        now = time.monotonic()
+        last_saved = self._last_used_saved.get(token_hash)
+        if last_saved is None or now - last_saved >= LAST_USED_PERSIST_INTERVAL:
+            self._last_used_saved[token_hash] = now
+            self.update_last_used(token)
+
+        return True
 
     def update_last_used(self, token: str):
         """
@@ -2,7 +2,9 @@ import os
 import fitz
 import io
 import pandas as pd
+from typing import AsyncIterator, Optional
 from PIL import Image
+from litestar.datastructures import UploadFile
 from litestar.exceptions import HTTPException
 from litestar.status_codes import HTTP_413_REQUEST_ENTITY_TOO_LARGE
 
@@ -10,9 +12,42 @@ from config.settings import get_settings
 
 settings = get_settings()
 
-def validar_pdf(file_bytes: bytes) -> bool:
-    """Valida que los bytes sean un PDF válido."""
-    if not file_bytes.startswith(b'%PDF'):
+# Tamaño de bloque para leer uploads (el archivo ya está en un SpooledTemporaryFile)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+EXTENSIONES_EXCEL = frozenset({'.xls', '.xlsx', '.xlsm', '.xlsb', '.xltx', '.xltm'})
+EXTENSIONES_IMAGEN = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp'})
+
+# Extensión (en minúsculas) -> tipo de archivo aceptado
+TIPO_POR_EXTENSION = {
+    '.pdf': 'pdf',
+    **{ext: 'excel' for ext in EXTENSIONES_EXCEL},
+    **{ext: 'imagen' for ext in EXTENSIONES_IMAGEN},
+}
+
+# Firmas esperadas por extensión de Excel
+_EXCEL_ZIP = frozenset({'.xlsx', '.xlsm', '.xltx', '.xltm'})
+_EXCEL_OLE = frozenset({'.xls', '.xlsb'})
+
+_FIRMA_PDF = b'%PDF'
+_FIRMA_ZIP = b'PK\x03\x04'
+_FIRMA_OLE = b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'
+
+
+def extension_archivo(nombre_archivo: str) -> str:
+    """Extensión en minúsculas (solo se normaliza el sufijo, no el nombre completo)."""
+    return os.path.splitext(nombre_archivo)[1].lower()
+
+
+def nombre_pdf(nombre_archivo: str) -> str:
+    """Nombre con la extensión reemplazada por .pdf (se agrega si no tiene extensión)."""
+    i = nombre_archivo.rfind('.')
+    return (nombre_archivo[:i] if i >= 0 else nombre_archivo) + '.pdf'
+
+
+def validar_pdf(file_bytes: bytes, nombre_archivo: str = "") -> bool:
+    """Valida que los bytes sean un PDF válido (el nombre se acepta por uniformidad)."""
+    if not file_bytes.startswith(_FIRMA_PDF):
         return False
     try:
         doc = fitz.open(stream=file_bytes, filetype="pdf")
@@ -22,16 +57,34 @@ def validar_pdf(file_bytes: bytes) -> bool:
         return False
 
 
+def _firma_excel_valida(cabecera: bytes, extension: str) -> bool:
+    """Verifica la firma (ZIP u OLE) esperada para la extensión de Excel."""
+    if extension in _EXCEL_ZIP:
+        return cabecera.startswith(_FIRMA_ZIP)
+    if extension in _EXCEL_OLE:
+        return cabecera.startswith(_FIRMA_OLE)
+    return True
+
+
+def firma_valida(cabecera: bytes, tipo: str, nombre_archivo: str) -> bool:
+    """
+    Verifica solo los primeros bytes de un archivo contra la firma de su tipo. Permite
+    descartar un archivo inválido sin leerlo completo; las imágenes se aceptan siempre
+    (la variedad de formatos se valida con PIL sobre el archivo completo).
+    """
+    if tipo == 'pdf':
+        return cabecera.startswith(_FIRMA_PDF)
+    if tipo == 'excel':
+        return _firma_excel_valida(cabecera, extension_archivo(nombre_archivo))
+    return True
+
+
 def validar_excel(file_bytes: bytes, nombre_archivo: str) -> bool:
     """Valida que los bytes sean un archivo Excel válido."""
-    extension = os.path.splitext(nombre_archivo.lower())[1]
+    extension = extension_archivo(nombre_archivo)
     
-    if extension in ['.xlsx', '.xlsm', '.xltx', '.xltm']:
-        if not file_bytes.startswith(b'PK\x03\x04'):
-            return False
-    elif extension in ['.xls', '.xlsb']:
-        if not file_bytes.startswith(b'\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1'):
-            return False
+    if not _firma_excel_valida(file_bytes, extension):
+        return False
     
     try:
         engine = 'xlrd' if extension == '.xls' else 'openpyxl'
@@ -51,18 +104,44 @@ def validar_tamano_archivo(file_bytes: bytes) -> None:
         )
 
 
-def es_archivo_excel(nombre_archivo: str) -> bool:
-    """Verifica si un archivo es Excel basándose en su extensión."""
-    extensiones_excel = ['.xls', '.xlsx', '.xlsm', '.xlsb', '.xltx', '.xltm']
-    extension = os.path.splitext(nombre_archivo.lower())[1]
-    return extension in extensiones_excel
+# Margen para el overhead multipart (boundaries y headers de cada parte)
+_MARGEN_MULTIPART = 64 * 1024
+
+
+def validar_content_length(content_length: Optional[str]) -> None:
+    """
+    Rechaza con 413 un request cuyo Content-Length declarado excede el máximo,
+    antes de que se lea el body. Sin header (chunked) se valida al leer el archivo.
+    """
+    if not content_length or not content_length.isdigit():
+        return
+    if int(content_length) > settings.MAX_FILE_SIZE_MB * 1024 * 1024 + _MARGEN_MULTIPART:
+        raise HTTPException(
+            status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Archivo excede el tamaño máximo de {settings.MAX_FILE_SIZE_MB}MB"
+        )
+
+
+async def iterar_archivo(data: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Lee un upload por bloques, validando el tamaño máximo a medida que avanza.
+    Un archivo demasiado grande se rechaza sin terminar de leerlo.
+    """
+    max_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+    leidos = 0
+    while chunk := await data.read(chunk_size):
+        leidos += len(chunk)
+        if leidos > max_bytes:
+            raise HTTPException(
+                status_code=HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Archivo excede el tamaño máximo de {settings.MAX_FILE_SIZE_MB}MB"
+            )
+        yield chunk
 
 
-def es_archivo_imagen(nombre_archivo: str) -> bool:
-    """Verifica si un archivo es una imagen basándose en su extensión."""
-    extensiones_imagen = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp']
-    extension = os.path.splitext(nombre_archivo.lower())[1]
-    return extension in extensiones_imagen
+def tipo_archivo(nombre_archivo: str) -> Optional[str]:
+    """Retorna 'pdf', 'excel' o 'imagen' según la extensión, o None si no se acepta."""
+    return TIPO_POR_EXTENSION.get(extension_archivo(nombre_archivo))
 
 
 def validar_imagen(file_bytes: bytes, nombre_archivo: str) -> bool: